@@ -24,29 +24,41 @@ def decode_vin(vin):
         return None
 
 
-def parse_vin_response(response):
+def parse_vin_payload(payload):
     """
-    Parses a VIN response and returns a dictionary of vehicle information.
+    Extracts the VIN from a reassembled Mode 09 PID 02 payload.
+
+    CAN payloads are ``49 02 01`` followed by the 17 characters; the legacy
+    protocols pad the VIN with leading zero bytes instead of the item count,
+    so the VIN is always the last 17 bytes.
 
     Args:
-        response (str): The response string to parse.
+        payload (bytes): The payload, starting at the service byte.
 
     Returns:
-        dict: A dictionary containing information about the vehicle.
+        str: The 17-character VIN, or None if the payload is not a VIN.
     """
-    # Ensure the response has enough data
-    if len(response.split()) >= 18:
-        # Extract the 17-character VIN by concatenating the relevant bytes
-        vin_data = response.split()[4:]
-        vin = []
-        for data in vin_data:
-            if not data.endswith(":"):
-                char = chr(int(data, 16))
-                if char.isalnum():  # Check if the character is alphanumeric
-                    vin.append(char)
-        return "".join(vin)
-    else:
+    if len(payload) < 19 or bytes(payload[:2]) != b"\x49\x02":
         return None
+    vin = bytes(payload[-17:]).decode("ascii", "ignore")
+    return vin if vin.isalnum() else None
+
+
+def vin_from_messages(messages):
+    """
+    Extracts the VIN from parsed Mode 09 PID 02 messages.
+
+    Args:
+        messages (list): python-obd messages returned for ``0902``.
+
+    Returns:
+        str: The 17-character VIN, or None if no ECU answered.
+    """
+    for message in messages:
+        vin = parse_vin_payload(message.data)
+        if vin:
+            return vin
+    return None
 
 
 def get_vehicle_data_from_nhtsa(vin):
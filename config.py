@@ -2,6 +2,7 @@
 This module loads environment variables from the .env file.
 """
 import os
+import secrets
 from dotenv import load_dotenv
 
 # Load variables from .env file
@@ -42,6 +43,21 @@ baud_rate_str = os.getenv("BAUD_RATE")
 if baud_rate_str is None:
     raise ValueError("BAUD_RATE environment variable is not set")
 BAUD_RATE = int(baud_rate_str)
+OBD_BROKER_PORT = int(os.getenv("OBD_BROKER_PORT", "50327"))
+# The broker unpickles what its clients send, so its key must stay private:
+# without one configured, each run makes its own and hands it to the
+# processes it starts through the environment
+if not os.getenv("OBD_BROKER_AUTHKEY"):
+    os.environ["OBD_BROKER_AUTHKEY"] = secrets.token_hex(32)
+OBD_BROKER_AUTHKEY = os.environ["OBD_BROKER_AUTHKEY"].encode()
+OBD_CAPTURE_FILE = os.getenv("OBD_CAPTURE_FILE") or None
+DATASTREAM_RETENTION = float(os.getenv("DATASTREAM_RETENTION", "600"))
+DATASTREAM_SPILL_DIR = os.getenv("DATASTREAM_SPILL_DIR") or None
+DATASTREAM_PUSH_INTERVAL = float(os.getenv("DATASTREAM_PUSH_INTERVAL", "0.1"))
+DATASTREAM_MAX_FPS = float(os.getenv("DATASTREAM_MAX_FPS", "10"))
+ENGINE_DISPLACEMENT = float(os.getenv("ENGINE_DISPLACEMENT", "2.0"))
+DATASTREAM_SNAPSHOT_DIR = os.getenv("DATASTREAM_SNAPSHOT_DIR", "snapshots")
+DATASTREAM_RECORD_DIR = os.getenv("DATASTREAM_RECORD_DIR", "recordings")
 
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
@@ -0,0 +1,110 @@
+"""
+This module runs the datastream engine with a choice of front-end.
+
+Usage:
+    python -m datastreams --profile air-fuel --frontend web
+    python -m datastreams -p air-fuel -p misfire -p boost.json --frontend tk
+    python -m datastreams -p misfire --frontend headless --alerts
+    python -m datastreams -p air-fuel --rules shop_rules.json
+"""
+import argparse
+import time
+
+from datastreams.profiles import PROFILES
+
+
+def run_headless(engine, interval=5.0):
+    """
+    Polls without a display, printing each channel's latest value and
+    achieved polling rate every ``interval`` seconds until interrupted.
+
+    Args:
+        engine (DatastreamEngine): The running engine.
+        interval (float): Seconds between reports.
+    """
+    try:
+        while True:
+            time.sleep(interval)
+            stats = engine.scheduler.stats()
+            for channel in engine.channels:
+                _, value = engine.store.latest(channel.name)
+                if channel.name in stats:
+                    achieved = stats[channel.name]["achieved"]
+                    print(f"{channel.name}: {value} ({achieved} Hz)")
+                else:
+                    print(f"{channel.name}: {value} (derived)")
+            print(f"Link utilization: {engine.scheduler.utilization:.0%}\n")
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a live datastream")
+    parser.add_argument(
+        "-p", "--profile", action="append", dest="profiles",
+        help=f"built-in profile ({', '.join(PROFILES)}) or a JSON/YAML file; "
+             "repeat to run several",
+    )
+    parser.add_argument("--frontend", choices=("tk", "web", "headless"),
+                        default="web")
+    parser.add_argument("--port", type=int, default=5000,
+                        help="port of the web dashboard")
+    parser.add_argument("--alerts", action="store_true",
+                        help="speak alerts when a sensor behaves abnormally")
+    parser.add_argument("--rules", help="JSON/YAML rule file to evaluate")
+    parser.add_argument("--record", action="store_true",
+                        help="record the session to disk (the web front-end "
+                             "always does)")
+    args = parser.parse_args()
+    profiles = args.profiles or ["air-fuel"]
+
+    if args.frontend == "web":
+        from datastreams.web import run_dashboard
+        run_dashboard(profiles, port=args.port, alerts=args.alerts,
+                      rules_path=args.rules)
+        return
+
+    from config import (
+        DATASTREAM_MAX_FPS,
+        DATASTREAM_RECORD_DIR,
+        DATASTREAM_SNAPSHOT_DIR,
+    )
+    from datastreams.anomaly import AnomalyDetector, Speaker
+    from datastreams.engine import engine_from_config
+    from datastreams.recorder import SessionRecorder
+    from datastreams.rules import load_rules, watch_rules
+
+    engine = engine_from_config(profiles)
+    # anomalies and rules are printed either way, and spoken with --alerts
+    speaker = Speaker() if args.alerts else None
+    detector = AnomalyDetector(engine.hub, speaker=speaker).start()
+    rule_engine = None
+    if args.rules:
+        rule_engine = watch_rules(
+            engine, load_rules(args.rules), speaker, DATASTREAM_SNAPSHOT_DIR
+        )
+    recorder = None
+    if args.record:
+        recorder = SessionRecorder(
+            engine.hub, DATASTREAM_RECORD_DIR, engine.channels
+        ).start()
+        print(f"Recording to {recorder.path}")
+    try:
+        if args.frontend == "tk":
+            from datastreams.tk_viewer import run_viewer
+            run_viewer(engine, max_fps=DATASTREAM_MAX_FPS)
+        else:
+            run_headless(engine)
+    finally:
+        if recorder is not None:
+            recorder.stop()
+            if recorder.dropped:
+                print(f"Recording dropped {recorder.dropped} samples")
+        if rule_engine is not None:
+            rule_engine.stop()
+        detector.stop()
+        engine.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+"""
+This module watches the live datastream for anomalies and speaks alerts.
+
+``AnomalyDetector`` subscribes to the datastream hub and keeps running
+statistics for every channel: the session mean and variance (Welford), an
+exponentially weighted moving average and a smoothed rate of change. Each
+update costs the same whatever the length of the session, so the detector
+keeps up with the acquisition rate. ``Limit`` checks on those statistics flag
+fuel trims running away, oxygen sensors stuck lean or rich and misfire counts
+climbing, and a rate-limited ``Speaker`` reads the alerts out.
+
+Run ``python -m datastreams.anomaly`` to benchmark the detector.
+"""
+import argparse
+import collections
+import math
+import queue
+import threading
+import time
+
+import numpy as np
+
+from datastreams.pubsub import Sample
+
+# Kinds of limit
+ABOVE = "above"
+BELOW = "below"
+RATE_ABOVE = "rate_above"
+ZSCORE_ABOVE = "zscore_above"
+
+# Seconds over which the moving average and rate of change settle
+DEFAULT_TAU = 5.0
+
+# Samples a channel needs before z-score limits apply
+MIN_SAMPLES = 50
+
+# Seconds before the same limit may alert again
+REPEAT_INTERVAL = 60.0
+
+# Seconds between spoken alerts
+SPEAK_INTERVAL = 10.0
+
+# Anomalies kept for display
+MAX_ANOMALIES = 100
+
+
+class ChannelStats:
+    """
+    Running statistics of one channel, updated in constant time per sample.
+
+    Attributes:
+        count (int): Samples seen.
+        mean (float): Session mean.
+        ewma (float): Moving average over about ``tau`` seconds.
+        rate (float): Change per second, averaged over about ``tau`` seconds.
+        last_value (float): The newest value.
+        last_time (float): Time of the newest value.
+    """
+
+    __slots__ = (
+        "tau", "count", "mean", "m2", "ewma", "rate", "last_value", "last_time"
+    )
+
+    def __init__(self, tau=DEFAULT_TAU):
+        """
+        Args:
+            tau (float): Time constant of the moving averages, seconds.
+        """
+        self.tau = tau
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = None
+        self.rate = 0.0
+        self.last_value = None
+        self.last_time = None
+
+    def update(self, timestamp, value):
+        """
+        Adds a sample.
+
+        Args:
+            timestamp (float): Sample time, seconds.
+            value (float): Sample value.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.last_time is None:
+            self.ewma = value
+        else:
+            elapsed = timestamp - self.last_time
+            if elapsed > 0:
+                # weight by elapsed time, so irregular polling averages evenly
+                alpha = 1.0 - math.exp(-elapsed / self.tau)
+                self.ewma += alpha * (value - self.ewma)
+                change = (value - self.last_value) / elapsed
+                self.rate += alpha * (change - self.rate)
+        self.last_value = value
+        self.last_time = timestamp
+
+    @property
+    def variance(self):
+        """
+        float: Session variance, 0 before two samples.
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def zscore(self, value):
+        """
+        Measures how far a value is from the session mean.
+
+        Args:
+            value (float): The value.
+
+        Returns:
+            float: Standard deviations from the mean; 0 while the channel
+            has been constant.
+        """
+        std = math.sqrt(self.variance)
+        return abs(value - self.mean) / std if std > 0 else 0.0
+
+
+class Limit:
+    """
+    A check on one channel's statistics.
+
+    Attributes:
+        channel (str): Channel name.
+        kind (str): ``above`` or ``below`` compare the moving average,
+            ``rate_above`` the smoothed rate of change and ``zscore_above``
+            each new value's distance from the session mean.
+        threshold (float): The limit.
+        message (str): Alert text; ``{value}`` is replaced by the statistic.
+        tau (float): Time constant of the channel's moving averages, or None
+            for the detector default.
+    """
+
+    def __init__(self, channel, kind, threshold, message, tau=None):
+        if kind not in (ABOVE, BELOW, RATE_ABOVE, ZSCORE_ABOVE):
+            raise ValueError(f"Unknown limit kind {kind!r}")
+        self.channel = channel
+        self.kind = kind
+        self.threshold = threshold
+        self.message = message
+        self.tau = tau
+
+    def __repr__(self):
+        return f"Limit({self.channel!r}, {self.kind!r}, {self.threshold!r})"
+
+
+def _default_limits():
+    limits = []
+    for bank in (1, 2):
+        limits += [
+            Limit(
+                f"LONG_FUEL_TRIM_{bank}", ABOVE, 20.0,
+                f"Bank {bank} fuel trim is at {{value:.0f}} percent, running lean.",
+                tau=10.0,
+            ),
+            Limit(
+                f"LONG_FUEL_TRIM_{bank}", BELOW, -20.0,
+                f"Bank {bank} fuel trim is at {{value:.0f}} percent, running rich.",
+                tau=10.0,
+            ),
+            Limit(
+                f"SHORT_FUEL_TRIM_{bank}", ZSCORE_ABOVE, 5.0,
+                f"Bank {bank} short term fuel trim jumped.",
+            ),
+        ]
+        # a working narrowband sensor switches about once a second, so its
+        # average over ten seconds sits near 0.45 volts
+        limits += [
+            Limit(
+                f"O2_B{bank}S1", BELOW, 0.2,
+                f"Bank {bank} upstream oxygen sensor is stuck lean.",
+                tau=10.0,
+            ),
+            Limit(
+                f"O2_B{bank}S1", ABOVE, 0.75,
+                f"Bank {bank} upstream oxygen sensor is stuck rich.",
+                tau=10.0,
+            ),
+        ]
+    for cylinder in range(1, 13):
+        limits.append(
+            Limit(
+                f"MONITOR_MISFIRE_CYLINDER_{cylinder}", RATE_ABOVE, 0.1,
+                f"Cylinder {cylinder} misfires are climbing.",
+                tau=20.0,
+            )
+        )
+    return limits
+
+
+DEFAULT_LIMITS = _default_limits()
+
+
+class Anomaly:
+    """
+    A limit being crossed.
+
+    Attributes:
+        timestamp (float): Time of the sample that crossed it.
+        limit (Limit): The limit.
+        value (float): The statistic compared.
+        message (str): The alert text.
+    """
+
+    __slots__ = ("timestamp", "limit", "value", "message")
+
+    def __init__(self, timestamp, limit, value):
+        self.timestamp = timestamp
+        self.limit = limit
+        self.value = value
+        self.message = limit.message.format(value=value)
+
+    def __repr__(self):
+        return f"Anomaly({self.limit.channel!r}, {self.message!r})"
+
+
+def speak_aloud(text):
+    """
+    Speaks text with the configured text-to-speech engine.
+
+    Args:
+        text (str): The text.
+    """
+    # imported here: the TTS engines are heavy and need the audio settings
+    from audio.audio_output import initialize_audio, tts_output
+
+    if not speak_aloud.initialized:
+        initialize_audio()
+        speak_aloud.initialized = True
+    tts_output(text)
+
+
+speak_aloud.initialized = False
+
+
+class Speaker:
+    """
+    Speaks alerts on a background thread, at most one per interval.
+
+    Alerts arriving while another is being spoken, or too soon after the
+    last one, are dropped rather than queued, so a burst of anomalies never
+    turns into minutes of speech.
+
+    Attributes:
+        spoken (int): Alerts spoken.
+        suppressed (int): Alerts dropped by the rate limit.
+    """
+
+    def __init__(self, speak=speak_aloud, min_interval=SPEAK_INTERVAL):
+        """
+        Args:
+            speak (callable): Called with the text; blocks while speaking.
+            min_interval (float): Seconds between the starts of alerts.
+        """
+        self.speak = speak
+        self.min_interval = min_interval
+        self.spoken = 0
+        self.suppressed = 0
+        self._queue = queue.Queue(maxsize=1)
+        self._last = None
+        self._thread = threading.Thread(
+            target=self._run, name="anomaly-speaker", daemon=True
+        )
+        self._thread.start()
+
+    def say(self, text):
+        """
+        Speaks text unless another alert was spoken too recently.
+
+        Args:
+            text (str): The alert.
+
+        Returns:
+            bool: False if the alert was dropped.
+        """
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.min_interval:
+            self.suppressed += 1
+            return False
+        try:
+            self._queue.put_nowait(text)
+        except queue.Full:
+            self.suppressed += 1
+            return False
+        self._last = now
+        return True
+
+    def _run(self):
+        while True:
+            text = self._queue.get()
+            try:
+                self.speak(text)
+                self.spoken += 1
+            except Exception as e:
+                print(f"Could not speak alert: {e}")
+
+
+class AnomalyDetector:
+    """
+    Updates channel statistics for every sample and checks the limits.
+
+    Example:
+        detector = AnomalyDetector(engine.hub, speaker=Speaker()).start()
+        ...
+        detector.stop()
+
+    Attributes:
+        stats (dict): Channel name mapped to its ChannelStats.
+        limits (list): The limits checked.
+        anomalies (collections.deque): The newest anomalies.
+        samples (int): Samples processed.
+        busy (float): Seconds spent processing.
+    """
+
+    def __init__(self, hub=None, limits=DEFAULT_LIMITS, speaker=None,
+                 tau=DEFAULT_TAU, repeat_interval=REPEAT_INTERVAL):
+        """
+        Args:
+            hub (Hub): Where samples arrive; only needed for ``start``.
+            limits (list): Limits to check.
+            speaker (Speaker): Speaks alerts; None only prints them.
+            tau (float): Default time constant of the moving averages.
+            repeat_interval (float): Seconds before a limit that stays
+                crossed, or is crossed again, alerts again.
+        """
+        self.hub = hub
+        self.limits = list(limits)
+        self.speaker = speaker
+        self.tau = tau
+        self.repeat_interval = repeat_interval
+        self.stats = {}
+        self.anomalies = collections.deque(maxlen=MAX_ANOMALIES)
+        self.samples = 0
+        self.busy = 0.0
+        self._limits = collections.defaultdict(list)
+        for limit in self.limits:
+            self._limits[limit.channel].append(limit)
+        self._alerted = {}
+        self._subscription = None
+        self._thread = None
+
+    def _channel(self, name):
+        limits = self._limits.get(name, ())
+        taus = [limit.tau for limit in limits if limit.tau is not None]
+        stats = self.stats[name] = ChannelStats(max(taus, default=self.tau))
+        return stats
+
+    def process(self, sample):
+        """
+        Updates the statistics with a sample and checks its channels' limits.
+
+        Args:
+            sample (Sample): One poll cycle.
+
+        Returns:
+            list: The Anomalies it raised.
+        """
+        started = time.perf_counter()
+        raised = []
+        timestamp = sample.timestamp
+        for name, value in sample.values.items():
+            if value is None:
+                continue
+            stats = self.stats.get(name) or self._channel(name)
+            limits = self._limits.get(name)
+            if limits:
+                # a new value is compared with the statistics before it
+                for limit in limits:
+                    if limit.kind == ZSCORE_ABOVE:
+                        enough = stats.count >= MIN_SAMPLES
+                        score = stats.zscore(value) if enough else 0.0
+                        self._check(limit, score > limit.threshold, timestamp,
+                                    score, raised)
+            stats.update(timestamp, value)
+            if limits:
+                for limit in limits:
+                    if limit.kind == ABOVE:
+                        crossed = stats.ewma > limit.threshold
+                        self._check(limit, crossed, timestamp, stats.ewma, raised)
+                    elif limit.kind == BELOW:
+                        crossed = stats.ewma < limit.threshold
+                        self._check(limit, crossed, timestamp, stats.ewma, raised)
+                    elif limit.kind == RATE_ABOVE:
+                        crossed = stats.rate > limit.threshold
+                        self._check(limit, crossed, timestamp, stats.rate, raised)
+        self.samples += 1
+        self.busy += time.perf_counter() - started
+        return raised
+
+    def _check(self, limit, crossed, timestamp, value, raised):
+        if not crossed:
+            return
+        last = self._alerted.get(limit)
+        if last is not None and timestamp - last < self.repeat_interval:
+            return
+        self._alerted[limit] = timestamp
+        anomaly = Anomaly(timestamp, limit, value)
+        self.anomalies.append(anomaly)
+        raised.append(anomaly)
+        print(f"Anomaly: {anomaly.message}")
+        if self.speaker is not None:
+            self.speaker.say(anomaly.message)
+
+    def start(self):
+        """
+        Subscribes to the hub and starts checking.
+
+        Returns:
+            AnomalyDetector: self, for chaining.
+        """
+        # falling behind must never hold up acquisition
+        self._subscription = self.hub.subscribe("anomaly", maxsize=256)
+        self._thread = threading.Thread(
+            target=self._run, name="anomaly-detector", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Unsubscribes and waits for the thread to finish.
+        """
+        if self._subscription is not None:
+            self.hub.unsubscribe(self._subscription)
+            self._thread.join(2.0)
+            self._subscription = None
+
+    def _run(self):
+        for sample in self._subscription:
+            self.process(sample)
+
+
+def benchmark(channels=120, rate=50.0, seconds=20.0, seed=0):
+    """
+    Measures the detector's cost on synthetic samples.
+
+    Every channel is a noisy random walk sampled at ``rate``; a few carry
+    the names of watched sensors, so limits are checked as well.
+
+    Args:
+        channels (int): Channels per sample.
+        rate (float): Samples per second.
+        seconds (float): Seconds of data.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Samples, channel updates, mean and worst microseconds per
+        sample, and the fraction of real time spent.
+    """
+    rng = np.random.default_rng(seed)
+    count = int(rate * seconds)
+    watched = [
+        "LONG_FUEL_TRIM_1", "SHORT_FUEL_TRIM_1", "O2_B1S1",
+        "MONITOR_MISFIRE_CYLINDER_3",
+    ]
+    names = watched + [f"CHANNEL_{i}" for i in range(channels - len(watched))]
+    values = np.cumsum(rng.normal(0, 0.1, (count, len(names))), axis=0)
+    values[:, 2] = 0.45 + 0.4 * np.sign(np.sin(np.arange(count) / rate * 6))
+    samples = [
+        Sample(i / rate, dict(zip(names, row.tolist())))
+        for i, row in enumerate(values)
+    ]
+
+    detector = AnomalyDetector()
+    timings = np.empty(count)
+    for i, sample in enumerate(samples):
+        started = time.perf_counter()
+        detector.process(sample)
+        timings[i] = time.perf_counter() - started
+    return {
+        "samples": count,
+        "updates": count * len(names),
+        "mean_us": float(timings.mean() * 1e6),
+        "p99_us": float(np.percentile(timings, 99) * 1e6),
+        "max_us": float(timings.max() * 1e6),
+        "real_time_fraction": float(timings.sum() / seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the anomaly detector")
+    parser.add_argument("--channels", type=int, default=120)
+    parser.add_argument("--rate", type=float, default=50.0)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    args = parser.parse_args()
+
+    result = benchmark(args.channels, args.rate, args.seconds)
+    print(f"{args.channels} channels at {args.rate:g} Hz for {args.seconds:g} s: "
+          f"{result['updates']} channel updates")
+    print(f"Per sample: {result['mean_us']:.0f} us mean, "
+          f"{result['p99_us']:.0f} us p99, {result['max_us']:.0f} us worst")
+    print(f"Per channel update: {result['mean_us'] / args.channels:.2f} us")
+    print(f"CPU time: {result['real_time_fraction']:.1%} of real time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+This module batches Mode 01 sensor queries into multi-PID requests.
+
+An ELM327 on a CAN vehicle accepts up to six Mode 01 PIDs in one request
+(``010C0D0F10111F``) and the ECU answers them in a single response. Packing
+the datastream sensors this way replaces one serial round-trip per sensor
+with one per six sensors.
+"""
+import logging
+
+from obd.OBDResponse import OBDResponse
+from obd.protocols.protocol import Message
+
+logger = logging.getLogger(__name__)
+
+# SAE J1979 limit on PIDs per Mode 01 request.
+MAX_PIDS_PER_REQUEST = 6
+
+# ELM327 protocol numbers for ISO 15765-4 (CAN).
+CAN_PROTOCOLS = {"6", "7", "8", "9"}
+
+# Service ID of an ECU's negative response
+NEGATIVE_RESPONSE = 0x7F
+
+
+def can_batch(command):
+    """
+    Checks whether a command can be packed into a multi-PID request.
+
+    Args:
+        command (obd.OBDCommand): The command to check.
+
+    Returns:
+        bool: True for fixed-length Mode 01 commands.
+    """
+    return command.mode == 1 and command.pid is not None and command.bytes > 2
+
+
+def chunk_commands(commands, size=MAX_PIDS_PER_REQUEST):
+    """
+    Splits commands into groups of at most ``size``.
+
+    Args:
+        commands (list): The commands to split.
+        size (int): Maximum group size.
+
+    Returns:
+        list: A list of command lists.
+    """
+    return [commands[i:i + size] for i in range(0, len(commands), size)]
+
+
+def build_request(commands):
+    """
+    Builds the multi-PID request string for a group of Mode 01 commands.
+
+    Args:
+        commands (list): Up to six batchable commands.
+
+    Returns:
+        bytes: The request, e.g. ``b"010C0D"``.
+    """
+    return b"01" + b"".join(command.command[2:] for command in commands)
+
+
+def rejected(messages):
+    """
+    Checks whether a request was refused rather than left unanswered.
+
+    The adapter answers ``?`` to a request it cannot parse and the ECU a
+    negative response to one it does not support. ``NO DATA``, a timeout or
+    a bus error says nothing about the request itself.
+
+    Args:
+        messages (list): Parsed messages returned for the request.
+
+    Returns:
+        bool: True if the adapter or ECU rejected the request.
+    """
+    for message in messages:
+        if message.raw().strip() == "?":
+            return True
+        if message.data and message.data[0] == NEGATIVE_RESPONSE:
+            return True
+    return False
+
+
+def demultiplex(messages, commands):
+    """
+    Splits multi-PID response messages into per-command responses.
+
+    Each message carries ``41 <pid> <data> <pid> <data> ...``. The data length
+    of every PID comes from its command definition, so the payload is walked
+    PID by PID and rebuilt as a single-PID message for the command's decoder.
+
+    Args:
+        messages (list): Parsed messages returned for the batched request.
+        commands (list): The commands that were batched.
+
+    Returns:
+        dict: Command mapped to its OBDResponse, only for PIDs that were found.
+    """
+    by_pid = {command.pid: command for command in commands}
+    per_command = {}
+
+    for message in messages:
+        data = message.data
+        if len(data) < 2 or data[0] != 0x41:
+            continue
+        i = 1
+        while i < len(data):
+            command = by_pid.get(data[i])
+            if command is None:
+                # padding or a corrupt frame; nothing after it can be trusted
+                break
+            end = i + command.bytes - 1
+            if end > len(data):
+                break
+            single = Message(message.frames)
+            single.ecu = message.ecu
+            single.data = bytearray([0x41]) + data[i:end]
+            per_command.setdefault(command, []).append(single)
+            i = end
+
+    return {command: command(found) for command, found in per_command.items()}
+
+
+class BatchQueryEngine:
+    """
+    Queries a set of sensors using as few requests as possible.
+
+    Batchable Mode 01 commands are grouped six to a request on CAN protocols.
+    PIDs missing from a batched answer are retried individually, and if the
+    adapter or ECU rejects a batched request outright, batching is switched
+    off and every sensor is queried on its own. An unanswered request, such
+    as a timeout or ``NO DATA``, leaves batching on.
+
+    Attributes:
+        misfire (MisfireEngine): Reads the misfire monitors, every cylinder
+            in one scan, whenever any of them is queried; None to query them
+            one by one.
+    """
+
+    def __init__(self, connection, batching=None):
+        """
+        Args:
+            connection: An open ``obd.OBD`` connection.
+            batching (bool): Force batching on or off. By default it is
+                enabled on CAN protocols only.
+        """
+        self.connection = connection
+        if batching is None:
+            batching = connection.protocol_id() in CAN_PROTOCOLS
+        self.batching = batching
+        self.requests = 0
+        self.misfire = None
+
+    def _send_and_parse(self, request):
+        # obd.OBD keeps the raw send on its ELM327 interface object
+        send_and_parse = getattr(self.connection, "send_and_parse", None)
+        if send_and_parse is None:
+            send_and_parse = self.connection.interface.send_and_parse
+        self.requests += 1
+        return send_and_parse(request) or []
+
+    def _query_single(self, command):
+        self.requests += 1
+        return self.connection.query(command)
+
+    def query_all(self, commands):
+        """
+        Queries every command and returns the responses.
+
+        Args:
+            commands (list): The OBD commands to query.
+
+        Returns:
+            dict: Command mapped to OBDResponse. Commands that produced no
+            data map to a null OBDResponse. A misfire scan also answers the
+            monitors that were not asked for.
+        """
+        results = {}
+        misfire = self.misfire
+        if misfire is not None and any(c in misfire.commands for c in commands):
+            results.update(misfire.query_all())
+            commands = [c for c in commands if c not in results]
+        batchable = [command for command in commands if can_batch(command)]
+        singles = [command for command in commands if not can_batch(command)]
+
+        if self.batching and len(batchable) > 1:
+            for group in chunk_commands(batchable):
+                if not self.batching:
+                    singles.extend(group)
+                    continue
+                messages = self._send_and_parse(build_request(group))
+                found = demultiplex(messages, group)
+                if not found and rejected(messages):
+                    logger.info("Multi-PID request rejected, disabling batching")
+                    self.batching = False
+                results.update(found)
+                singles.extend(c for c in group if c not in found)
+        else:
+            singles = list(commands)
+
+        for command in singles:
+            results[command] = self._query_single(command)
+
+        for command in commands:
+            results.setdefault(command, OBDResponse())
+        return results
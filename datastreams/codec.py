@@ -0,0 +1,499 @@
+"""
+This module packs blocks of channel samples into a compact binary form.
+
+OBD values are PID bytes run through a linear formula, so a channel's
+samples are small integers times a fixed step: RPM moves in quarters, fuel
+trims in 100/128 percent. A block is stored as those integers, and its
+timestamps as whole microseconds; both are delta encoded, zigzag mapped to
+unsigned, written as varints and compressed with zlib. A channel whose
+values are not on a fixed step, such as a derived channel, keeps its
+float64 values, byte-shuffled before compression.
+
+Decoding gives back every value to well within its sensor resolution and
+every timestamp to the microsecond. The packed form is used by
+``/data?format=packed`` and by session archives (``archive_session``).
+
+Run ``python -m datastreams.codec`` for the encode/decode benchmark on the
+simulator's air-fuel and misfire profiles.
+"""
+import argparse
+import json
+import math
+import random
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from datastreams.session_index import INDEX_BLOCK, SessionIndex
+from utils.pid_decoders import REGISTRY
+
+MAGIC = b"OBDZ"
+VERSION = 1
+
+# magic, version, kind, count, step, offset, first timestamp in microseconds
+HEADER = struct.Struct("<4sBBxxIddq")
+
+# How a block stores its values
+SCALED = 0
+FLOAT = 1
+
+# zlib level; 6 balances ratio and speed for blocks this size
+COMPRESSION_LEVEL = 6
+
+ARCHIVE_MAGIC = b"OBDA"
+
+# magic, then the length of the JSON directory that follows
+ARCHIVE_HEADER = struct.Struct("<4sI")
+
+
+def _resolutions():
+    # probe each decoder formula with one count in each data byte: the
+    # smallest change is the step and the value at zero the offset
+    found = {}
+    for decoder in REGISTRY.values():
+        if decoder.kind != "numeric":
+            continue
+        offset = decoder.decode(bytes(4))
+        steps = [
+            abs(decoder.decode(bytes(i * (0,) + (1,) + (3 - i) * (0,))) - offset)
+            for i in range(4)
+        ]
+        steps = [step for step in steps if step > 0]
+        if steps:
+            found[decoder.name] = (min(steps), offset)
+    return found
+
+
+# Channel name mapped to (step, offset) of its scaled integers
+RESOLUTIONS = _resolutions()
+
+
+def channel_resolution(name):
+    """
+    Looks up the step and offset a channel's values are quantized to.
+
+    Args:
+        name (str): Channel name.
+
+    Returns:
+        tuple: ``(step, offset)``, or None if the channel has no fixed step.
+    """
+    if name.startswith("MONITOR_MISFIRE_CYLINDER_"):
+        return (1.0, 0.0)
+    return RESOLUTIONS.get(name)
+
+
+def infer_resolution(values):
+    """
+    Finds a step that every value is a whole multiple of, counted from the
+    smallest value.
+
+    Args:
+        values (numpy.ndarray): Sample values.
+
+    Returns:
+        tuple: ``(step, offset)``, or None if there is none.
+    """
+    levels = np.unique(values)
+    if not np.all(np.isfinite(levels)):
+        return None
+    if len(levels) < 2:
+        return 1.0, float(levels[0]) if len(levels) else 0.0
+    step = float(np.diff(levels).min())
+    offset = float(levels[0])
+    if _quantize(values, step, offset) is None:
+        return None
+    return step, offset
+
+
+def _quantize(values, step, offset):
+    counts = np.rint((values - offset) / step)
+    error = np.abs(counts * step + offset - values)
+    if not np.all(error <= 1e-9 * np.maximum(1.0, np.abs(values))):
+        return None
+    return counts.astype(np.int64)
+
+
+def zigzag(values):
+    """
+    Maps signed integers to unsigned so small magnitudes stay small.
+
+    Args:
+        values (numpy.ndarray): int64 values.
+
+    Returns:
+        numpy.ndarray: uint64 values; 0, -1, 1, -2 become 0, 1, 2, 3.
+    """
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values):
+    """
+    Reverses ``zigzag``.
+
+    Args:
+        values (numpy.ndarray): uint64 values.
+
+    Returns:
+        numpy.ndarray: int64 values.
+    """
+    values = values.astype(np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(
+        values & np.uint64(1)
+    ).view(np.int64)
+
+
+def encode_varints(values):
+    """
+    Writes unsigned integers seven bits per byte, low bits first; the high
+    bit of a byte is set when more bytes of the same integer follow.
+
+    Args:
+        values (numpy.ndarray): uint64 values.
+
+    Returns:
+        bytes: The encoded values.
+    """
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for byte in range(int(lengths.max(initial=0))):
+        more = lengths > byte
+        bits = (values[more] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        bits |= np.where(lengths[more] > byte + 1, 0x80, 0).astype(np.uint64)
+        out[starts[more] + byte] = bits
+    return out.tobytes()
+
+
+def decode_varints(data, count):
+    """
+    Reads ``count`` integers written by ``encode_varints``.
+
+    Args:
+        data (bytes): Encoded values, possibly followed by other data.
+        count (int): Number of integers to read.
+
+    Returns:
+        tuple: ``(values, used)``; ``values`` are uint64 and ``used`` is the
+        number of bytes they took.
+    """
+    if count == 0:
+        return np.empty(0, dtype=np.uint64), 0
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    used = int(ends[-1]) + 1
+    raw = raw[:used]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    owner = np.repeat(np.arange(count), ends - starts + 1)
+    shifts = (7 * (np.arange(used) - starts[owner])).astype(np.uint64)
+    parts = (raw & 0x7F).astype(np.uint64) << shifts
+    return np.bitwise_or.reduceat(parts, starts), used
+
+
+def encode_block(timestamps, values, name=None, resolution=None):
+    """
+    Packs one channel's samples.
+
+    Args:
+        timestamps (numpy.ndarray): Sample times in seconds, ascending.
+        values (numpy.ndarray): Sample values.
+        name (str): Channel name, to look up its resolution.
+        resolution (tuple): ``(step, offset)`` to use instead; without
+            either, the step is inferred from the values.
+
+    Returns:
+        bytes: The packed block.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if resolution is None and name is not None:
+        resolution = channel_resolution(name)
+    counts = None
+    if resolution is not None:
+        counts = _quantize(values, *resolution)
+    if counts is None:
+        # a formula outside the table, or a derived channel
+        resolution = infer_resolution(values)
+        if resolution is not None:
+            counts = _quantize(values, *resolution)
+
+    micros = np.rint(timestamps * 1e6).astype(np.int64)
+    first = int(micros[0]) if len(micros) else 0
+    payload = encode_varints(zigzag(np.diff(micros, prepend=first)))
+    if counts is not None:
+        kind, (step, offset) = SCALED, resolution
+        payload += encode_varints(zigzag(np.diff(counts, prepend=0)))
+    else:
+        # grouping the bytes of each significance lets zlib find the repeats
+        kind, step, offset = FLOAT, 0.0, 0.0
+        payload += values.view(np.uint8).reshape(-1, 8).T.tobytes()
+    header = HEADER.pack(MAGIC, VERSION, kind, len(values), step, offset, first)
+    return header + zlib.compress(payload, COMPRESSION_LEVEL)
+
+
+def decode_block(data):
+    """
+    Unpacks a block written by ``encode_block``.
+
+    Args:
+        data (bytes): The packed block.
+
+    Returns:
+        tuple: ``(timestamps, values)`` float64 arrays.
+
+    Raises:
+        ValueError: If the data is not a packed block.
+    """
+    magic, version, kind, count, step, offset, first = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a packed sample block")
+    payload = zlib.decompress(data[HEADER.size:])
+    deltas, used = decode_varints(payload, count)
+    timestamps = (first + np.cumsum(unzigzag(deltas))) / 1e6
+    if kind == SCALED:
+        deltas, _ = decode_varints(payload[used:], count)
+        values = np.cumsum(unzigzag(deltas)) * step + offset
+    else:
+        shuffled = np.frombuffer(payload[used:], dtype=np.uint8)
+        values = shuffled.reshape(8, count).T.copy().view(np.float64).ravel()
+    return timestamps, values
+
+
+def archive_session(session_path, out_path, block=INDEX_BLOCK):
+    """
+    Packs a recorded session into one file for keeping or sending.
+
+    Each channel is packed in blocks of the session index's size, with the
+    time range of every block in the file's directory, so an archive is
+    still read one time range at a time.
+
+    Args:
+        session_path (str): The session directory.
+        out_path (str): The archive file.
+        block (int): Samples per packed block.
+
+    Returns:
+        tuple: ``(recorded, archived)`` sizes in bytes.
+    """
+    session = SessionIndex(session_path)
+    directory = {"metadata": session.metadata, "channels": {}}
+    payloads = []
+    position = recorded = 0
+    for name in session.names:
+        timestamps, values = session.query(name)
+        recorded += timestamps.nbytes + values.nbytes
+        blocks = []
+        for start in range(0, len(timestamps), block):
+            packed = encode_block(
+                timestamps[start:start + block], values[start:start + block], name
+            )
+            blocks.append([
+                float(timestamps[start]),
+                float(timestamps[min(start + block, len(timestamps)) - 1]),
+                position,
+                len(packed),
+            ])
+            payloads.append(packed)
+            position += len(packed)
+        directory["channels"][name] = blocks
+    encoded = json.dumps(directory).encode("utf-8")
+    with open(out_path, "wb") as f:
+        f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, len(encoded)))
+        f.write(encoded)
+        for packed in payloads:
+            f.write(packed)
+    return recorded, ARCHIVE_HEADER.size + len(encoded) + position
+
+
+class SessionArchive:
+    """
+    Reads a session packed by ``archive_session``.
+
+    Attributes:
+        path (str): The archive file.
+        metadata (dict): The session's ``session.json``.
+        names (list): Channel names.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The archive file.
+
+        Raises:
+            ValueError: If the file is not a session archive.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            magic, length = ARCHIVE_HEADER.unpack(f.read(ARCHIVE_HEADER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a session archive")
+            directory = json.loads(f.read(length))
+        self._base = ARCHIVE_HEADER.size + length
+        self.metadata = directory["metadata"]
+        self._blocks = directory["channels"]
+        self.names = list(self._blocks)
+
+    def query(self, name, start=None, end=None):
+        """
+        Unpacks a channel's samples in a time range.
+
+        Only the blocks overlapping the range are read.
+
+        Args:
+            name (str): Channel name.
+            start (float): First time, or None from the beginning.
+            end (float): Last time, or None to the end.
+
+        Returns:
+            tuple: ``(timestamps, values)`` arrays.
+        """
+        start = -math.inf if start is None else start
+        end = math.inf if end is None else end
+        parts = []
+        with open(self.path, "rb") as f:
+            for first, last, position, length in self._blocks[name]:
+                if last < start or first > end:
+                    continue
+                f.seek(self._base + position)
+                parts.append(decode_block(f.read(length)))
+        if not parts:
+            return np.empty(0), np.empty(0)
+        timestamps = np.concatenate([t for t, _ in parts])
+        values = np.concatenate([v for _, v in parts])
+        keep = (timestamps >= start) & (timestamps <= end)
+        return timestamps[keep], values[keep]
+
+
+def simulate_profile(profile, seconds, rate, seed=0):
+    """
+    Generates a session the way the ELM327 simulator would answer it.
+
+    Args:
+        profile (VehicleProfile): A simulator profile.
+        seconds (float): Length of the session.
+        rate (float): Polls per second of every Mode 01 PID; misfire
+            monitors are read once a second.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Channel name mapped to ``(timestamps, values)``.
+    """
+    rng = random.Random(seed)
+    jitter = np.random.default_rng(seed)
+    channels = {}
+    polls = np.arange(0, seconds, 1 / rate)
+    for pid, generator in profile.signals.items():
+        decoder = REGISTRY[(1, pid)]
+        # answers arrive a few milliseconds apart, not on a perfect grid
+        times = 1.7e9 + polls + jitter.uniform(0, 0.01, len(polls))
+        raw = np.array(
+            [list(generator(t, rng)[:decoder.length]) for t in polls],
+            dtype=np.uint8,
+        )
+        channels[decoder.name] = (times, decoder.decode_array(raw))
+    scans = np.arange(0, seconds, 1.0)
+    for cylinder, per_minute in enumerate(profile.misfire_rates, 1):
+        times = 1.7e9 + scans + jitter.uniform(0, 0.01, len(scans))
+        counts = np.rint(per_minute * scans / 60)
+        channels[f"MONITOR_MISFIRE_CYLINDER_{cylinder}"] = (times, counts)
+    return channels
+
+
+def benchmark(profile_names=("air_fuel", "misfire"), seconds=600.0, rate=10.0,
+              block=INDEX_BLOCK):
+    """
+    Packs simulated sessions and measures size and speed.
+
+    Args:
+        profile_names (list): Simulator profile names.
+        seconds (float): Length of each session.
+        rate (float): Polls per second of every Mode 01 PID.
+        block (int): Samples per packed block.
+
+    Returns:
+        dict: Profile name mapped to samples, float64 bytes, JSON bytes,
+        packed bytes, encode and decode seconds, and whether every sample
+        came back within its resolution.
+    """
+    from utils.elm327_simulator import PROFILES
+
+    results = {}
+    for profile_name in profile_names:
+        channels = simulate_profile(PROFILES[profile_name], seconds, rate)
+        samples = raw = text = packed = 0
+        encode_time = decode_time = 0.0
+        exact = True
+        for name, (timestamps, values) in channels.items():
+            samples += len(values)
+            raw += timestamps.nbytes + values.nbytes
+            text += len(json.dumps(
+                {"timestamps": timestamps.tolist(), "values": values.tolist()}
+            ))
+            for start in range(0, len(values), block):
+                t, v = timestamps[start:start + block], values[start:start + block]
+                started = time.perf_counter()
+                data = encode_block(t, v, name)
+                encode_time += time.perf_counter() - started
+                started = time.perf_counter()
+                decoded_t, decoded_v = decode_block(data)
+                decode_time += time.perf_counter() - started
+                packed += len(data)
+                step = (channel_resolution(name) or (1e-6, 0))[0]
+                exact &= bool(
+                    np.all(np.abs(decoded_t - t) <= 1e-6)
+                    and np.all(np.abs(decoded_v - v) <= step * 1e-6)
+                )
+        results[profile_name] = {
+            "channels": len(channels),
+            "samples": samples,
+            "raw": raw,
+            "json": text,
+            "packed": packed,
+            "encode": encode_time,
+            "decode": decode_time,
+            "exact": exact,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the sample codec, or archive a recorded session"
+    )
+    parser.add_argument("--seconds", type=float, default=600.0,
+                        help="length of each simulated session")
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="polls per second of every PID")
+    parser.add_argument("--archive", nargs=2, metavar=("SESSION", "OUTPUT"),
+                        help="pack a recorded session instead")
+    args = parser.parse_args()
+
+    if args.archive:
+        recorded, archived = archive_session(*args.archive)
+        print(f"Archived {recorded / 1e6:.1f} MB into {archived / 1e6:.2f} MB "
+              f"({recorded / max(archived, 1):.1f}x)")
+        return
+
+    for name, r in benchmark(seconds=args.seconds, rate=args.rate).items():
+        print(f"{name}: {r['channels']} channels, {r['samples']} samples")
+        print(f"  float64 {r['raw'] / 1e3:.0f} kB, JSON {r['json'] / 1e3:.0f} kB, "
+              f"packed {r['packed'] / 1e3:.1f} kB "
+              f"({r['raw'] / r['packed']:.1f}x vs float64, "
+              f"{r['json'] / r['packed']:.1f}x vs JSON, "
+              f"{r['packed'] / r['samples']:.2f} bytes/sample)")
+        print(f"  encode {r['samples'] / r['encode'] / 1e6:.1f} M samples/s, "
+              f"decode {r['samples'] / r['decode'] / 1e6:.1f} M samples/s, "
+              f"round trip {'exact' if r['exact'] else 'LOSSY'}")
+
+
+if __name__ == "__main__":
+    main()
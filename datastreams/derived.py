@@ -0,0 +1,351 @@
+"""
+This module computes derived channels from the live sensor stream.
+
+A derived channel is a formula over polled sensors: total fuel trim per
+bank, the bank-to-bank trim delta, volumetric efficiency, equivalence ratio,
+lambda and fuel flow. ``DerivedEngine`` subscribes to the datastream hub and,
+for every batch of new samples, lines the inputs up (holding each sensor's
+last value between polls) and evaluates every formula over the whole batch
+at once. Results go into the same store and hub as the sensors, so they are
+plotted and recorded like any other channel.
+"""
+import threading
+
+import numpy as np
+
+from datastreams.pubsub import BLOCK, Sample
+
+# Specific gas constant of dry air, J/(kg*K).
+AIR_GAS_CONSTANT = 287.05
+
+# Stoichiometric air-fuel ratio and density (g/L) of gasoline.
+STOICHIOMETRIC_AFR = 14.7
+FUEL_DENSITY = 745.0
+
+# Engine displacement in liters assumed when none is configured.
+DEFAULT_DISPLACEMENT = 2.0
+
+# Intake air temperature (°C) assumed when the vehicle does not report it.
+DEFAULT_INTAKE_TEMP = 25.0
+
+
+def hold_forward(rows):
+    """
+    Fills each column's gaps with its last value, as the sensor holds it
+    until it is polled again.
+
+    Args:
+        rows (numpy.ndarray): One row per sample and one column per channel;
+            NaN where the channel was not sampled.
+
+    Returns:
+        numpy.ndarray: The filled rows; gaps before a column's first value
+        stay NaN.
+    """
+    held = np.where(np.isnan(rows), 0, np.arange(len(rows))[:, None])
+    np.maximum.accumulate(held, axis=0, out=held)
+    return np.take_along_axis(rows, held, axis=0)
+
+
+class DerivedChannel:
+    """
+    A channel computed from other channels.
+
+    Attributes:
+        name (str): Channel name, used like a command name.
+        desc (str): Description shown as the graph title.
+        units (str): Units of the result.
+        inputs (dict): Input channel name mapped to the value used when the
+            vehicle does not report it, or None if the input is required.
+        formula (callable): Called with one array per input, by name;
+            returns the result array.
+        mode: Always None; derived channels are not OBD commands.
+    """
+
+    mode = None
+    pid = None
+
+    def __init__(self, name, desc, units, inputs, formula):
+        self.name = name
+        self.desc = desc
+        self.units = units
+        self.inputs = inputs
+        self.formula = formula
+
+    def __repr__(self):
+        return f"DerivedChannel({self.name!r})"
+
+
+def _total_trim_1(SHORT_FUEL_TRIM_1, LONG_FUEL_TRIM_1):
+    return SHORT_FUEL_TRIM_1 + LONG_FUEL_TRIM_1
+
+
+def _total_trim_2(SHORT_FUEL_TRIM_2, LONG_FUEL_TRIM_2):
+    return SHORT_FUEL_TRIM_2 + LONG_FUEL_TRIM_2
+
+
+def _trim_delta(SHORT_FUEL_TRIM_1, LONG_FUEL_TRIM_1, SHORT_FUEL_TRIM_2,
+                LONG_FUEL_TRIM_2):
+    return (SHORT_FUEL_TRIM_1 + LONG_FUEL_TRIM_1) - (
+        SHORT_FUEL_TRIM_2 + LONG_FUEL_TRIM_2
+    )
+
+
+# PID 0x44 is named an equivalence ratio but reports the commanded lambda
+# (air-fuel ratio over stoichiometric, above 1 when lean); the equivalence
+# ratio phi is its reciprocal.
+def _lambda(COMMANDED_EQUIV_RATIO):
+    return COMMANDED_EQUIV_RATIO
+
+
+def _equivalence_ratio(COMMANDED_EQUIV_RATIO):
+    with np.errstate(divide="ignore"):
+        return 1.0 / COMMANDED_EQUIV_RATIO
+
+
+def _fuel_flow(MAF, COMMANDED_EQUIV_RATIO):
+    # g/s of fuel at the commanded air-fuel ratio, in liters per hour
+    with np.errstate(divide="ignore"):
+        fuel = MAF / (STOICHIOMETRIC_AFR * COMMANDED_EQUIV_RATIO)
+    return fuel / FUEL_DENSITY * 3600.0
+
+
+def volumetric_efficiency(displacement):
+    """
+    Builds the volumetric efficiency formula for an engine.
+
+    The measured air mass flow is compared with what a four-stroke engine of
+    this displacement would draw at the manifold pressure and intake
+    temperature: ``RPM / 2`` intake strokes per minute, each filling the
+    displacement with air of density ``MAP / (R * T)``.
+
+    Args:
+        displacement (float): Displacement in liters.
+
+    Returns:
+        callable: The formula, in percent.
+    """
+    def formula(MAF, RPM, INTAKE_PRESSURE, INTAKE_TEMP):
+        density = INTAKE_PRESSURE * 1000.0 / (
+            AIR_GAS_CONSTANT * (INTAKE_TEMP + 273.15)
+        )
+        theoretical = density * displacement * RPM / 120.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(theoretical > 0, 100.0 * MAF / theoretical, np.nan)
+
+    return formula
+
+
+def build_derived_channels(displacement=DEFAULT_DISPLACEMENT):
+    """
+    Builds the standard derived channels.
+
+    Args:
+        displacement (float): Engine displacement in liters, for volumetric
+            efficiency.
+
+    Returns:
+        dict: Channel name mapped to DerivedChannel.
+    """
+    channels = [
+        DerivedChannel(
+            "TOTAL_FUEL_TRIM_1", "Total Fuel Trim - Bank 1", "percent",
+            {"SHORT_FUEL_TRIM_1": None, "LONG_FUEL_TRIM_1": None}, _total_trim_1,
+        ),
+        DerivedChannel(
+            "TOTAL_FUEL_TRIM_2", "Total Fuel Trim - Bank 2", "percent",
+            {"SHORT_FUEL_TRIM_2": None, "LONG_FUEL_TRIM_2": None}, _total_trim_2,
+        ),
+        DerivedChannel(
+            "FUEL_TRIM_BANK_DELTA", "Total Fuel Trim - Bank 1 minus Bank 2",
+            "percent",
+            {
+                "SHORT_FUEL_TRIM_1": None,
+                "LONG_FUEL_TRIM_1": None,
+                "SHORT_FUEL_TRIM_2": None,
+                "LONG_FUEL_TRIM_2": None,
+            },
+            _trim_delta,
+        ),
+        DerivedChannel(
+            "VOLUMETRIC_EFFICIENCY", "Estimated Volumetric Efficiency", "percent",
+            {
+                "MAF": None,
+                "RPM": None,
+                "INTAKE_PRESSURE": None,
+                "INTAKE_TEMP": DEFAULT_INTAKE_TEMP,
+            },
+            volumetric_efficiency(displacement),
+        ),
+        DerivedChannel(
+            "EQUIVALENCE_RATIO", "Commanded Equivalence Ratio (phi)", "ratio",
+            {"COMMANDED_EQUIV_RATIO": 1.0}, _equivalence_ratio,
+        ),
+        DerivedChannel(
+            "LAMBDA", "Commanded Lambda", "ratio",
+            {"COMMANDED_EQUIV_RATIO": 1.0}, _lambda,
+        ),
+        DerivedChannel(
+            "FUEL_FLOW", "Estimated Fuel Flow", "liter per hour",
+            {"MAF": None, "COMMANDED_EQUIV_RATIO": 1.0}, _fuel_flow,
+        ),
+    ]
+    return {channel.name: channel for channel in channels}
+
+
+DERIVED_CHANNELS = build_derived_channels()
+
+
+class DerivedEngine:
+    """
+    Evaluates derived channels on every batch of new samples.
+
+    Input values carry over between batches, so each batch costs the same
+    whatever the length of the session.
+
+    Attributes:
+        channels (dict): Name mapped to each DerivedChannel evaluated.
+        inputs (list): Names of every channel some formula reads.
+        batches (int): Batches evaluated.
+    """
+
+    def __init__(self, hub, store, channels=()):
+        """
+        Args:
+            hub (Hub): Where sensor samples arrive and results are published.
+            store (TimeSeriesStore): Where results are appended.
+            channels (list): The DerivedChannels to evaluate.
+        """
+        self.hub = hub
+        self.store = store
+        self.channels = {}
+        self.inputs = []
+        self.batches = 0
+        self._column = {}
+        self._last = np.empty(0)
+        self._lock = threading.Lock()
+        self._subscription = None
+        self._thread = None
+        for channel in channels:
+            self.add_channel(channel)
+
+    def add_channel(self, channel, rate=None):
+        """
+        Starts evaluating a derived channel.
+
+        Args:
+            channel (DerivedChannel): The channel; a store channel of the same
+                name is added for its results.
+            rate (float): Expected results per second; sizes the store
+                channel for the retention period like a polled channel.
+        """
+        self.store.add_channel(channel.name, rate=rate)
+        with self._lock:
+            self.channels[channel.name] = channel
+            self._reindex()
+
+    def remove_channel(self, name):
+        """
+        Stops evaluating a derived channel.
+
+        Args:
+            name (str): Channel name.
+        """
+        with self._lock:
+            if self.channels.pop(name, None) is not None:
+                self._reindex()
+
+    def _reindex(self):
+        # keep held input values across a change of inputs
+        held = dict(zip(self.inputs, self._last))
+        self.inputs = sorted(
+            {name for c in self.channels.values() for name in c.inputs}
+        )
+        self._column = {name: i for i, name in enumerate(self.inputs)}
+        self._last = np.array([held.get(name, np.nan) for name in self.inputs])
+
+    def start(self):
+        """
+        Subscribes to the hub and starts evaluating.
+
+        Returns:
+            DerivedEngine: self, for chaining.
+        """
+        # derived values must not be lost, so the producer waits briefly
+        self._subscription = self.hub.subscribe("derived", policy=BLOCK)
+        self._thread = threading.Thread(
+            target=self._run, name="derived-channels", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Unsubscribes and waits for the thread to finish.
+        """
+        if self._subscription is not None:
+            self.hub.unsubscribe(self._subscription)
+            self._thread.join(2.0)
+            self._subscription = None
+
+    def _run(self):
+        while True:
+            first = self._subscription.get()
+            if first is None:
+                return
+            self.process([first] + self._subscription.drain())
+
+    def process(self, samples):
+        """
+        Evaluates every derived channel over a batch of samples.
+
+        Args:
+            samples (list): Samples in time order; those without any input
+                are ignored.
+
+        Returns:
+            dict: Channel name mapped to its values at the times of the
+            samples used.
+        """
+        with self._lock:
+            return self._process(samples)
+
+    def _process(self, samples):
+        samples = [
+            sample for sample in samples
+            if any(name in self._column for name in sample.values)
+        ]
+        if not samples:
+            return {}
+        rows = np.full((len(samples) + 1, len(self.inputs)), np.nan)
+        rows[0] = self._last
+        for row, sample in enumerate(samples, 1):
+            for name, value in sample.values.items():
+                column = self._column.get(name)
+                if column is not None and value is not None:
+                    rows[row, column] = value
+        rows = hold_forward(rows)
+        self._last = rows[-1]
+        rows = rows[1:]
+
+        results = {}
+        for channel in self.channels.values():
+            arguments = {}
+            for name, default in channel.inputs.items():
+                column = rows[:, self._column[name]]
+                if default is not None:
+                    column = np.where(np.isnan(column), default, column)
+                arguments[name] = column
+            results[channel.name] = channel.formula(**arguments)
+
+        for row, sample in enumerate(samples):
+            values = {}
+            for name, column in results.items():
+                value = float(column[row])
+                values[name] = None if np.isnan(value) else value
+            self.store.append_many(sample.timestamp, values)
+            self.hub.publish(
+                Sample(sample.timestamp, values), exclude=self._subscription
+            )
+        self.batches += 1
+        return results
@@ -0,0 +1,152 @@
+"""
+This module discovers the sensors a vehicle supports from its support bitmaps.
+
+PIDs ``00``, ``20``, ``40`` ... ``C0`` of Mode 01 (and the same MIDs of Mode
+06) each return a 32-bit map of which of the next 32 PIDs the ECU answers.
+Reading those maps takes a handful of requests, where probing every sensor
+costs one request each and a full timeout for every unsupported one.
+"""
+import time
+
+from datastreams.batch_query import CAN_PROTOCOLS, MAX_PIDS_PER_REQUEST, rejected
+
+# PIDs whose answer is a support bitmap for the 32 PIDs that follow.
+SUPPORT_PIDS = (0x00, 0x20, 0x40, 0x60, 0x80, 0xA0, 0xC0)
+
+# Times a support request is sent before its ranges count as unsupported;
+# one NO DATA or bus error must not hide a whole service.
+SUPPORT_ATTEMPTS = 3
+
+
+def decode_bitmap(base, bitmap):
+    """
+    Decodes one support bitmap.
+
+    Args:
+        base (int): The support PID that returned the bitmap.
+        bitmap (bytes): The four data bytes of the answer.
+
+    Returns:
+        set: Supported PIDs, from ``base + 1`` to ``base + 32``.
+    """
+    value = int.from_bytes(bitmap[:4], "big")
+    return {base + 32 - bit for bit in range(32) if value & (1 << bit)}
+
+
+def parse_support_messages(messages, mode):
+    """
+    Collects the supported PIDs from support-bitmap responses.
+
+    A response may carry several ``<pid> <4 bytes>`` groups when support PIDs
+    were batched, and several ECUs may answer; their bitmaps are merged.
+
+    Args:
+        messages (list): Parsed messages for a support request.
+        mode (int): The service, 1 or 6.
+
+    Returns:
+        tuple: The set of supported PIDs and the set of support PIDs answered.
+    """
+    supported = set()
+    answered = set()
+    for message in messages:
+        data = message.data
+        if not data or data[0] != 0x40 + mode:
+            continue
+        for i in range(1, len(data) - 4, 5):
+            base = data[i]
+            if base not in SUPPORT_PIDS:
+                break
+            answered.add(base)
+            supported |= decode_bitmap(base, data[i + 1:i + 5])
+    return supported, answered
+
+
+def _read_support(connection, request, mode):
+    # retried while unanswered, but not once the ECU has refused it
+    for _ in range(SUPPORT_ATTEMPTS):
+        messages = connection.send_and_parse(request)
+        found, answered = parse_support_messages(messages, mode)
+        if answered or rejected(messages):
+            break
+    return found, answered
+
+
+def read_supported_pids(connection, mode=1, batching=None):
+    """
+    Reads the support bitmaps of one service.
+
+    On CAN all support PIDs are requested six to a request, because ECUs
+    simply leave out the ranges they do not have. Otherwise the chain is
+    followed one range at a time, only while the previous map says the next
+    range exists. An unanswered request is retried ``SUPPORT_ATTEMPTS``
+    times before its ranges are taken as unsupported.
+
+    Args:
+        connection: A connection with ``send_and_parse`` and ``protocol_id``.
+        mode (int): The service, 1 or 6.
+        batching (bool): Force batched requests on or off.
+
+    Returns:
+        set: Every supported PID of the service, support PIDs included.
+    """
+    if batching is None:
+        batching = connection.protocol_id() in CAN_PROTOCOLS
+    supported = _read_support_ranges(connection, mode, batching)
+    if not supported:
+        print(f"No supported PIDs found in Mode {mode:02X}")
+    return supported
+
+
+def _read_support_ranges(connection, mode, batching):
+    supported = set()
+    if batching:
+        for i in range(0, len(SUPPORT_PIDS), MAX_PIDS_PER_REQUEST):
+            group = SUPPORT_PIDS[i:i + MAX_PIDS_PER_REQUEST]
+            if i and group[0] not in supported:
+                break
+            request = f"{mode:02X}" + "".join(f"{pid:02X}" for pid in group)
+            found, answered = _read_support(connection, request, mode)
+            if i == 0 and not answered:
+                # the ECU rejected the batch, walk the chain instead
+                return _read_support_ranges(connection, mode, batching=False)
+            supported |= found
+        return supported
+
+    for base in SUPPORT_PIDS:
+        if base and base not in supported:
+            break
+        found, _ = _read_support(connection, f"{mode:02X}{base:02X}", mode)
+        if not found:
+            break
+        supported |= found
+    return supported
+
+
+def discover_supported(connection, candidates):
+    """
+    Filters a sensor list down to the commands the vehicle supports.
+
+    Args:
+        connection: A connection with ``send_and_parse`` and ``protocol_id``.
+        candidates (list): OBD commands the datastream would like to show.
+
+    Returns:
+        list: The supported candidates, in their original order and without
+        duplicates.
+    """
+    started = time.monotonic()
+    modes = sorted({command.mode for command in candidates})
+    supported = {mode: read_supported_pids(connection, mode) for mode in modes}
+
+    sensors = []
+    for command in candidates:
+        if command.pid in supported[command.mode] and command not in sensors:
+            sensors.append(command)
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Discovered {len(sensors)} of {len(candidates)} sensors "
+        f"in {elapsed:.2f} s"
+    )
+    return sensors
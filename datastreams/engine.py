@@ -0,0 +1,269 @@
+"""
+This module is the single acquisition core behind every datastream.
+
+``DatastreamEngine`` owns one scheduler, one time-series store and one
+publish hub. Profiles are added to it at any time; a command that several
+profiles share is polled once, at the fastest rate any of them asks for,
+and every front-end (Tk viewer, web dashboard, headless recorder) reads the
+same store or subscribes to the same hub. Derived channels a profile asks
+for are computed from that stream and stored alongside the sensors, and
+the misfire monitors of every cylinder are read together in one Mode 06
+scan whenever they are due.
+"""
+import obd
+
+from datastreams.batch_query import BatchQueryEngine
+from datastreams.derived import (
+    DEFAULT_DISPLACEMENT,
+    DerivedEngine,
+    build_derived_channels,
+)
+from datastreams.discovery import read_supported_pids
+from datastreams.misfire import MisfireEngine, is_misfire_monitor
+from datastreams.pubsub import Hub, Producer
+from datastreams.scheduler import DEFAULT_RATES, FALLBACK_RATE, PollingScheduler
+from datastreams.timeseries_store import DEFAULT_RETENTION, TimeSeriesStore
+
+
+class DatastreamEngine:
+    """
+    Polls the sensors of any number of profiles through one connection.
+
+    Example:
+        engine = DatastreamEngine(connection)
+        engine.add_profile(get_profile("air-fuel"))
+        engine.add_profile(get_profile("misfire"))
+        engine.start()
+
+    Attributes:
+        connection: The OBD connection.
+        queries (BatchQueryEngine): Sends the scheduler's queries.
+        scheduler (PollingScheduler): Polls every channel.
+        store (TimeSeriesStore): Every sample, one channel per command name.
+        hub (Hub): Publishes every poll cycle.
+        derived (DerivedEngine): Computes the profiles' derived channels.
+        profiles (dict): Profile name mapped to its supported commands and
+            derived channels.
+    """
+
+    def __init__(self, connection, retention=DEFAULT_RETENTION, spill_dir=None,
+                 displacement=DEFAULT_DISPLACEMENT):
+        """
+        Args:
+            connection: A connection with ``query``, ``send_and_parse`` and
+                ``protocol_id``.
+            retention (float): Seconds kept per channel.
+            spill_dir (str): Directory for samples older than the retention.
+            displacement (float): Engine displacement in liters, for
+                volumetric efficiency.
+        """
+        self.connection = connection
+        self.queries = BatchQueryEngine(connection)
+        self.scheduler = PollingScheduler(self.queries)
+        self.store = TimeSeriesStore(retention, spill_dir)
+        self.hub = Hub()
+        self.producer = Producer(self.scheduler, self.hub, self.store)
+        self.derived = DerivedEngine(self.hub, self.store)
+        self.derived_channels = build_derived_channels(displacement)
+        self.profiles = {}
+        self._inputs = {}
+        self._supported = {}
+
+    def supported(self, commands):
+        """
+        Filters commands down to those the vehicle supports.
+
+        Support bitmaps are read once per service and reused by every
+        profile.
+
+        Args:
+            commands (list): OBD commands.
+
+        Returns:
+            list: The supported commands, in order and without duplicates.
+        """
+        found = []
+        for command in commands:
+            if command.mode not in self._supported:
+                self._supported[command.mode] = read_supported_pids(
+                    self.connection, command.mode
+                )
+            if command.pid in self._supported[command.mode] and command not in found:
+                found.append(command)
+        return found
+
+    def add_profile(self, profile):
+        """
+        Starts polling a profile's supported sensors and computing its
+        derived channels.
+
+        A derived channel is skipped when the vehicle lacks one of its
+        required inputs; inputs the profile does not list are polled at
+        their default rate but not shown.
+
+        Args:
+            profile (SensorProfile): The profile.
+
+        Returns:
+            list: The profile's supported commands and derived channels.
+        """
+        commands = self.supported(profile.commands)
+        derived = []
+        inputs = []
+        for name in profile.derived:
+            channel = self.derived_channels[name]
+            available = self.supported([obd.commands[n] for n in channel.inputs])
+            missing = [
+                n for n, default in channel.inputs.items()
+                if default is None and obd.commands[n] not in available
+            ]
+            if missing:
+                print(f"Skipping {name}: {', '.join(missing)} not supported")
+                continue
+            derived.append(channel)
+            inputs += [c for c in available if c not in commands + inputs]
+
+        settings = {
+            command: (rate, priority) for command, rate, priority in profile.sensors
+        }
+        for command in commands + inputs:
+            rate, priority = settings.get(command, (None, None))
+            existing = self.scheduler.channels.get(command)
+            if existing is not None:
+                # shared with another profile: poll once, as fast as either asks
+                rate = max(existing.rate, rate or 0)
+                priority = max(existing.priority, priority or 0)
+            elif rate is None:
+                rate = DEFAULT_RATES.get(command, FALLBACK_RATE)[0]
+            # the store needs the channel before the producer samples it
+            self.store.add_channel(command.name, rate=rate)
+            channel = self.scheduler.add_channel(command, rate, priority)
+            if existing is not None:
+                channel.next_due = existing.next_due
+        for channel in derived:
+            # one result per poll cycle that reads any of the inputs
+            rate = sum(
+                self.scheduler.channels[obd.commands[name]].rate
+                for name in channel.inputs
+                if obd.commands[name] in self.scheduler.channels
+            )
+            self.derived.add_channel(channel, rate=rate)
+        self._scan_misfires()
+        self.profiles[profile.name] = commands + derived
+        self._inputs[profile.name] = inputs
+        print(
+            f"Profile {profile.name}: {len(commands)} of "
+            f"{len(profile.commands)} sensors supported, {len(derived)} of "
+            f"{len(profile.derived)} derived channels"
+        )
+        return commands + derived
+
+    def remove_profile(self, name):
+        """
+        Stops polling the sensors, and computing the derived channels, only
+        this profile uses.
+
+        Args:
+            name (str): Profile name.
+        """
+        channels = self.profiles.pop(name, []) + self._inputs.pop(name, [])
+        still_used = {
+            c for others in list(self.profiles.values()) + list(self._inputs.values())
+            for c in others
+        }
+        for channel in channels:
+            if channel in still_used:
+                continue
+            if channel.name in self.derived.channels:
+                self.derived.remove_channel(channel.name)
+            else:
+                self.scheduler.remove_channel(channel)
+        self._scan_misfires()
+
+    def _scan_misfires(self):
+        # the polled misfire monitors are answered by one scan of them all
+        monitors = [c for c in list(self.scheduler.channels) if is_misfire_monitor(c)]
+        misfire = self.queries.misfire
+        if misfire is not None and set(misfire.commands) == set(monitors):
+            return
+        self.queries.misfire = (
+            MisfireEngine(self.connection, monitors) if monitors else None
+        )
+
+    @property
+    def commands(self):
+        """
+        list: Every polled command, in the order profiles added them.
+        """
+        return list(self.scheduler.channels)
+
+    @property
+    def channels(self):
+        """
+        list: The commands and derived channels the profiles show, in the
+        order profiles added them; inputs polled only for a derived channel
+        are left out.
+        """
+        channels = []
+        for profile in self.profiles.values():
+            channels += [c for c in profile if c not in channels]
+        return channels
+
+    def start(self):
+        """
+        Starts the background producer and derived channels.
+
+        Returns:
+            DatastreamEngine: self, for chaining.
+        """
+        # subscribe before the producer primes, so the first cycle is derived
+        self.derived.start()
+        self.producer.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the background producer and derived channels.
+        """
+        self.producer.stop()
+        self.derived.stop()
+
+
+def engine_from_config(profile_names):
+    """
+    Connects to the adapter broker and starts an engine for some profiles,
+    with the settings from the environment.
+
+    Args:
+        profile_names (list): Built-in profile names or profile file paths.
+
+    Returns:
+        DatastreamEngine: The running engine.
+    """
+    from config import (
+        SERIAL_PORT,
+        BAUD_RATE,
+        OBD_BROKER_PORT,
+        OBD_BROKER_AUTHKEY,
+        OBD_CAPTURE_FILE,
+        DATASTREAM_RETENTION,
+        DATASTREAM_SPILL_DIR,
+        ENGINE_DISPLACEMENT,
+    )
+    from datastreams.profiles import get_profile
+    from utils.obd_broker import connect_broker
+
+    # Share the ELM327 device through the adapter broker
+    connection = connect_broker(
+        SERIAL_PORT,
+        BAUD_RATE,
+        OBD_BROKER_PORT,
+        authkey=OBD_BROKER_AUTHKEY,
+        capture_path=OBD_CAPTURE_FILE,
+    )
+    engine = DatastreamEngine(
+        connection, DATASTREAM_RETENTION, DATASTREAM_SPILL_DIR, ENGINE_DISPLACEMENT
+    )
+    for name in profile_names:
+        engine.add_profile(get_profile(name))
+    return engine.start()
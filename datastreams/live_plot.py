@@ -0,0 +1,154 @@
+"""
+This module draws live datastream plots with blitting.
+
+``BlittedPlotter`` creates one line per channel once and, on each frame,
+only moves the line data and copies the lines onto a cached background of
+the axes, ticks and titles. The x axis is fixed at the last ``window``
+seconds, so the background stays valid from frame to frame; it is redrawn
+only when a value leaves its axis range, a title changes or the window is
+resized. Frames run on a canvas timer at a capped rate, independent of how
+fast samples arrive, and cost the same however long the session has run.
+"""
+import time
+
+import numpy as np
+
+# Frames drawn per second at most.
+DEFAULT_MAX_FPS = 10.0
+
+# Seconds of data shown.
+DEFAULT_WINDOW = 30.0
+
+# Fraction of the data range added above and below when rescaling.
+Y_MARGIN = 0.1
+
+# Rescale when the fitted range is less than this fraction of the y range.
+MIN_FILL = 0.25
+
+
+class BlittedPlotter:
+    """
+    Draws one subplot per channel and refreshes them by blitting.
+
+    Example:
+        plotter = BlittedPlotter(fig, ["Engine RPM"], source, window=30)
+        plotter.start()
+
+    Attributes:
+        frames (int): Frames drawn.
+        full_draws (int): Frames that needed the background redrawn.
+    """
+
+    def __init__(self, fig, titles, source, window=DEFAULT_WINDOW,
+                 max_fps=DEFAULT_MAX_FPS, ylabel="Value"):
+        """
+        Args:
+            fig (matplotlib.figure.Figure): The figure, embedded in a canvas.
+            titles (list): Subplot titles, one per channel.
+            source (callable): Called with ``window`` on every frame; returns
+                a ``(timestamps, values)`` pair per channel, timestamps in
+                epoch seconds.
+            window (float): Seconds shown.
+            max_fps (float): Frames drawn per second at most.
+            ylabel (str): Label of every y axis.
+        """
+        self.fig = fig
+        self.source = source
+        self.window = window
+        self.max_fps = max_fps
+        self.frames = 0
+        self.full_draws = 0
+        self.axes = []
+        self.lines = []
+        for index, title in enumerate(titles):
+            axis = fig.add_subplot(len(titles), 1, index + 1)
+            (line,) = axis.plot([], [], animated=True)
+            axis.set_xlim(-window, 0)
+            axis.set_title(title)
+            axis.set(xlabel="Seconds ago", ylabel=ylabel)
+            self.axes.append(axis)
+            self.lines.append(line)
+        fig.tight_layout()
+        self._background = None
+        self._timer = None
+        fig.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def start(self):
+        """
+        Starts drawing frames on the canvas timer.
+
+        Returns:
+            BlittedPlotter: self, for chaining.
+        """
+        self._timer = self.fig.canvas.new_timer(interval=int(1000 / self.max_fps))
+        self._timer.add_callback(self.update)
+        self._timer.start()
+        return self
+
+    def stop(self):
+        """
+        Stops drawing frames.
+        """
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+
+    def set_title(self, index, title):
+        """
+        Changes a subplot title; the background is redrawn if it differs.
+
+        Args:
+            index (int): Channel index.
+            title (str): The new title.
+        """
+        if self.axes[index].get_title() != title:
+            self.axes[index].set_title(title)
+            self._background = None
+
+    def update(self):
+        """
+        Draws one frame with the latest data from the source.
+        """
+        now = time.time()
+        for axis, line, (timestamps, values) in zip(
+            self.axes, self.lines, self.source(self.window)
+        ):
+            # copied, since the source's arrays keep changing underneath
+            values = np.array(values, dtype=float)
+            line.set_data(np.asarray(timestamps) - now, values)
+            if self._rescale(axis, values):
+                self._background = None
+
+        if self._background is None:
+            # draw_event captures the new background and draws the lines
+            self.full_draws += 1
+            self.fig.canvas.draw()
+        else:
+            canvas = self.fig.canvas
+            canvas.restore_region(self._background)
+            for axis, line in zip(self.axes, self.lines):
+                axis.draw_artist(line)
+            canvas.blit(self.fig.bbox)
+            canvas.flush_events()
+        self.frames += 1
+
+    def _rescale(self, axis, values):
+        finite = values[np.isfinite(values)]
+        if not len(finite):
+            return False
+        low, high = finite.min(), finite.max()
+        margin = (high - low) * Y_MARGIN or abs(high) * Y_MARGIN or 1.0
+        bottom, top = axis.get_ylim()
+        # keep the range while the data fits and fills a fair part of it
+        fitted = high - low + 2 * margin
+        if bottom <= low and high <= top and fitted >= MIN_FILL * (top - bottom):
+            return False
+        axis.set_ylim(low - margin, high + margin)
+        return True
+
+    def _on_draw(self, event):
+        canvas = self.fig.canvas
+        self._background = canvas.copy_from_bbox(self.fig.bbox)
+        for axis, line in zip(self.axes, self.lines):
+            axis.draw_artist(line)
+        canvas.blit(self.fig.bbox)
@@ -0,0 +1,398 @@
+"""
+This module acquires Mode 06 misfire monitor results for every cylinder.
+
+Each cylinder's monitor (MID ``A2`` to ``AD``) answers with 9-byte test
+records; ``0B`` is the average misfire count over the last ten driving
+cycles and ``0C`` the count for the current cycle. ``MisfireEngine`` reads
+all supported cylinders in as few requests as the ECU accepts, decodes every
+record of a response in one array operation, and stores the counts in
+fixed-width arrays with one row per scan and NaN where a cylinder did not
+answer, so every column stays aligned with the timestamps. Misfire rates and
+cylinder imbalance are computed over the whole window at once.
+"""
+import time
+
+import numpy as np
+from obd.OBDResponse import OBDResponse
+from obd.protocols.protocol import Message
+from obd.UnitsAndScaling import UAS_IDS
+
+from datastreams.batch_query import CAN_PROTOCOLS, MAX_PIDS_PER_REQUEST, rejected
+
+# Bytes per test record: MID, TID, UAS, value, minimum, maximum (2 each).
+TEST_RECORD_LENGTH = 9
+
+TID_MISFIRE_AVERAGE = 0x0B
+TID_MISFIRE_COUNT = 0x0C
+
+# Units and scaling ID of plain counts, decoded without a lookup.
+UAS_COUNTS = 0x24
+
+# Scans kept; at a few scans per second this is several minutes.
+DEFAULT_CAPACITY = 1024
+
+
+def split_tests(messages, mids):
+    """
+    Splits Mode 06 responses into one set of messages per MID, the way
+    python-obd expects a single-MID answer.
+
+    Args:
+        messages (list): Parsed messages; several MIDs and several ECUs may
+            be mixed.
+        mids (set): MIDs wanted.
+
+    Returns:
+        dict: MID mapped to its messages, only for MIDs that answered.
+    """
+    found = {}
+    for message in messages:
+        data = bytes(message.data)
+        if not data or data[0] != 0x46:
+            continue
+        for start in range(1, len(data) - TEST_RECORD_LENGTH + 1, TEST_RECORD_LENGTH):
+            mid = data[start]
+            if mid not in mids:
+                continue
+            singles = found.setdefault(mid, {})
+            single = singles.get(id(message))
+            if single is None:
+                single = singles[id(message)] = Message(message.frames)
+                single.ecu = message.ecu
+                single.data = bytearray([0x46])
+            single.data += data[start:start + TEST_RECORD_LENGTH]
+    return {mid: list(singles.values()) for mid, singles in found.items()}
+
+
+def parse_tests(messages):
+    """
+    Decodes every test record in a set of Mode 06 responses.
+
+    Args:
+        messages (list): Parsed messages; several MIDs and several ECUs may
+            be mixed.
+
+    Returns:
+        tuple: ``(mids, tids, values)`` arrays with one entry per record;
+        ``values`` holds the test value after units and scaling.
+    """
+    blocks = []
+    for message in messages:
+        data = bytes(message.data)
+        if not data or data[0] != 0x46:
+            continue
+        usable = (len(data) - 1) // TEST_RECORD_LENGTH * TEST_RECORD_LENGTH
+        blocks.append(
+            np.frombuffer(data, dtype=np.uint8, count=usable, offset=1)
+            .reshape(-1, TEST_RECORD_LENGTH)
+        )
+    if not blocks:
+        empty = np.empty(0, dtype=np.uint8)
+        return empty, empty, np.empty(0)
+    records = np.concatenate(blocks)
+    values = (records[:, 3].astype(np.uint16) << 8 | records[:, 4]).astype(float)
+    # misfire monitors report counts; anything else goes through python-obd
+    for row in np.flatnonzero(records[:, 2] != UAS_COUNTS):
+        scaling = UAS_IDS.get(int(records[row, 2]))
+        values[row] = (
+            scaling(bytes(records[row, 3:5])).magnitude if scaling else np.nan
+        )
+    return records[:, 0], records[:, 1], values
+
+
+class MisfireEngine:
+    """
+    Scans the misfire monitors of every cylinder into aligned arrays.
+
+    Example:
+        engine = MisfireEngine(connection, supported_sensors)
+        engine.scan()
+        times, rates = engine.rates(seconds=10)
+
+    The datastream engine attaches one to its ``BatchQueryEngine``, which
+    then answers every due misfire monitor from a single scan.
+
+    Attributes:
+        commands (list): The misfire monitor commands scanned, one column
+            each, in MID order.
+        cylinders (list): Cylinder numbers, in column order.
+        requests (int): Requests sent so far.
+    """
+
+    def __init__(self, connection, commands, capacity=DEFAULT_CAPACITY,
+                 batching=None):
+        """
+        Args:
+            connection: A connection with ``send_and_parse`` and
+                ``protocol_id``.
+            commands (list): ``MONITOR_MISFIRE_CYLINDER_n`` commands the
+                vehicle supports.
+            capacity (int): Scans kept.
+            batching (bool): Force several MIDs per request on or off;
+                by default it is tried on CAN and dropped if the ECU
+                rejects a batch.
+        """
+        self.connection = connection
+        # columns are found by binary search on the MIDs
+        self.commands = sorted(commands, key=lambda command: command.pid)
+        self.mids = np.array([command.pid for command in self.commands])
+        self.cylinders = [int(mid) - 0xA1 for mid in self.mids]
+        if batching is None:
+            batching = connection.protocol_id() in CAN_PROTOCOLS
+        self.batching = batching
+        self.capacity = capacity
+        self.requests = 0
+        width = len(self.commands)
+        self.timestamps = np.full(capacity, np.nan)
+        self.counts = np.full((capacity, width), np.nan)
+        self.averages = np.full((capacity, width), np.nan)
+        self.written = 0
+
+    def _request(self, mids):
+        self.requests += 1
+        command = "06" + "".join(f"{mid:02X}" for mid in mids)
+        return self.connection.send_and_parse(command)
+
+    def _read(self):
+        if not self.batching:
+            messages = []
+            for mid in self.mids:
+                messages += self._request([mid])
+            return messages
+
+        messages = []
+        for start in range(0, len(self.mids), MAX_PIDS_PER_REQUEST):
+            answer = self._request(self.mids[start:start + MAX_PIDS_PER_REQUEST])
+            if rejected(answer):
+                # only one non-support MID per request on this ECU
+                self.batching = False
+            messages += answer
+        mids, _, _ = parse_tests(messages)
+        # a MID lost to NO DATA or a bus error is asked for again on its own
+        for mid in np.setdiff1d(self.mids, mids):
+            messages += self._request([mid])
+        return messages
+
+    def scan(self):
+        """
+        Reads every cylinder once and appends a row.
+
+        Returns:
+            numpy.ndarray: This scan's current-cycle counts per cylinder,
+            NaN for cylinders that did not answer.
+        """
+        return self._scan(self._read())
+
+    def query_all(self):
+        """
+        Scans every cylinder once and answers like ``BatchQueryEngine``.
+
+        Returns:
+            dict: Every scanned command mapped to its OBDResponse, null for
+            cylinders that did not answer.
+        """
+        messages = self._read()
+        self._scan(messages)
+        found = split_tests(messages, {int(mid) for mid in self.mids})
+        return {
+            command: command(found[command.pid]) if command.pid in found
+            else OBDResponse(command, [])
+            for command in self.commands
+        }
+
+    def _scan(self, messages):
+        mids, tids, values = parse_tests(messages)
+        row = self.written % self.capacity
+        self.timestamps[row] = time.time()
+        # column of each record; records for other MIDs are dropped
+        columns = np.searchsorted(self.mids, mids)
+        columns = np.minimum(columns, len(self.mids) - 1)
+        known = self.mids[columns] == mids
+        for tid, target in (
+            (TID_MISFIRE_COUNT, self.counts),
+            (TID_MISFIRE_AVERAGE, self.averages),
+        ):
+            target[row] = np.nan
+            selected = known & (tids == tid)
+            target[row, columns[selected]] = values[selected]
+        self.written += 1
+        return self.counts[row].copy()
+
+    def run(self, callback=None, stop_event=None, interval=0.0):
+        """
+        Scans until ``stop_event`` is set.
+
+        Args:
+            callback (callable): Called with each scan's counts.
+            stop_event (threading.Event): Stops the loop when set.
+            interval (float): Seconds to wait between scans.
+        """
+        while stop_event is None or not stop_event.is_set():
+            counts = self.scan()
+            if callback is not None:
+                callback(counts)
+            if interval:
+                time.sleep(interval)
+
+    def window(self, seconds=None):
+        """
+        Returns the stored scans in time order.
+
+        Args:
+            seconds (float): Only scans from the last ``seconds``; None for
+                all.
+
+        Returns:
+            tuple: ``(timestamps, counts, averages)``; the arrays have one
+            row per scan and one column per cylinder.
+        """
+        if self.written <= self.capacity:
+            order = np.arange(self.written)
+        else:
+            order = np.arange(self.written, self.written + self.capacity)
+            order %= self.capacity
+        timestamps = self.timestamps[order]
+        keep = slice(None)
+        if seconds is not None and len(timestamps):
+            keep = timestamps >= timestamps[-1] - seconds
+        return timestamps[keep], self.counts[order][keep], self.averages[order][keep]
+
+    def rates(self, seconds=None):
+        """
+        Computes the misfire rate of every cylinder between consecutive scans.
+
+        Args:
+            seconds (float): Window length; None for all stored scans.
+
+        Returns:
+            tuple: ``(times, rates)``; see ``misfire_rates``.
+        """
+        timestamps, counts, _ = self.window(seconds)
+        return misfire_rates(timestamps, counts)
+
+    def imbalance(self, seconds=None):
+        """
+        Compares each cylinder's misfires with the engine average.
+
+        Args:
+            seconds (float): Window length; None for all stored scans.
+
+        Returns:
+            numpy.ndarray: See ``cylinder_imbalance``.
+        """
+        return cylinder_imbalance(self.rates(seconds)[1])
+
+    def suspect_cylinders(self, seconds=10.0, ratio=3.0, min_rate=0.05):
+        """
+        Lists cylinders misfiring far more than the others.
+
+        Args:
+            seconds (float): Window length.
+            ratio (float): Imbalance at or above which a cylinder is flagged.
+            min_rate (float): Misfires per second below which nothing is
+                flagged.
+
+        Returns:
+            list: Cylinder numbers.
+        """
+        _, rates = self.rates(seconds)
+        return find_suspects(rates, self.cylinders, ratio, min_rate)
+
+
+def is_misfire_monitor(command):
+    """
+    Checks whether a command reads a cylinder's misfire monitor.
+    """
+    return command.mode == 6 and 0xA2 <= (command.pid or 0) <= 0xAD
+
+
+def misfire_rates(timestamps, counts):
+    """
+    Computes misfire rates between consecutive scans.
+
+    Intervals where a count is missing or went down (a new driving cycle
+    reset the counter) are NaN.
+
+    Args:
+        timestamps (numpy.ndarray): Scan times.
+        counts (numpy.ndarray): Current-cycle counts, one row per scan and
+            one column per cylinder.
+
+    Returns:
+        tuple: ``(times, rates)``; ``times`` are interval ends and ``rates``
+        misfires per second, one column per cylinder.
+    """
+    if len(timestamps) < 2:
+        return timestamps[:0], counts[:0]
+    deltas = np.diff(counts, axis=0)
+    deltas[deltas < 0] = np.nan
+    intervals = np.diff(timestamps)[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return timestamps[1:], deltas / intervals
+
+
+def cylinder_imbalance(rates):
+    """
+    Compares each cylinder's misfires with the engine average.
+
+    Args:
+        rates (numpy.ndarray): Rates from ``misfire_rates``.
+
+    Returns:
+        numpy.ndarray: Misfires of each cylinder divided by the mean over all
+        cylinders; 1 is average, NaN when nothing misfired.
+    """
+    if not len(rates):
+        return np.full(rates.shape[1], np.nan)
+    totals = np.nansum(rates, axis=0)
+    mean = totals.mean()
+    if mean == 0:
+        return np.full(rates.shape[1], np.nan)
+    return totals / mean
+
+
+def find_suspects(rates, cylinders, ratio=3.0, min_rate=0.05):
+    """
+    Lists cylinders misfiring far more than the others.
+
+    Args:
+        rates (numpy.ndarray): Rates from ``misfire_rates``.
+        cylinders (list): Cylinder number of each column.
+        ratio (float): Imbalance at or above which a cylinder is flagged.
+        min_rate (float): Misfires per second below which nothing is flagged.
+
+    Returns:
+        list: Cylinder numbers.
+    """
+    if not len(rates):
+        return []
+    imbalance = cylinder_imbalance(rates)
+    with np.errstate(invalid="ignore"):
+        mean_rates = np.nanmean(rates, axis=0)
+        flagged = (imbalance >= ratio) & (mean_rates >= min_rate)
+    return [cylinders[i] for i in np.flatnonzero(flagged)]
+
+
+def misfire_suspects(store, commands, seconds=10.0):
+    """
+    Finds misfiring cylinders from misfire monitor channels in a store.
+
+    Args:
+        store (TimeSeriesStore): Store with a channel per command name.
+        commands (list): Commands of any kind; only misfire monitors are
+            used.
+        seconds (float): Window length.
+
+    Returns:
+        list: Cylinder numbers.
+    """
+    monitors = [command for command in commands if is_misfire_monitor(command)]
+    if not monitors:
+        return []
+    # the monitors are polled together; sample them all at the first one's times
+    timestamps, _ = store.window(monitors[0].name, seconds)
+    timestamps, counts = store.aligned(
+        [command.name for command in monitors], timestamps=timestamps.copy()
+    )
+    _, rates = misfire_rates(timestamps, counts)
+    return find_suspects(rates, [command.pid - 0xA1 for command in monitors])
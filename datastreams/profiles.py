@@ -0,0 +1,197 @@
+"""
+This module defines the sensor profiles a datastream can show.
+
+A profile names a set of OBD commands, optionally with their own polling
+rate and priority, and any derived channels (see ``datastreams.derived``) to
+compute from them. The built-in profiles are ``air-fuel`` and ``misfire``;
+shop-defined profiles are JSON files, or YAML when PyYAML is installed:
+
+    {
+        "name": "boost",
+        "sensors": [
+            "RPM",
+            {"command": "INTAKE_PRESSURE", "rate": 20, "priority": 3},
+            "VOLUMETRIC_EFFICIENCY"
+        ]
+    }
+"""
+import json
+import os
+
+import obd
+
+from datastreams.derived import DERIVED_CHANNELS
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+class SensorProfile:
+    """
+    A named list of sensors.
+
+    Attributes:
+        name (str): Profile name.
+        sensors (list): ``(command, rate, priority)`` tuples; rate and
+            priority are None to use the scheduler defaults.
+        derived (list): Names of derived channels to compute.
+    """
+
+    def __init__(self, name, sensors, derived=()):
+        """
+        Args:
+            name (str): Profile name.
+            sensors (list): OBD commands, or ``(command, rate, priority)``
+                tuples.
+            derived (list): Names of derived channels to compute; their
+                inputs are polled even when not listed in ``sensors``.
+        """
+        self.name = name
+        self.sensors = [
+            sensor if isinstance(sensor, tuple) else (sensor, None, None)
+            for sensor in sensors
+        ]
+        self.derived = list(derived)
+
+    @property
+    def commands(self):
+        """
+        list: The profile's commands, in order.
+        """
+        return [command for command, _, _ in self.sensors]
+
+    def __repr__(self):
+        return (
+            f"SensorProfile({self.name!r}, {len(self.sensors)} sensors, "
+            f"{len(self.derived)} derived)"
+        )
+
+
+AIR_FUEL = SensorProfile(
+    "air-fuel",
+    [
+        obd.commands.RPM,
+        obd.commands.MAF,
+        obd.commands.SHORT_FUEL_TRIM_1,
+        obd.commands.LONG_FUEL_TRIM_1,
+        obd.commands.SHORT_FUEL_TRIM_2,
+        obd.commands.LONG_FUEL_TRIM_2,
+        obd.commands.O2_B1S1,
+        obd.commands.O2_B2S1,
+        obd.commands.INTAKE_PRESSURE,
+        obd.commands.THROTTLE_POS,
+        obd.commands.O2_S1_WR_CURRENT,
+        obd.commands.O2_S2_WR_VOLTAGE,
+        obd.commands.O2_S2_WR_CURRENT,
+        obd.commands.O2_S3_WR_VOLTAGE,
+        obd.commands.O2_S3_WR_CURRENT,
+        obd.commands.O2_S4_WR_VOLTAGE,
+        obd.commands.O2_S4_WR_CURRENT,
+        obd.commands.O2_S5_WR_VOLTAGE,
+        obd.commands.O2_S5_WR_CURRENT,
+        obd.commands.O2_S6_WR_VOLTAGE,
+        obd.commands.O2_S6_WR_CURRENT,
+        obd.commands.O2_S7_WR_VOLTAGE,
+        obd.commands.O2_S7_WR_CURRENT,
+        obd.commands.O2_S8_WR_VOLTAGE,
+        obd.commands.O2_S8_WR_CURRENT,
+    ],
+    derived=[
+        "TOTAL_FUEL_TRIM_1",
+        "TOTAL_FUEL_TRIM_2",
+        "FUEL_TRIM_BANK_DELTA",
+        "VOLUMETRIC_EFFICIENCY",
+        "EQUIVALENCE_RATIO",
+        "FUEL_FLOW",
+    ],
+)
+
+MISFIRE = SensorProfile(
+    "misfire",
+    [
+        getattr(obd.commands, f"MONITOR_MISFIRE_CYLINDER_{cylinder}")
+        for cylinder in range(1, 13)
+    ],
+)
+
+PROFILES = {profile.name: profile for profile in (AIR_FUEL, MISFIRE)}
+
+
+def parse_profile(definition):
+    """
+    Builds a profile from its dictionary form.
+
+    Args:
+        definition (dict): ``name`` and a ``sensors`` list of command or
+            derived channel names, or ``{"command", "rate", "priority"}``
+            objects.
+
+    Returns:
+        SensorProfile: The profile.
+
+    Raises:
+        ValueError: If a command name is unknown.
+    """
+    sensors = []
+    derived = []
+    for entry in definition["sensors"]:
+        if isinstance(entry, str):
+            entry = {"command": entry}
+        name = entry["command"].upper()
+        if name in DERIVED_CHANNELS:
+            derived.append(name)
+            continue
+        if not obd.commands.has_name(name):
+            raise ValueError(f"Unknown OBD command {name!r}")
+        sensors.append(
+            (obd.commands[name], entry.get("rate"), entry.get("priority"))
+        )
+    return SensorProfile(definition["name"], sensors, derived)
+
+
+def load_profile(path):
+    """
+    Reads a profile file.
+
+    Args:
+        path (str): A ``.json``, ``.yaml`` or ``.yml`` file.
+
+    Returns:
+        SensorProfile: The profile.
+
+    Raises:
+        ValueError: If the file is YAML and PyYAML is not installed.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("Install PyYAML to read YAML profiles")
+            definition = yaml.safe_load(f)
+        else:
+            definition = json.load(f)
+    definition.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    return parse_profile(definition)
+
+
+def get_profile(name):
+    """
+    Looks up a built-in profile, or reads one from a file.
+
+    Args:
+        name (str): A built-in profile name or a profile file path.
+
+    Returns:
+        SensorProfile: The profile.
+
+    Raises:
+        ValueError: If there is no such profile.
+    """
+    if name in PROFILES:
+        return PROFILES[name]
+    if os.path.exists(name):
+        return load_profile(name)
+    raise ValueError(
+        f"Unknown profile {name!r}; use a file or one of {', '.join(PROFILES)}"
+    )
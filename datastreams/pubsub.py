@@ -0,0 +1,352 @@
+"""
+This module moves datastream acquisition into one background producer.
+
+``Producer`` polls the scheduler on its own thread, at the pace of the
+channel rates rather than of whoever is watching, and publishes each poll
+cycle as a ``Sample`` to a ``Hub``. Dashboards, recorders, alert evaluators
+and the voice loop each subscribe with their own bounded queue, so any
+number of consumers costs the same bus bandwidth as one.
+
+A full queue is handled by the subscriber's policy:
+    drop_oldest: discard the oldest queued sample (live views, recorders)
+    drop_newest: discard the sample being published
+    block: wait up to ``block_timeout`` for room, then drop it
+"""
+import collections
+import threading
+import time
+
+from obd.OBDResponse import Monitor
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+
+# Samples a subscriber may fall behind by.
+DEFAULT_QUEUE_SIZE = 256
+
+# Seconds the producer waits on a full blocking subscriber.
+DEFAULT_BLOCK_TIMEOUT = 0.5
+
+
+def sample_value(response):
+    """
+    Extracts the number a datastream records from a response.
+
+    Args:
+        response (obd.OBDResponse): The decoded response.
+
+    Returns:
+        float: The value's magnitude, the current-cycle misfire count of a
+        Mode 06 misfire monitor, or None.
+    """
+    if response.is_null():
+        return None
+    value = response.value
+    if isinstance(value, Monitor):
+        value = value.MISFIRE_COUNT.value
+    return getattr(value, "magnitude", None)
+
+
+class Sample:
+    """
+    The values read in one poll cycle.
+
+    Attributes:
+        timestamp (float): Time of the cycle, epoch seconds.
+        values (dict): Channel name mapped to its value, None if the
+            vehicle did not answer.
+    """
+
+    __slots__ = ("timestamp", "values")
+
+    def __init__(self, timestamp, values):
+        self.timestamp = timestamp
+        self.values = values
+
+    def __repr__(self):
+        return f"Sample({self.timestamp:.3f}, {len(self.values)} channels)"
+
+
+class Subscription:
+    """
+    One consumer's bounded queue of published items.
+
+    Attributes:
+        name (str): Subscriber name, shown in ``Hub.stats``.
+        policy (str): ``drop_oldest``, ``drop_newest`` or ``block``.
+        delivered (int): Items handed to the consumer.
+        dropped (int): Items discarded because the queue was full.
+        closed (bool): True once unsubscribed.
+    """
+
+    def __init__(self, name, maxsize=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT):
+        """
+        Args:
+            name (str): Subscriber name.
+            maxsize (int): Items queued before the policy applies.
+            policy (str): What to do when the queue is full.
+            block_timeout (float): Seconds ``block`` waits for room.
+        """
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError(f"Unknown backpressure policy {policy!r}")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.delivered = 0
+        self.dropped = 0
+        self.closed = False
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        """
+        Queues an item according to the policy; called by the hub.
+
+        Returns:
+            bool: False if the item was dropped.
+        """
+        with self._condition:
+            if self.closed:
+                return False
+            if len(self._queue) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                else:
+                    self._condition.wait_for(
+                        lambda: len(self._queue) < self.maxsize or self.closed,
+                        self.block_timeout,
+                    )
+                    if len(self._queue) >= self.maxsize or self.closed:
+                        self.dropped += 1
+                        return False
+            self._queue.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Takes the oldest queued item.
+
+        Args:
+            timeout (float): Seconds to wait; None waits until an item
+                arrives or the subscription closes.
+
+        Returns:
+            The item, or None on timeout or once closed and empty.
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._queue or self.closed, timeout
+            ) or not self._queue:
+                return None
+            item = self._queue.popleft()
+            self.delivered += 1
+            self._condition.notify_all()
+            return item
+
+    def drain(self):
+        """
+        Takes every queued item without waiting.
+
+        Returns:
+            list: The items, oldest first.
+        """
+        with self._condition:
+            items = list(self._queue)
+            self._queue.clear()
+            self.delivered += len(items)
+            self._condition.notify_all()
+            return items
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        """
+        Stops delivery and wakes any waiting consumer or producer.
+        """
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class Hub:
+    """
+    Fans published items out to every subscriber.
+
+    Example:
+        hub = Hub()
+        dashboard = hub.subscribe("dashboard")
+        hub.publish(Sample(time.time(), {"RPM": 812.0}))
+        sample = dashboard.get(timeout=1)
+    """
+
+    def __init__(self):
+        self.published = 0
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, maxsize=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST,
+                  block_timeout=DEFAULT_BLOCK_TIMEOUT):
+        """
+        Adds a subscriber; it receives items published from now on.
+
+        See ``Subscription`` for the arguments.
+
+        Returns:
+            Subscription: The subscriber's queue.
+        """
+        subscription = Subscription(name, maxsize, policy, block_timeout)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes and closes a subscriber.
+
+        Args:
+            subscription (Subscription): The subscriber's queue.
+        """
+        subscription.close()
+        with self._lock:
+            self._subscriptions = [
+                s for s in self._subscriptions if s is not subscription
+            ]
+
+    def publish(self, item, exclude=None):
+        """
+        Queues an item for every subscriber.
+
+        Args:
+            item: Usually a Sample.
+            exclude (Subscription): A subscriber not to queue it for, such as
+                the publisher's own subscription.
+        """
+        self.published += 1
+        # the list is replaced, never mutated, so it is safe to iterate
+        for subscription in self._subscriptions:
+            if subscription is not exclude:
+                subscription.put(item)
+
+    def stats(self):
+        """
+        Reports the state of every subscriber.
+
+        Returns:
+            dict: Subscriber name mapped to policy, queued, delivered and
+            dropped counts.
+        """
+        return {
+            s.name: {
+                "policy": s.policy,
+                "queued": len(s),
+                "delivered": s.delivered,
+                "dropped": s.dropped,
+            }
+            for s in self._subscriptions
+        }
+
+
+class Producer:
+    """
+    Polls a PollingScheduler on a background thread and publishes each cycle.
+
+    Example:
+        producer = Producer(scheduler, hub, store).start()
+        ...
+        producer.stop()
+
+    Attributes:
+        scheduler (PollingScheduler): The poller.
+        hub (Hub): Where samples are published.
+        store (TimeSeriesStore): Receives every sample before it is
+            published, or None.
+        cycles (int): Samples published.
+        errors (int): Poll cycles that raised.
+    """
+
+    def __init__(self, scheduler, hub, store=None):
+        """
+        Args:
+            scheduler (PollingScheduler): The poller, with its channels added.
+            hub (Hub): Where samples are published.
+            store (TimeSeriesStore): Optional store to append samples to;
+                it must have a channel per command name.
+        """
+        self.scheduler = scheduler
+        self.hub = hub
+        self.store = store
+        self.cycles = 0
+        self.errors = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Primes every channel and starts polling.
+
+        Returns:
+            Producer: self, for chaining.
+        """
+        self._publish(self.scheduler.prime())
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="datastream-producer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        """
+        Stops polling and waits for the thread to finish.
+
+        Args:
+            timeout (float): Seconds to wait for the thread.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self):
+        """
+        bool: True while the polling thread is alive.
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.scheduler.run(self._publish, self._stop_event)
+            except Exception as e:
+                # a dropped link must not end acquisition for every consumer
+                self.errors += 1
+                print(f"Datastream poll failed: {e}")
+                self._stop_event.wait(1.0)
+
+    def _publish(self, responses):
+        now = time.time()
+        values = {
+            command.name: sample_value(response)
+            for command, response in responses.items()
+        }
+        if self.store is not None:
+            self.store.append_many(now, values)
+        self.cycles += 1
+        self.hub.publish(Sample(now, values))
@@ -0,0 +1,391 @@
+"""
+This module records datastream sessions to disk and exports them.
+
+``SessionRecorder`` subscribes to the datastream hub and appends every sample
+to one file per channel while the session runs, so a session of any length
+never has to fit in memory. Each file holds ``(timestamp, value)`` float64
+pairs, the layout the time-series store spills in, with a block index
+beside it (see ``datastreams.session_index``), and ``session.json``
+describes the channels. ``RecordedSession`` memory-maps the files, and
+``export_csv`` and ``export_xlsx`` convert a session a few minutes of data at
+a time, while it is still being recorded if need be:
+
+    python -m datastreams.recorder recordings/20240601-093000 session.xlsx
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from datastreams.pubsub import DROP_OLDEST
+from datastreams.session_index import INDEX_SUFFIX, BlockIndexer, map_channel
+from datastreams.timeseries_store import SPILL_SUFFIX
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Samples queued for the writer before the oldest are dropped; an hour of
+# data at typical poll rates
+RECORD_QUEUE = 65536
+
+# Seconds of data exported at a time
+EXPORT_CHUNK = 300.0
+
+# Rows per worksheet; Excel allows 1,048,576 including the header
+XLSX_SHEET_ROWS = 1_000_000
+
+METADATA_FILE = "session.json"
+
+
+class SessionRecorder:
+    """
+    Appends every published sample to per-channel files.
+
+    Example:
+        recorder = SessionRecorder(engine.hub, "recordings", engine.channels)
+        recorder.start()
+        ...
+        recorder.stop()
+        export_csv(recorder.path, "session.csv")
+
+    Attributes:
+        path (str): The session directory, set by ``start``.
+        samples (int): Samples written.
+        dropped (int): Samples lost because the writer fell behind by more
+            than ``RECORD_QUEUE``; also saved in the metadata.
+    """
+
+    def __init__(self, hub, directory, channels=()):
+        """
+        Args:
+            hub (Hub): Where samples arrive.
+            directory (str): Sessions go into a new subdirectory of it, named
+                after the start time.
+            channels (list): Commands or derived channels whose description
+                and units go into the metadata; other channels are recorded
+                too, without them.
+        """
+        self.hub = hub
+        self.directory = directory
+        self.path = None
+        self.samples = 0
+        self.dropped = 0
+        self._described = {channel.name: channel for channel in channels}
+        self._files = {}
+        self._indexers = {}
+        self._metadata = None
+        self._subscription = None
+        self._thread = None
+
+    def start(self):
+        """
+        Creates the session directory and starts recording.
+
+        Returns:
+            SessionRecorder: self, for chaining.
+        """
+        self.path = self._create_directory()
+        self._metadata = {
+            "started": time.time(),
+            "stopped": None,
+            "dropped": 0,
+            "channels": {},
+        }
+        self._write_metadata()
+        # a deep queue absorbs slow disks; the producer never waits on it
+        self._subscription = self.hub.subscribe(
+            "recorder", maxsize=RECORD_QUEUE, policy=DROP_OLDEST
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="session-recorder", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Writes the queued samples, closes the files and finishes the
+        metadata.
+        """
+        if self._subscription is None:
+            return
+        self.hub.unsubscribe(self._subscription)
+        self._thread.join()
+        self.dropped = self._subscription.dropped
+        self._subscription = None
+        for f in self._files.values():
+            f.close()
+        for indexer in self._indexers.values():
+            indexer.close()
+        self._files = {}
+        self._indexers = {}
+        self._metadata["stopped"] = time.time()
+        self._metadata["dropped"] = self.dropped
+        self._write_metadata()
+
+    def _create_directory(self):
+        # sessions started within the same second get a numbered suffix, so
+        # one never appends to another's files
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, stamp)
+        suffix = 1
+        while True:
+            try:
+                os.makedirs(path)
+                return path
+            except FileExistsError:
+                suffix += 1
+                path = os.path.join(self.directory, f"{stamp}-{suffix}")
+
+    def _run(self):
+        while True:
+            first = self._subscription.get()
+            if first is None:
+                return
+            self._write([first] + self._subscription.drain())
+            self.dropped = self._subscription.dropped
+
+    def _write(self, samples):
+        columns = {}
+        for sample in samples:
+            for name, value in sample.values.items():
+                if value is not None:
+                    columns.setdefault(name, []).append((sample.timestamp, value))
+        for name, rows in columns.items():
+            f = self._files.get(name) or self._open(name)
+            block = np.array(rows, dtype=np.float64)
+            block.tofile(f)
+            # readers map the files while recording, so never leave data buffered
+            f.flush()
+            self._indexers[name].add(block)
+        self.samples += len(samples)
+
+    def _open(self, name):
+        # the file exists before the metadata names it
+        path = os.path.join(self.path, name + SPILL_SUFFIX)
+        f = self._files[name] = open(path, "ab")
+        self._indexers[name] = BlockIndexer(
+            os.path.join(self.path, name + INDEX_SUFFIX)
+        )
+        channel = self._described.get(name)
+        self._metadata["channels"][name] = {
+            "file": name + SPILL_SUFFIX,
+            "desc": getattr(channel, "desc", name),
+            "units": getattr(channel, "units", None),
+        }
+        self._write_metadata()
+        return f
+
+    def _write_metadata(self):
+        # replaced atomically, so a reader never sees half a file
+        path = os.path.join(self.path, METADATA_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._metadata, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+class RecordedSession:
+    """
+    A recorded session on disk, memory-mapped.
+
+    Attributes:
+        path (str): The session directory.
+        metadata (dict): Contents of ``session.json``.
+        names (list): Recorded channel names.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The session directory.
+        """
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.names = list(self.metadata["channels"])
+
+    def channel(self, name):
+        """
+        Maps a channel's samples without reading them into memory.
+
+        Args:
+            name (str): Channel name.
+
+        Returns:
+            tuple: ``(timestamps, values)`` read-only views.
+        """
+        samples = map_channel(
+            os.path.join(self.path, self.metadata["channels"][name]["file"])
+        )
+        return samples[:, 0], samples[:, 1]
+
+    def span(self):
+        """
+        Finds the times of the first and last recorded samples.
+
+        Returns:
+            tuple: First and last sample times, or None if nothing was
+            recorded.
+        """
+        first = last = None
+        for name in self.names:
+            timestamps, _ = self.channel(name)
+            if len(timestamps):
+                first = timestamps[0] if first is None else min(first, timestamps[0])
+                last = timestamps[-1] if last is None else max(last, timestamps[-1])
+        return None if first is None else (float(first), float(last))
+
+    def chunks(self, names=None, seconds=EXPORT_CHUNK):
+        """
+        Yields the session as rows, a time range at a time.
+
+        Each row is a time at which any channel was sampled; every channel
+        holds its last value until it is sampled again.
+
+        Args:
+            names (list): Channels, all by default.
+            seconds (float): Length of each time range.
+
+        Yields:
+            tuple: ``(timestamps, values)``; ``values`` has one row per time
+            and one column per channel, NaN before a channel's first sample.
+        """
+        names = self.names if names is None else names
+        span = self.span()
+        if span is None:
+            return
+        channels = [self.channel(name) for name in names]
+        start, end = span
+        while start <= end:
+            stop = start + seconds
+            ranges = [
+                (timestamps, values, np.searchsorted(timestamps, start),
+                 np.searchsorted(timestamps, stop))
+                for timestamps, values in channels
+            ]
+            times = np.unique(np.concatenate(
+                [timestamps[lo:hi] for timestamps, _, lo, hi in ranges]
+            ))
+            if len(times):
+                rows = np.full((len(times), len(names)), np.nan)
+                for column, (timestamps, values, lo, hi) in enumerate(ranges):
+                    # include the sample before the range, which is still held
+                    first = max(lo - 1, 0)
+                    index = np.searchsorted(timestamps[first:hi], times, "right") - 1
+                    held = index >= 0
+                    rows[held, column] = values[first:hi][index[held]]
+                yield times, rows
+            start = stop
+
+
+def export_csv(session_path, out_path, names=None, chunk_seconds=EXPORT_CHUNK):
+    """
+    Writes a recorded session to a CSV file, a time range at a time.
+
+    Args:
+        session_path (str): The session directory.
+        out_path (str): The CSV file.
+        names (list): Channels, all by default.
+        chunk_seconds (float): Seconds of data held in memory at a time.
+
+    Returns:
+        int: Rows written.
+    """
+    session = RecordedSession(session_path)
+    names = session.names if names is None else names
+    written = 0
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp"] + names)
+        for times, rows in session.chunks(names, chunk_seconds):
+            np.savetxt(
+                f, np.column_stack((times, rows)), delimiter=",", fmt="%.6f"
+            )
+            written += len(times)
+    return written
+
+
+def export_xlsx(session_path, out_path, names=None, chunk_seconds=EXPORT_CHUNK):
+    """
+    Writes a recorded session to an Excel workbook, a time range at a time.
+
+    Rows stream into a write-only workbook, and a new worksheet starts when
+    one is full.
+
+    Args:
+        session_path (str): The session directory.
+        out_path (str): The ``.xlsx`` file.
+        names (list): Channels, all by default.
+        chunk_seconds (float): Seconds of data held in memory at a time.
+
+    Returns:
+        int: Rows written.
+
+    Raises:
+        ValueError: If openpyxl is not installed.
+    """
+    if openpyxl is None:
+        raise ValueError("Install openpyxl to export XLSX files")
+    session = RecordedSession(session_path)
+    names = session.names if names is None else names
+    header = ["timestamp"] + [
+        session.metadata["channels"][name]["desc"] for name in names
+    ]
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = None
+    sheet_rows = XLSX_SHEET_ROWS
+    written = 0
+    for times, rows in session.chunks(names, chunk_seconds):
+        for row in np.column_stack((times, rows)).tolist():
+            if sheet_rows >= XLSX_SHEET_ROWS:
+                number = len(workbook.worksheets) + 1
+                sheet = workbook.create_sheet(f"Datastream {number}")
+                sheet.append(header)
+                sheet_rows = 0
+            sheet.append([None if value != value else value for value in row])
+            sheet_rows += 1
+        written += len(times)
+    if sheet is None:
+        workbook.create_sheet("Datastream 1").append(header)
+    workbook.save(out_path)
+    return written
+
+
+def export_session(session_path, out_path, names=None):
+    """
+    Exports a recorded session as CSV or XLSX, by the output file's
+    extension.
+
+    Args:
+        session_path (str): The session directory.
+        out_path (str): A ``.csv`` or ``.xlsx`` file.
+        names (list): Channels, all by default.
+
+    Returns:
+        int: Rows written.
+    """
+    if out_path.lower().endswith(".xlsx"):
+        return export_xlsx(session_path, out_path, names)
+    return export_csv(session_path, out_path, names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a recorded datastream")
+    parser.add_argument("session", help="session directory")
+    parser.add_argument("output", help=".csv or .xlsx file")
+    parser.add_argument("-c", "--channel", action="append", dest="names",
+                        help="channel to export; repeat for several, all by default")
+    args = parser.parse_args()
+
+    rows = export_session(args.session, args.output, args.names)
+    print(f"Exported {rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,734 @@
+"""
+This module evaluates shop-defined rules against the live datastream.
+
+A rule is a condition on channels, optionally held for a time before it
+triggers and cleared only after it has been false for a time:
+
+    RPM > 2500 and LTFT1 > 10 % for 3 s
+    COOLANT > 230 °F
+    (STFT1 > 15 or STFT2 > 15) and not THROTTLE > 80 for 2 s clear after 5 s
+
+Rules are parsed once. Every comparison of every rule is evaluated in one
+NumPy operation per batch of samples, each rule combines its comparison
+columns, and the hold and clear windows of all rules advance together. When
+a rule triggers, its actions run: ``log`` prints and records the event,
+``snapshot`` saves the rule's channels over the preceding seconds and
+``speak`` reads the rule's message out loud.
+
+Rule files are JSON, or YAML when PyYAML is installed:
+
+    {
+        "rules": [
+            {
+                "name": "Lean at cruise",
+                "when": "RPM > 2500 and LTFT1 > 10 % for 3 s",
+                "actions": ["log", "snapshot", "speak"],
+                "message": "Running lean at cruise."
+            },
+            "COOLANT > 230 °F"
+        ]
+    }
+
+Run ``python -m datastreams.rules`` to benchmark the evaluation.
+"""
+import argparse
+import collections
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import obd
+
+from datastreams.derived import DERIVED_CHANNELS, hold_forward
+from datastreams.profiles import SensorProfile
+from datastreams.pubsub import Sample
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Actions a rule can take when it triggers
+LOG = "log"
+SNAPSHOT = "snapshot"
+SPEAK = "speak"
+ACTIONS = (LOG, SNAPSHOT, SPEAK)
+
+# Seconds of data a snapshot keeps before the trigger
+SNAPSHOT_SECONDS = 30.0
+
+# Rule events kept for display
+MAX_EVENTS = 100
+
+# Short names techs use for common channels
+ALIASES = {
+    "STFT1": "SHORT_FUEL_TRIM_1",
+    "STFT2": "SHORT_FUEL_TRIM_2",
+    "LTFT1": "LONG_FUEL_TRIM_1",
+    "LTFT2": "LONG_FUEL_TRIM_2",
+    "COOLANT": "COOLANT_TEMP",
+    "ECT": "COOLANT_TEMP",
+    "IAT": "INTAKE_TEMP",
+    "MAP": "INTAKE_PRESSURE",
+    "THROTTLE": "THROTTLE_POS",
+    "TPS": "THROTTLE_POS",
+    "LOAD": "ENGINE_LOAD",
+    "VE": "VOLUMETRIC_EFFICIENCY",
+}
+
+# Units a threshold may be given in, converted to the units python-OBD
+# reports; None means the reported unit
+UNITS = {
+    "%": None,
+    "PERCENT": None,
+    "RPM": None,
+    "V": None,
+    "KPA": None,
+    "G/S": None,
+    "KPH": None,
+    "KM/H": None,
+    "C": None,
+    "°C": None,
+    "DEGC": None,
+    "F": lambda value: (value - 32.0) * 5.0 / 9.0,
+    "°F": lambda value: (value - 32.0) * 5.0 / 9.0,
+    "DEGF": lambda value: (value - 32.0) * 5.0 / 9.0,
+    "PSI": lambda value: value * 6.894757,
+    "MPH": lambda value: value * 1.609344,
+}
+
+# Duration units, in seconds
+DURATIONS = {
+    "MS": 0.001, "S": 1.0, "SEC": 1.0, "SECONDS": 1.0, "MIN": 60.0,
+    "MINUTES": 60.0,
+}
+
+OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+TOKEN = re.compile(
+    r"\s*(?:(?P<number>-?\d+(?:\.\d+)?)|(?P<op>>=|<=|==|!=|>|<)"
+    r"|(?P<paren>[()])|(?P<word>%|°?[A-Za-z_][A-Za-z0-9_/]*))"
+)
+
+
+def tokenize(text):
+    """
+    Splits a rule into tokens.
+
+    Args:
+        text (str): The rule.
+
+    Returns:
+        list: ``(kind, text)`` tuples; kind is ``number``, ``op``,
+        ``paren`` or ``word``.
+
+    Raises:
+        ValueError: If the rule has a character no token starts with.
+    """
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            rest = text[position:].strip()
+            raise ValueError(f"Unexpected {rest!r} in rule {text!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def resolve_channel(name):
+    """
+    Looks up the channel a rule names.
+
+    Args:
+        name (str): A command or derived channel name, or an alias, in any
+            case.
+
+    Returns:
+        str: The channel name.
+
+    Raises:
+        ValueError: If there is no such channel.
+    """
+    name = ALIASES.get(name.upper(), name.upper())
+    if name not in DERIVED_CHANNELS and not obd.commands.has_name(name):
+        raise ValueError(f"Unknown channel {name!r}")
+    return name
+
+
+class _Parser:
+    # recursive descent over: expr := term ("or" term)*
+    #                          term := factor ("and" factor)*
+    #                          factor := "not" factor | "(" expr ")" | comparison
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def keyword(self, *words):
+        kind, text = self.peek()
+        if kind == "word" and text.lower() in words:
+            self.position += 1
+            return True
+        return False
+
+    def take(self, kind):
+        token_kind, text = self.peek()
+        if token_kind != kind:
+            found = text if text is not None else "end of rule"
+            raise ValueError(f"Expected {kind}, found {found!r} in {self.text!r}")
+        self.position += 1
+        return text
+
+    def parse(self):
+        tree = self.expr()
+        hold = self.duration() if self.keyword("for") else 0.0
+        clear = 0.0
+        if self.keyword("clear"):
+            self.keyword("after")
+            clear = self.duration()
+        if self.position < len(self.tokens):
+            raise ValueError(
+                f"Unexpected {self.peek()[1]!r} in rule {self.text!r}"
+            )
+        return tree, hold, clear
+
+    def expr(self):
+        node = self.term()
+        while self.keyword("or"):
+            node = ("or", node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.keyword("and"):
+            node = ("and", node, self.factor())
+        return node
+
+    def factor(self):
+        if self.keyword("not"):
+            return ("not", self.factor())
+        if self.peek() == ("paren", "("):
+            self.position += 1
+            node = self.expr()
+            if self.take("paren") != ")":
+                raise ValueError(f"Expected ')' in rule {self.text!r}")
+            return node
+        channel = resolve_channel(self.take("word"))
+        op = self.take("op")
+        threshold = float(self.take("number"))
+        kind, unit = self.peek()
+        if kind == "word" and unit.upper() in UNITS:
+            self.position += 1
+            convert = UNITS[unit.upper()]
+            if convert is not None:
+                threshold = convert(threshold)
+        return ("cmp", channel, op, threshold)
+
+    def duration(self):
+        value = float(self.take("number"))
+        kind, unit = self.peek()
+        if kind == "word" and unit.upper() in DURATIONS:
+            self.position += 1
+            value *= DURATIONS[unit.upper()]
+        return value
+
+
+def _comparisons(tree):
+    if tree[0] == "cmp":
+        return [tree[1:]]
+    return [c for child in tree[1:] for c in _comparisons(child)]
+
+
+class Rule:
+    """
+    A parsed rule and its evaluation counters.
+
+    Attributes:
+        name (str): Rule name.
+        source (str): The rule text.
+        hold (float): Seconds the condition must hold before triggering.
+        clear (float): Seconds the condition must be false before clearing.
+        actions (list): Actions taken when the rule triggers.
+        message (str): What ``speak`` says and ``log`` prints.
+        channels (list): Channel names the rule reads.
+        evaluations (int): Samples the rule was evaluated on.
+        seconds (float): Time spent evaluating its condition.
+        triggers (int): Times the rule triggered.
+    """
+
+    def __init__(self, source, name=None, actions=(LOG,), message=None):
+        """
+        Args:
+            source (str): The rule text.
+            name (str): Rule name; the text by default.
+            actions (list): Some of ``log``, ``snapshot`` and ``speak``.
+            message (str): Alert text; ``Rule <name> triggered`` by default.
+
+        Raises:
+            ValueError: If the rule does not parse or an action is unknown.
+        """
+        for action in actions:
+            if action not in ACTIONS:
+                raise ValueError(f"Unknown rule action {action!r}")
+        self.source = source
+        self.name = name or source
+        self.actions = list(actions)
+        self.message = message or f"Rule {self.name} triggered."
+        self.tree, self.hold, self.clear = _Parser(source).parse()
+        self.channels = list(
+            dict.fromkeys(channel for channel, _, _ in _comparisons(self.tree))
+        )
+        self.evaluations = 0
+        self.seconds = 0.0
+        self.triggers = 0
+
+    def __repr__(self):
+        return f"Rule({self.name!r})"
+
+
+def parse_rules(definition):
+    """
+    Builds rules from their dictionary form.
+
+    Args:
+        definition: A list, or a dict with a ``rules`` list, of rule texts or
+            ``{"when", "name", "actions", "message"}`` objects.
+
+    Returns:
+        list: The Rules.
+
+    Raises:
+        ValueError: If a rule does not parse.
+    """
+    if isinstance(definition, dict):
+        definition = definition["rules"]
+    rules = []
+    for entry in definition:
+        if isinstance(entry, str):
+            entry = {"when": entry}
+        rules.append(
+            Rule(
+                entry["when"],
+                entry.get("name"),
+                entry.get("actions", (LOG,)),
+                entry.get("message"),
+            )
+        )
+    return rules
+
+
+def load_rules(path):
+    """
+    Reads a rule file.
+
+    Args:
+        path (str): A ``.json``, ``.yaml`` or ``.yml`` file.
+
+    Returns:
+        list: The Rules.
+
+    Raises:
+        ValueError: If the file is YAML and PyYAML is not installed, or a
+            rule does not parse.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("Install PyYAML to read YAML rules")
+            definition = yaml.safe_load(f)
+        else:
+            definition = json.load(f)
+    return parse_rules(definition)
+
+
+class RuleEvent:
+    """
+    A rule triggering or clearing.
+
+    Attributes:
+        timestamp (float): Time of the sample that triggered or cleared it.
+        rule (Rule): The rule.
+        triggered (bool): True when triggered, False when cleared.
+        snapshot (str): File the snapshot was saved to, if any.
+    """
+
+    __slots__ = ("timestamp", "rule", "triggered", "snapshot")
+
+    def __init__(self, timestamp, rule, triggered, snapshot=None):
+        self.timestamp = timestamp
+        self.rule = rule
+        self.triggered = triggered
+        self.snapshot = snapshot
+
+    def __repr__(self):
+        state = "triggered" if self.triggered else "cleared"
+        return f"RuleEvent({self.rule.name!r}, {state})"
+
+
+class RuleEngine:
+    """
+    Evaluates compiled rules on every batch of new samples.
+
+    Example:
+        engine = RuleEngine(load_rules("rules.json"), hub, store).start()
+
+    Attributes:
+        rules (list): The Rules.
+        channels (list): Every channel some rule reads.
+        active (numpy.ndarray): Whether each rule is triggered.
+        events (collections.deque): The newest RuleEvents.
+        batches (int): Batches evaluated.
+        busy (float): Seconds spent evaluating.
+    """
+
+    def __init__(self, rules, hub=None, store=None, speaker=None,
+                 snapshot_dir=None, snapshot_seconds=SNAPSHOT_SECONDS):
+        """
+        Args:
+            rules (list): The Rules.
+            hub (Hub): Where samples arrive; only needed for ``start``.
+            store (TimeSeriesStore): Where snapshots are read from.
+            speaker (Speaker): Speaks the ``speak`` actions.
+            snapshot_dir (str): Directory snapshots are saved to; they are
+                only kept in memory when None.
+            snapshot_seconds (float): Seconds of data before the trigger.
+        """
+        self.rules = list(rules)
+        self.hub = hub
+        self.store = store
+        self.speaker = speaker
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_seconds = snapshot_seconds
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+        self.snapshots = collections.deque(maxlen=MAX_EVENTS)
+        self.batches = 0
+        self.busy = 0.0
+        self._subscription = None
+        self._thread = None
+        self._compile()
+
+    def _compile(self):
+        self.channels = list(
+            dict.fromkeys(c for rule in self.rules for c in rule.channels)
+        )
+        column = {name: i for i, name in enumerate(self.channels)}
+
+        # every distinct comparison is evaluated once, grouped by operator
+        comparisons = {}
+        for rule in self.rules:
+            for comparison in _comparisons(rule.tree):
+                comparisons.setdefault(comparison, len(comparisons))
+        self._groups = []
+        for op, function in OPERATORS.items():
+            found = [(c, i) for c, i in comparisons.items() if c[1] == op]
+            if found:
+                self._groups.append((
+                    function,
+                    np.array([column[c[0]] for c, _ in found]),
+                    np.array([c[2] for c, _ in found]),
+                    np.array([i for _, i in found]),
+                ))
+        self._width = len(comparisons)
+        self._predicates = [
+            self._predicate(rule.tree, comparisons) for rule in self.rules
+        ]
+        self._column = column
+
+        count = len(self.rules)
+        self._hold = np.array([rule.hold for rule in self.rules])
+        self._clear = np.array([rule.clear for rule in self.rules])
+        self._last = np.full(len(self.channels), np.nan)
+        self._true_since = np.full(count, np.nan)
+        self._false_since = np.full(count, np.nan)
+        self.active = np.zeros(count, dtype=bool)
+
+    def _predicate(self, tree, comparisons):
+        if tree[0] == "cmp":
+            index = comparisons[tree[1:]]
+            return lambda matrix: matrix[:, index]
+        if tree[0] == "not":
+            operand = self._predicate(tree[1], comparisons)
+            return lambda matrix: ~operand(matrix)
+        left = self._predicate(tree[1], comparisons)
+        right = self._predicate(tree[2], comparisons)
+        if tree[0] == "and":
+            return lambda matrix: left(matrix) & right(matrix)
+        return lambda matrix: left(matrix) | right(matrix)
+
+    def start(self):
+        """
+        Subscribes to the hub and starts evaluating.
+
+        Returns:
+            RuleEngine: self, for chaining.
+        """
+        self._subscription = self.hub.subscribe("rules", maxsize=256)
+        self._thread = threading.Thread(
+            target=self._run, name="rule-engine", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Unsubscribes and waits for the thread to finish.
+        """
+        if self._subscription is not None:
+            self.hub.unsubscribe(self._subscription)
+            self._thread.join(2.0)
+            self._subscription = None
+
+    def _run(self):
+        while True:
+            first = self._subscription.get()
+            if first is None:
+                return
+            self.process([first] + self._subscription.drain())
+
+    def process(self, samples):
+        """
+        Evaluates every rule over a batch of samples and runs the actions of
+        those that trigger.
+
+        Args:
+            samples (list): Samples in time order; those without any rule
+                channel are ignored.
+
+        Returns:
+            list: The RuleEvents of the batch.
+        """
+        started = time.perf_counter()
+        samples = [
+            sample for sample in samples
+            if any(name in self._column for name in sample.values)
+        ]
+        if not samples or not self.rules:
+            return []
+        times = np.array([sample.timestamp for sample in samples])
+        values = np.full((len(samples) + 1, len(self.channels)), np.nan)
+        values[0] = self._last
+        for row, sample in enumerate(samples, 1):
+            for name, value in sample.values.items():
+                column = self._column.get(name)
+                if column is not None and value is not None:
+                    values[row, column] = value
+        values = hold_forward(values)
+        self._last = values[-1]
+        values = values[1:]
+
+        # comparisons against a channel not yet sampled (NaN) are false
+        matrix = np.empty((len(samples), self._width), dtype=bool)
+        with np.errstate(invalid="ignore"):
+            for function, columns, thresholds, indices in self._groups:
+                matrix[:, indices] = function(values[:, columns], thresholds)
+
+        condition = np.empty((len(samples), len(self.rules)), dtype=bool)
+        for i, (rule, predicate) in enumerate(zip(self.rules, self._predicates)):
+            rule_started = time.perf_counter()
+            condition[:, i] = predicate(matrix)
+            rule.seconds += time.perf_counter() - rule_started
+            rule.evaluations += len(samples)
+
+        active = self._advance(times, condition)
+        previous = np.vstack([self.active, active[:-1]])
+        events = []
+        for row, i in zip(*np.nonzero(active != previous)):
+            events.append(
+                self._act(float(times[row]), self.rules[i], active[row, i])
+            )
+        self.active = active[-1].copy()
+        self.batches += 1
+        self.busy += time.perf_counter() - started
+        return events
+
+    def _advance(self, times, condition):
+        # the hold and clear windows of every rule, over every row at once
+        rows = np.arange(len(times))[:, None]
+        last_false = np.maximum.accumulate(np.where(condition, -1, rows), axis=0)
+        last_true = np.maximum.accumulate(np.where(condition, rows, -1), axis=0)
+        first = times[0]
+        true_since = np.where(
+            last_false < 0,
+            np.where(np.isnan(self._true_since), first, self._true_since),
+            times[np.minimum(last_false + 1, len(times) - 1)],
+        )
+        false_since = np.where(
+            last_true < 0,
+            np.where(np.isnan(self._false_since), first, self._false_since),
+            times[np.minimum(last_true + 1, len(times) - 1)],
+        )
+        elapsed = times[:, None]
+        triggers = condition & (elapsed - true_since >= self._hold)
+        clears = ~condition & (elapsed - false_since >= self._clear)
+
+        # a rule is active when its latest trigger is newer than its latest clear
+        last_trigger = np.maximum.accumulate(np.where(triggers, rows, -1), axis=0)
+        last_clear = np.maximum.accumulate(np.where(clears, rows, -1), axis=0)
+        active = np.where(
+            (last_trigger < 0) & (last_clear < 0),
+            self.active,
+            last_trigger > last_clear,
+        )
+        self._true_since = np.where(condition[-1], true_since[-1], np.nan)
+        self._false_since = np.where(condition[-1], np.nan, false_since[-1])
+        return active
+
+    def _act(self, timestamp, rule, triggered):
+        event = RuleEvent(timestamp, rule, bool(triggered))
+        if not triggered:
+            if LOG in rule.actions:
+                print(f"Rule cleared: {rule.name}")
+        else:
+            rule.triggers += 1
+            if LOG in rule.actions:
+                print(f"Rule triggered: {rule.name}")
+            if SNAPSHOT in rule.actions and self.store is not None:
+                event.snapshot = self._snapshot(timestamp, rule)
+            if SPEAK in rule.actions and self.speaker is not None:
+                self.speaker.say(rule.message)
+        self.events.append(event)
+        return event
+
+    def _snapshot(self, timestamp, rule):
+        names = [name for name in rule.channels if name in self.store.channels]
+        stamps, values = self.store.aligned(names, self.snapshot_seconds)
+        snapshot = {"timestamps": stamps, **dict(zip(names, values.T))}
+        self.snapshots.append((rule, snapshot))
+        if self.snapshot_dir is None:
+            return None
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", rule.name).strip("_")[:40]
+        path = os.path.join(
+            self.snapshot_dir,
+            f"{slug}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(timestamp))}.npz",
+        )
+        np.savez(path, **snapshot)
+        return path
+
+    def stats(self):
+        """
+        Reports each rule's evaluation cost, most expensive first.
+
+        Returns:
+            dict: Rule name mapped to evaluations, microseconds per batch
+            and triggers.
+        """
+        report = {}
+        for rule in sorted(self.rules, key=lambda r: r.seconds, reverse=True):
+            report[rule.name] = {
+                "evaluations": rule.evaluations,
+                "us_per_batch": round(rule.seconds / max(self.batches, 1) * 1e6, 2),
+                "triggers": rule.triggers,
+                "active": bool(self.active[self.rules.index(rule)]),
+            }
+        return report
+
+
+def watch_rules(engine, rules, speaker=None, snapshot_dir=None):
+    """
+    Evaluates rules on a running datastream engine, polling any channel
+    they read that no profile polls yet.
+
+    Args:
+        engine (DatastreamEngine): The engine.
+        rules (list): The Rules.
+        speaker (Speaker): Speaks the ``speak`` actions.
+        snapshot_dir (str): Directory snapshots are saved to.
+
+    Returns:
+        RuleEngine: The running rule engine.
+    """
+    rule_engine = RuleEngine(
+        rules, engine.hub, engine.store, speaker, snapshot_dir
+    )
+    commands = [obd.commands[n] for n in rule_engine.channels
+                if n not in DERIVED_CHANNELS]
+    derived = [n for n in rule_engine.channels if n in DERIVED_CHANNELS]
+    engine.add_profile(SensorProfile("rules", commands, derived))
+    return rule_engine.start()
+
+
+def benchmark(count=300, rate=10.0, seconds=60.0, batch=5, seed=0):
+    """
+    Measures the evaluation cost of many synthetic rules.
+
+    Args:
+        count (int): Rules.
+        rate (float): Samples per second.
+        seconds (float): Seconds of data.
+        batch (int): Samples per batch.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Batches, and the mean and worst milliseconds per batch.
+    """
+    rng = np.random.default_rng(seed)
+    names = ["RPM", "LONG_FUEL_TRIM_1", "SHORT_FUEL_TRIM_1", "COOLANT_TEMP",
+             "INTAKE_PRESSURE", "THROTTLE_POS", "SPEED", "MAF"]
+    rules = []
+    for i in range(count):
+        a, b = rng.choice(names, 2, replace=False)
+        rules.append(Rule(
+            f"{a} > {rng.uniform(0, 100):.1f} and {b} < {rng.uniform(0, 100):.1f}"
+            f" for {rng.integers(0, 5)} s clear after 1 s",
+            name=f"rule {i}",
+            actions=(),
+        ))
+    engine = RuleEngine(rules)
+
+    total = int(rate * seconds)
+    values = rng.uniform(0, 100, (total, len(names)))
+    samples = [
+        Sample(i / rate, dict(zip(names, row.tolist())))
+        for i, row in enumerate(values)
+    ]
+    timings = []
+    for start in range(0, total, batch):
+        started = time.perf_counter()
+        engine.process(samples[start:start + batch])
+        timings.append(time.perf_counter() - started)
+    timings = np.array(timings)
+    return {
+        "batches": len(timings),
+        "mean_ms": float(timings.mean() * 1e3),
+        "max_ms": float(timings.max() * 1e3),
+        "triggers": sum(rule.triggers for rule in rules),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rule engine")
+    parser.add_argument("--rules", type=int, default=300)
+    parser.add_argument("--batch", type=int, default=5,
+                        help="samples per batch")
+    args = parser.parse_args()
+
+    result = benchmark(args.rules, batch=args.batch)
+    print(f"{args.rules} rules, {args.batch} samples per batch, "
+          f"{result['batches']} batches, {result['triggers']} triggers")
+    print(f"Per batch: {result['mean_ms']:.2f} ms mean, "
+          f"{result['max_ms']:.2f} ms worst")
+
+
+if __name__ == "__main__":
+    main()
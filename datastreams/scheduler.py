@@ -0,0 +1,329 @@
+"""
+This module schedules datastream polling per channel.
+
+Every channel declares a target rate and a priority. Each poll cycle sends the
+channels whose deadlines are earliest (earliest-deadline-first, priority as
+the tie-break) in one batched request, so fast-changing signals such as RPM
+get most of the ELM327 bandwidth and slow ones such as coolant temperature
+only a trickle. When the link cannot keep up, low priority channels are
+slowed down first.
+"""
+import threading
+import time
+
+import obd
+
+from datastreams.batch_query import MAX_PIDS_PER_REQUEST, BatchQueryEngine
+
+# Target rate (Hz) and priority per command; higher priority wins ties and
+# is the last to be slowed down when the link is saturated.
+DEFAULT_RATES = {
+    obd.commands.RPM: (10.0, 3),
+    obd.commands.THROTTLE_POS: (10.0, 3),
+    obd.commands.SPEED: (5.0, 2),
+    obd.commands.MAF: (10.0, 3),
+    obd.commands.INTAKE_PRESSURE: (5.0, 2),
+    obd.commands.O2_B1S1: (5.0, 2),
+    obd.commands.O2_B2S1: (5.0, 2),
+    obd.commands.SHORT_FUEL_TRIM_1: (2.0, 1),
+    obd.commands.SHORT_FUEL_TRIM_2: (2.0, 1),
+    obd.commands.LONG_FUEL_TRIM_1: (2.0, 1),
+    obd.commands.LONG_FUEL_TRIM_2: (2.0, 1),
+    obd.commands.INTAKE_TEMP: (0.5, 0),
+    obd.commands.COOLANT_TEMP: (0.2, 0),
+}
+
+# Used for commands without an entry in DEFAULT_RATES.
+FALLBACK_RATE = (1.0, 1)
+
+# Wide-range O2 channels move with the mixture, misfire monitors do not.
+for _command in obd.commands[1]:
+    if _command is not None and "_WR_" in _command.name:
+        DEFAULT_RATES.setdefault(_command, (5.0, 2))
+for _command in obd.commands[6]:
+    if _command is not None and _command.name.startswith("MONITOR_MISFIRE"):
+        DEFAULT_RATES.setdefault(_command, (1.0, 1))
+
+# Largest factor a channel's period is stretched by when the link is saturated.
+MAX_STRETCH = 16.0
+
+
+class Channel:
+    """
+    A polled command with its target rate and measured rate.
+
+    Attributes:
+        command (obd.OBDCommand): The command to poll.
+        rate (float): Target samples per second.
+        priority (int): Higher values are served first and slowed last.
+        next_due (float): Clock time the next sample is due.
+        stretch (float): Factor applied to the period while saturated.
+        samples (int): Samples taken so far.
+    """
+
+    def __init__(self, command, rate, priority):
+        self.command = command
+        self.rate = rate
+        self.priority = priority
+        self.next_due = 0.0
+        self.stretch = 1.0
+        self.samples = 0
+        self._last_sample = None
+        self._interval = None
+
+    @property
+    def period(self):
+        """
+        float: Seconds between samples, including any saturation stretch.
+        """
+        return self.stretch / self.rate
+
+    @property
+    def achieved_rate(self):
+        """
+        float: Smoothed measured samples per second, 0 before two samples.
+        """
+        if not self._interval:
+            return 0.0
+        return 1.0 / self._interval
+
+    def record(self, now):
+        """
+        Records a sample taken at ``now`` and schedules the next one.
+
+        Args:
+            now (float): Clock time of the sample.
+        """
+        if self._last_sample is not None:
+            interval = now - self._last_sample
+            if self._interval is None:
+                self._interval = interval
+            else:
+                self._interval += 0.2 * (interval - self._interval)
+        if self._last_sample is None:
+            self.next_due = now
+        self._last_sample = now
+        self.samples += 1
+        # a channel that fell behind resumes from now instead of bursting
+        self.next_due = max(self.next_due, now - self.period) + self.period
+
+
+class PollingScheduler:
+    """
+    Earliest-deadline-first poller over a BatchQueryEngine.
+
+    Example:
+        scheduler = PollingScheduler(BatchQueryEngine(connection))
+        for sensor in supported_sensors:
+            scheduler.add_channel(sensor)
+        scheduler.prime()
+        while True:
+            scheduler.poll_once()
+            rpm = scheduler.latest[obd.commands.RPM].value
+    """
+
+    def __init__(self, engine, max_per_cycle=MAX_PIDS_PER_REQUEST,
+                 clock=time.monotonic):
+        """
+        Args:
+            engine (BatchQueryEngine): The engine that performs the queries.
+            max_per_cycle (int): Channels served per cycle; one batched
+                request by default, so urgent channels never wait long.
+            clock (callable): Monotonic clock returning seconds.
+        """
+        self.engine = engine
+        self.max_per_cycle = max_per_cycle
+        self.clock = clock
+        self.channels = {}
+        self.latest = {}
+        # channels may be added or removed while another thread polls
+        self._lock = threading.RLock()
+        self._busy = 0.0
+        self._started = None
+        self._cycle_time = None
+
+    @classmethod
+    def for_connection(cls, connection, commands, **kwargs):
+        """
+        Creates a scheduler for a connection with default channel rates.
+
+        Args:
+            connection: An open OBD connection.
+            commands (list): The commands to poll.
+
+        Returns:
+            PollingScheduler: The scheduler with one channel per command.
+        """
+        scheduler = cls(BatchQueryEngine(connection), **kwargs)
+        for command in commands:
+            scheduler.add_channel(command)
+        return scheduler
+
+    def add_channel(self, command, rate=None, priority=None):
+        """
+        Adds or updates a channel.
+
+        Args:
+            command (obd.OBDCommand): The command to poll.
+            rate (float): Target rate in Hz, defaults to DEFAULT_RATES.
+            priority (int): Channel priority, defaults to DEFAULT_RATES.
+
+        Returns:
+            Channel: The channel.
+        """
+        default_rate, default_priority = DEFAULT_RATES.get(command, FALLBACK_RATE)
+        channel = Channel(
+            command,
+            default_rate if rate is None else rate,
+            default_priority if priority is None else priority,
+        )
+        with self._lock:
+            self.channels[command] = channel
+        return channel
+
+    def remove_channel(self, command):
+        """
+        Stops polling a command.
+
+        Args:
+            command (obd.OBDCommand): The command to remove.
+        """
+        with self._lock:
+            self.channels.pop(command, None)
+            self.latest.pop(command, None)
+
+    def prime(self):
+        """
+        Polls every channel once so each has a latest value.
+
+        Returns:
+            dict: Command mapped to OBDResponse.
+        """
+        with self._lock:
+            return self._poll(list(self.channels.values()))
+
+    def due_channels(self, now=None):
+        """
+        Returns the channels to serve in the next cycle.
+
+        Args:
+            now (float): Clock time, defaults to the scheduler clock.
+
+        Returns:
+            list: Due channels, earliest deadline first.
+        """
+        now = self.clock() if now is None else now
+        due = [c for c in self.channels.values() if c.next_due <= now]
+        due.sort(key=lambda c: (c.next_due, -c.priority))
+        return due[:self.max_per_cycle]
+
+    def poll_once(self):
+        """
+        Serves the due channels with one batched query.
+
+        Returns:
+            dict: Command mapped to OBDResponse for the channels polled,
+            empty when nothing was due.
+        """
+        with self._lock:
+            due = self.due_channels()
+            if not due:
+                return {}
+            responses = self._poll(due)
+            self._adapt()
+            return responses
+
+    def run(self, callback=None, stop_event=None):
+        """
+        Polls until ``stop_event`` is set, sleeping while nothing is due.
+
+        Args:
+            callback (callable): Called with each cycle's responses.
+            stop_event (threading.Event): Stops the loop when set.
+        """
+        while stop_event is None or not stop_event.is_set():
+            responses = self.poll_once()
+            if responses:
+                if callback is not None:
+                    callback(responses)
+                continue
+            wait = self.time_to_next()
+            if wait > 0:
+                time.sleep(min(wait, 0.1))
+
+    def time_to_next(self):
+        """
+        Returns:
+            float: Seconds until the next channel is due, 0 if one is due.
+        """
+        if not self.channels:
+            return 0.1
+        earliest = min(c.next_due for c in self.channels.values())
+        return max(0.0, earliest - self.clock())
+
+    @property
+    def utilization(self):
+        """
+        float: Fraction of elapsed time spent waiting on the adapter.
+        """
+        if self._started is None:
+            return 0.0
+        elapsed = self.clock() - self._started
+        return self._busy / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        """
+        Reports target and achieved rates per channel.
+
+        Returns:
+            dict: Command name mapped to target rate, achieved rate,
+            priority and current stretch.
+        """
+        return {
+            channel.command.name: {
+                "target": channel.rate,
+                "achieved": round(channel.achieved_rate, 2),
+                "priority": channel.priority,
+                "stretch": round(channel.stretch, 2),
+            }
+            for channel in self.channels.values()
+        }
+
+    def _poll(self, channels):
+        started = self.clock()
+        if self._started is None:
+            self._started = started
+        responses = self.engine.query_all([c.command for c in channels])
+        now = self.clock()
+        self._busy += now - started
+        if self._cycle_time is None:
+            self._cycle_time = now - started
+        else:
+            self._cycle_time += 0.1 * (now - started - self._cycle_time)
+        # a misfire scan answers every monitor, due or not; credit them all
+        for command, response in responses.items():
+            channel = self.channels.get(command)
+            if channel is not None:
+                channel.record(now)
+                self.latest[command] = response
+        return responses
+
+    def _adapt(self):
+        # Compare the sample rate the channels ask for with what the link
+        # delivers per cycle. Over capacity, slow down the lowest priority
+        # tier that is not yet fully stretched; with clear headroom, relax.
+        if not self._cycle_time:
+            return
+        capacity = self.max_per_cycle / self._cycle_time
+        demand = sum(c.rate / c.stretch for c in self.channels.values())
+        if demand > capacity:
+            stretchable = [c for c in self.channels.values() if c.stretch < MAX_STRETCH]
+            if stretchable:
+                lowest = min(c.priority for c in stretchable)
+                for channel in stretchable:
+                    if channel.priority == lowest:
+                        channel.stretch = min(channel.stretch * 1.25, MAX_STRETCH)
+        elif demand * 1.25 < capacity:
+            for channel in self.channels.values():
+                if channel.stretch > 1.0:
+                    channel.stretch = max(1.0, channel.stretch * 0.95)
@@ -0,0 +1,373 @@
+"""
+This module indexes recorded sessions for time-range queries.
+
+Every channel file of a recorded session gets a sparse block index next to
+it, written by the recorder as it goes: one record per ``INDEX_BLOCK``
+samples with the block's first and last time, its offset in the file and
+the minimum and maximum value. ``SessionIndex`` keeps only these records in
+memory and memory-maps the samples, so a query for a few seconds of a
+six-hour road test reads a few pages of the file, and an overview of the
+whole session reads the index alone:
+
+    session = SessionIndex("recordings/20240601-093000")
+    times = session.find("MONITOR_MISFIRE_CYLINDER_3", above=0)
+    views = session.around(["RPM", "MONITOR_MISFIRE_CYLINDER_3"], times[0], 20)
+"""
+import json
+import os
+
+import numpy as np
+
+# Samples per index block
+INDEX_BLOCK = 1024
+
+INDEX_SUFFIX = ".idx"
+
+INDEX_DTYPE = np.dtype([
+    ("start", "<f8"),
+    ("end", "<f8"),
+    ("offset", "<i8"),
+    ("count", "<i8"),
+    ("min", "<f8"),
+    ("max", "<f8"),
+])
+
+# Bytes per recorded sample: a float64 timestamp and a float64 value
+SAMPLE_BYTES = 16
+
+
+def map_channel(path):
+    """
+    Maps a channel file without reading it into memory.
+
+    Args:
+        path (str): The channel file.
+
+    Returns:
+        numpy.ndarray: Read-only ``(count, 2)`` view of timestamps and
+        values; a sample still being written is left out.
+    """
+    count = os.path.getsize(path) // SAMPLE_BYTES
+    if count == 0:
+        return np.empty((0, 2))
+    return np.memmap(path, dtype=np.float64, mode="r", shape=(count, 2))
+
+
+def index_blocks(timestamps, values, offset=0, block=INDEX_BLOCK):
+    """
+    Builds the index records of consecutive samples.
+
+    Args:
+        timestamps (numpy.ndarray): Sample times.
+        values (numpy.ndarray): Sample values.
+        offset (int): File position of the first sample, in samples.
+        block (int): Samples per block; the last block may be shorter.
+
+    Returns:
+        numpy.ndarray: One INDEX_DTYPE record per block.
+    """
+    starts = np.arange(0, len(timestamps), block)
+    records = np.empty(len(starts), dtype=INDEX_DTYPE)
+    if not len(starts):
+        return records
+    ends = np.minimum(starts + block, len(timestamps))
+    records["start"] = timestamps[starts]
+    records["end"] = timestamps[ends - 1]
+    records["offset"] = offset + starts
+    records["count"] = ends - starts
+    records["min"] = np.minimum.reduceat(values, starts)
+    records["max"] = np.maximum.reduceat(values, starts)
+    return records
+
+
+class BlockIndexer:
+    """
+    Appends index records for a channel file as it grows.
+
+    Attributes:
+        written (int): Samples seen.
+    """
+
+    def __init__(self, path, block=INDEX_BLOCK):
+        """
+        Args:
+            path (str): The index file.
+            block (int): Samples per block.
+        """
+        self.block = block
+        self.written = 0
+        self._pending = []
+        self._file = open(path, "ab")
+
+    def add(self, samples):
+        """
+        Indexes samples appended to the channel file.
+
+        Args:
+            samples (numpy.ndarray): ``(count, 2)`` timestamps and values.
+        """
+        self._pending.append(samples)
+        pending = sum(len(p) for p in self._pending)
+        if pending < self.block:
+            return
+        # index whole blocks only; the rest waits for more samples
+        samples = np.concatenate(self._pending)
+        whole = len(samples) // self.block * self.block
+        index_blocks(
+            samples[:whole, 0], samples[:whole, 1], self.written, self.block
+        ).tofile(self._file)
+        self._file.flush()
+        self.written += whole
+        self._pending = [samples[whole:]]
+
+    def close(self):
+        """
+        Closes the index file; the last partial block is left unindexed.
+        """
+        self._file.close()
+
+
+class SessionIndex:
+    """
+    A recorded session, queried through its block indexes.
+
+    Attributes:
+        path (str): The session directory.
+        metadata (dict): Contents of ``session.json``.
+        names (list): Recorded channel names.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The session directory.
+        """
+        self.path = path
+        with open(os.path.join(path, "session.json"), encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.names = list(self.metadata["channels"])
+        self._channels = {}
+
+    def _channel(self, name):
+        data = map_channel(
+            os.path.join(self.path, self.metadata["channels"][name]["file"])
+        )
+        cached = self._channels.get(name)
+        if cached is not None and len(cached[0]) == len(data):
+            return cached
+        index_path = os.path.join(self.path, name + INDEX_SUFFIX)
+        blocks = np.empty(0, dtype=INDEX_DTYPE)
+        if os.path.exists(index_path):
+            blocks = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        # samples the index does not cover yet: the block being recorded, or
+        # all of a session recorded without an index
+        indexed = int(blocks["offset"][-1] + blocks["count"][-1]) if len(blocks) else 0
+        indexed = min(indexed, len(data))
+        blocks = blocks[blocks["offset"] < indexed]
+        tail = index_blocks(data[indexed:, 0], data[indexed:, 1], indexed)
+        self._channels[name] = (data, np.concatenate((blocks, tail)))
+        return self._channels[name]
+
+    def blocks(self, name):
+        """
+        Returns a channel's index.
+
+        Args:
+            name (str): Channel name.
+
+        Returns:
+            numpy.ndarray: INDEX_DTYPE records covering every sample.
+        """
+        return self._channel(name)[1]
+
+    def span(self, name=None):
+        """
+        Finds the times of the first and last recorded samples.
+
+        Args:
+            name (str): A channel, or None for the whole session.
+
+        Returns:
+            tuple: ``(first, last)``, or None if nothing was recorded.
+        """
+        blocks = [self.blocks(n) for n in ([name] if name else self.names)]
+        blocks = [b for b in blocks if len(b)]
+        if not blocks:
+            return None
+        return (
+            float(min(b["start"][0] for b in blocks)),
+            float(max(b["end"][-1] for b in blocks)),
+        )
+
+    def _bounds(self, name, start, end):
+        # positions in the file of the samples in [start, end]
+        data, blocks = self._channel(name)
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        first = int(np.searchsorted(blocks["end"], start, "left"))
+        last = int(np.searchsorted(blocks["start"], end, "right"))
+        if first >= last:
+            return data, 0, 0
+        lo = int(blocks["offset"][first])
+        hi = int(blocks["offset"][last - 1] + blocks["count"][last - 1])
+        # only the edge blocks are searched, so only their pages are read
+        head = data[lo:min(lo + int(blocks["count"][first]), hi), 0]
+        lo += int(np.searchsorted(head, start, "left"))
+        tail_start = int(blocks["offset"][last - 1])
+        tail = data[max(tail_start, lo):hi, 0]
+        hi = max(tail_start, lo) + int(np.searchsorted(tail, end, "right"))
+        return data, lo, max(lo, hi)
+
+    def query(self, name, start=None, end=None):
+        """
+        Returns a channel's samples in a time range.
+
+        Args:
+            name (str): Channel name.
+            start (float): First time, or None from the beginning.
+            end (float): Last time, or None to the end.
+
+        Returns:
+            tuple: ``(timestamps, values)`` views of the mapped file.
+        """
+        data, lo, hi = self._bounds(name, start, end)
+        return data[lo:hi, 0], data[lo:hi, 1]
+
+    def window(self, names, start=None, end=None):
+        """
+        Returns several channels' samples in a time range.
+
+        Args:
+            names (list): Channel names.
+            start (float): First time, or None from the beginning.
+            end (float): Last time, or None to the end.
+
+        Returns:
+            dict: Channel name mapped to ``(timestamps, values)`` views.
+        """
+        return {name: self.query(name, start, end) for name in names}
+
+    def around(self, names, timestamp, seconds=20.0):
+        """
+        Returns several channels' samples centered on a moment.
+
+        Args:
+            names (list): Channel names.
+            timestamp (float): The moment.
+            seconds (float): Length of the window.
+
+        Returns:
+            dict: Channel name mapped to ``(timestamps, values)`` views.
+        """
+        half = seconds / 2
+        return self.window(names, timestamp - half, timestamp + half)
+
+    def stats(self, name, start=None, end=None):
+        """
+        Finds a channel's minimum and maximum in a time range.
+
+        Blocks wholly inside the range are answered from the index; only
+        the samples of the two edge blocks are read.
+
+        Args:
+            name (str): Channel name.
+            start (float): First time, or None from the beginning.
+            end (float): Last time, or None to the end.
+
+        Returns:
+            tuple: ``(min, max)``, or None if the range has no samples.
+        """
+        data, lo, hi = self._bounds(name, start, end)
+        if lo == hi:
+            return None
+        blocks = self.blocks(name)
+        inner = blocks[
+            (blocks["offset"] >= lo) & (blocks["offset"] + blocks["count"] <= hi)
+        ]
+        edges = [data[lo:hi, 1]] if not len(inner) else [
+            data[lo:int(inner["offset"][0]), 1],
+            data[int(inner["offset"][-1] + inner["count"][-1]):hi, 1],
+        ]
+        lows = [inner["min"].min()] if len(inner) else []
+        highs = [inner["max"].max()] if len(inner) else []
+        for edge in edges:
+            if len(edge):
+                lows.append(edge.min())
+                highs.append(edge.max())
+        return float(min(lows)), float(max(highs))
+
+    def envelope(self, name, start=None, end=None, bins=1000):
+        """
+        Summarizes a channel as the minimum and maximum per time bin, for
+        drawing a long range at screen resolution.
+
+        When the range spans more blocks than bins, the index alone is read;
+        otherwise the samples are, at most ``bins`` blocks of them.
+
+        Args:
+            name (str): Channel name.
+            start (float): First time, or None from the beginning.
+            end (float): Last time, or None to the end.
+            bins (int): Number of bins.
+
+        Returns:
+            tuple: ``(times, mins, maxs)``; ``times`` are bin starts and
+            empty bins are NaN.
+        """
+        span = self.span(name)
+        if span is None:
+            return np.empty(0), np.empty(0), np.empty(0)
+        start = span[0] if start is None else start
+        end = span[1] if end is None else end
+        edges = np.linspace(start, end, bins + 1)
+        blocks = self.blocks(name)
+        inside = blocks[(blocks["end"] >= start) & (blocks["start"] <= end)]
+        if len(inside) > bins:
+            times, lows, highs = inside["start"], inside["min"], inside["max"]
+        else:
+            times, values = self.query(name, start, end)
+            lows = highs = values
+        slot = np.clip(np.searchsorted(edges, times, "right") - 1, 0, bins - 1)
+        mins = np.full(bins, np.inf)
+        maxs = np.full(bins, -np.inf)
+        np.minimum.at(mins, slot, lows)
+        np.maximum.at(maxs, slot, highs)
+        empty = np.isinf(mins)
+        mins[empty] = maxs[empty] = np.nan
+        return edges[:-1], mins, maxs
+
+    def find(self, name, above=None, below=None, start=None, end=None):
+        """
+        Finds the times a channel was above or below a value.
+
+        Only blocks whose index range allows a match are read.
+
+        Args:
+            name (str): Channel name.
+            above (float): Match values greater than this.
+            below (float): Match values less than this.
+            start (float): First time, or None from the beginning.
+            end (float): Last time, or None to the end.
+
+        Returns:
+            numpy.ndarray: The matching sample times.
+        """
+        data, lo, hi = self._bounds(name, start, end)
+        blocks = self.blocks(name)
+        candidate = (blocks["offset"] + blocks["count"] > lo) & (blocks["offset"] < hi)
+        if above is not None:
+            candidate &= blocks["max"] > above
+        if below is not None:
+            candidate &= blocks["min"] < below
+        found = []
+        for block in blocks[candidate]:
+            first = max(int(block["offset"]), lo)
+            last = min(int(block["offset"] + block["count"]), hi)
+            timestamps, values = data[first:last, 0], data[first:last, 1]
+            match = np.ones(len(values), dtype=bool)
+            if above is not None:
+                match &= values > above
+            if below is not None:
+                match &= values < below
+            found.append(timestamps[match])
+        return np.concatenate(found) if found else np.empty(0)
@@ -0,0 +1,376 @@
+"""
+This module keeps live sensor samples in bounded ring buffers.
+
+Every channel owns preallocated timestamp and value arrays three times the
+size of the retention period, so a session of any length uses the same
+memory. Samples are appended after the newest one, and when the arrays are
+full the newest ``capacity`` samples are moved to the front: the retained
+samples are always contiguous, so any window is a slice of the arrays and
+is returned without copying, and no sample of a window is overwritten until
+``capacity`` more samples have been appended.
+
+With a spill directory set, the oldest block of a full channel is appended
+to ``<spill_dir>/<session>/<channel>.f64`` before it is overwritten, so nothing of a
+long road test is lost while the dashboard only ever works on the window.
+"""
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+# Seconds of samples kept per channel.
+DEFAULT_RETENTION = 600.0
+
+# Capacity of a channel added without a rate.
+DEFAULT_CAPACITY = 4096
+
+# Buffer length in capacities; a window stays intact for
+# (BUFFER_CAPACITIES - 2) * capacity appends after it is taken.
+BUFFER_CAPACITIES = 3
+
+# Samples written to the spill file at a time; capacities are rounded up to
+# a whole number of blocks.
+SPILL_BLOCK = 256
+
+SPILL_SUFFIX = ".f64"
+
+
+class RingBuffer:
+    """
+    A fixed-size, time-ordered series of samples for one channel.
+
+    One thread appends; other threads may read. Windows are views of the
+    buffer, and the samples in them are left untouched for at least
+    ``capacity`` more appends; copy a window to keep it longer.
+
+    Attributes:
+        name (str): Channel name.
+        capacity (int): Samples kept.
+        written (int): Samples appended since creation.
+        spill_path (str): File evicted blocks are appended to, or None.
+    """
+
+    def __init__(self, name, capacity, spill_path=None):
+        """
+        Args:
+            name (str): Channel name.
+            capacity (int): Samples kept.
+            spill_path (str): Where evicted blocks go; None to drop them.
+        """
+        if spill_path is not None:
+            capacity = math.ceil(capacity / SPILL_BLOCK) * SPILL_BLOCK
+        self.name = name
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.written = 0
+        length = BUFFER_CAPACITIES * capacity
+        self._timestamps = np.full(length, np.nan)
+        self._values = np.full(length, np.nan)
+        self._sequences = np.full(length, -1, dtype=np.int64)
+        # one past the newest sample; readers take everything from this one
+        # value, so they never see it half updated
+        self._end = 0
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, timestamp, value, sequence=None):
+        """
+        Appends a sample, evicting the oldest one when full.
+
+        Args:
+            timestamp (float): Sample time, epoch seconds.
+            value (float): Sample value; None is stored as NaN.
+            sequence (int): Increasing sample number; defaults to
+                ``written``.
+        """
+        if (
+            self.spill_path is not None
+            and self.written >= self.capacity
+            and self.written % SPILL_BLOCK == 0
+        ):
+            self._spill()
+        end = self._end
+        if end == len(self._timestamps):
+            # move the retained samples to the front; windows taken within the
+            # last capacity appends all lie beyond it
+            for array in (self._timestamps, self._values, self._sequences):
+                array[:self.capacity] = array[end - self.capacity:end]
+            end = self._end = self.capacity
+        self._timestamps[end] = timestamp
+        self._values[end] = np.nan if value is None else value
+        self._sequences[end] = self.written if sequence is None else sequence
+        self._end = end + 1
+        self.written += 1
+
+    def _spill(self):
+        # the oldest block, evicted over the next SPILL_BLOCK appends
+        start = self._end - self.capacity
+        block = np.column_stack(
+            (
+                self._timestamps[start:start + SPILL_BLOCK],
+                self._values[start:start + SPILL_BLOCK],
+            )
+        )
+        with open(self.spill_path, "ab") as f:
+            block.tofile(f)
+
+    def _span(self):
+        # the retained samples are contiguous in [end - len, end)
+        end = self._end
+        return end - min(end, self.capacity), end
+
+    def _bounds(self, seconds=None, count=None):
+        # one read of the end, so every array is sliced from the same span
+        start, end = self._span()
+        if count is not None:
+            start = max(start, end - count)
+        if seconds is not None and end > start:
+            cutoff = self._timestamps[end - 1] - seconds
+            start += int(np.searchsorted(self._timestamps[start:end], cutoff))
+        return start, end
+
+    def window(self, seconds=None, count=None):
+        """
+        Returns the newest samples without copying them.
+
+        Args:
+            seconds (float): Only samples within ``seconds`` of the newest.
+            count (int): At most this many samples.
+
+        Returns:
+            tuple: ``(timestamps, values)`` array views, oldest first.
+        """
+        start, end = self._bounds(seconds, count)
+        return self._timestamps[start:end], self._values[start:end]
+
+    def since(self, sequence, seconds=None, until=None):
+        """
+        Returns the samples numbered ``sequence`` or later without copying
+        them.
+
+        Args:
+            sequence (int): First sample number wanted.
+            seconds (float): Also limit to the newest ``seconds``.
+            until (int): Stop before this sample number.
+
+        Returns:
+            tuple: ``(timestamps, values)`` array views, oldest first.
+        """
+        start, end = self._bounds(seconds)
+        sequences = self._sequences[start:end]
+        stop = end if until is None else start + int(
+            np.searchsorted(sequences, until)
+        )
+        start += int(np.searchsorted(sequences, sequence))
+        return self._timestamps[start:stop], self._values[start:stop]
+
+    def latest(self):
+        """
+        Returns:
+            tuple: ``(timestamp, value)`` of the newest sample, or
+            ``(None, None)`` when empty.
+        """
+        if not self.written:
+            return None, None
+        end = self._span()[1]
+        return float(self._timestamps[end - 1]), float(self._values[end - 1])
+
+    def history(self):
+        """
+        Returns every sample of the session: spilled blocks, then the
+        buffer.
+
+        Returns:
+            tuple: ``(timestamps, values)`` arrays.
+        """
+        timestamps, values = self.window()
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return timestamps.copy(), values.copy()
+        spilled_timestamps, spilled_values = read_spill(self.spill_path)
+        # the block being overwritten now is both on disk and in the buffer
+        overlap = int(np.searchsorted(timestamps, spilled_timestamps[-1], "right"))
+        return (
+            np.concatenate((spilled_timestamps, timestamps[overlap:])),
+            np.concatenate((spilled_values, values[overlap:])),
+        )
+
+
+def read_spill(path):
+    """
+    Loads a channel's spilled samples.
+
+    Args:
+        path (str): The spill file.
+
+    Returns:
+        tuple: ``(timestamps, values)`` arrays.
+    """
+    samples = np.fromfile(path, dtype=np.float64).reshape(-1, 2)
+    return samples[:, 0], samples[:, 1]
+
+
+class TimeSeriesStore:
+    """
+    Ring buffers for every live channel of a session.
+
+    Example:
+        store = TimeSeriesStore(retention=300)
+        store.add_channel("RPM", rate=10)
+        store.append("RPM", time.time(), 812.0)
+        timestamps, values = store.window("RPM", seconds=10)
+
+    Channels may be appended to from several threads; each sample takes the
+    next ``sequence`` number only once it is stored, so a cursor never
+    skips a sample still being written.
+
+    Attributes:
+        retention (float): Seconds kept per channel.
+        spill_dir (str): Directory evicted blocks are written to, or None.
+        channels (dict): Channel name mapped to its RingBuffer.
+        sequence (int): Samples appended to all channels; a reader's cursor.
+    """
+
+    def __init__(self, retention=DEFAULT_RETENTION, spill_dir=None):
+        """
+        Args:
+            retention (float): Seconds kept per channel.
+            spill_dir (str): Directory for evicted blocks, which go into a
+                subdirectory named after the session start; None to drop
+                them.
+        """
+        self.retention = retention
+        self.channels = {}
+        self.sequence = 0
+        self._lock = threading.Lock()
+        if spill_dir is not None:
+            # one directory per session so earlier drives are never appended to
+            spill_dir = os.path.join(spill_dir, time.strftime("%Y%m%d-%H%M%S"))
+            os.makedirs(spill_dir, exist_ok=True)
+        self.spill_dir = spill_dir
+
+    def add_channel(self, name, rate=None, capacity=None):
+        """
+        Adds a channel, or returns it if it exists.
+
+        Args:
+            name (str): Channel name, also the spill file name.
+            rate (float): Expected samples per second; sizes the buffer for
+                the retention period.
+            capacity (int): Samples kept; overrides ``rate``.
+
+        Returns:
+            RingBuffer: The channel's buffer.
+        """
+        if name in self.channels:
+            return self.channels[name]
+        if capacity is None:
+            capacity = (
+                math.ceil(self.retention * rate) if rate else DEFAULT_CAPACITY
+            )
+        spill_path = None
+        if self.spill_dir is not None:
+            spill_path = os.path.join(self.spill_dir, name + SPILL_SUFFIX)
+        self.channels[name] = RingBuffer(name, max(2, capacity), spill_path)
+        return self.channels[name]
+
+    def __contains__(self, name):
+        return name in self.channels
+
+    def append(self, name, timestamp, value):
+        """
+        Appends a sample to a channel.
+
+        Args:
+            name (str): Channel name.
+            timestamp (float): Sample time, epoch seconds.
+            value (float): Sample value; None is stored as NaN.
+        """
+        with self._lock:
+            self.channels[name].append(timestamp, value, self.sequence)
+            self.sequence += 1
+
+    def append_many(self, timestamp, values):
+        """
+        Appends one sample to each of several channels.
+
+        Args:
+            timestamp (float): Sample time shared by all values.
+            values (dict): Channel name mapped to value.
+        """
+        with self._lock:
+            for name, value in values.items():
+                self.channels[name].append(timestamp, value, self.sequence)
+                self.sequence += 1
+
+    def window(self, name, seconds=None, count=None):
+        """
+        Returns a channel's newest samples without copying them.
+
+        See ``RingBuffer.window``.
+        """
+        return self.channels[name].window(seconds, count)
+
+    def latest(self, name):
+        """
+        Returns a channel's newest ``(timestamp, value)``.
+        """
+        return self.channels[name].latest()
+
+    def since(self, names, cursor, seconds=None):
+        """
+        Returns what several channels received after a cursor.
+
+        Args:
+            names (list): Channel names.
+            cursor (int): ``sequence`` returned by the previous call, 0 at
+                first. Samples evicted since then are skipped.
+            seconds (float): Also limit to each channel's newest ``seconds``.
+
+        Returns:
+            tuple: ``(cursor, columns)``; ``cursor`` is the value to pass next
+            time and ``columns`` a list of ``(timestamps, values)`` views in
+            the order of ``names``.
+        """
+        # samples appended while reading are left for the next call
+        end = self.sequence
+        columns = [
+            self.channels[name].since(cursor, seconds, until=end) for name in names
+        ]
+        return end, columns
+
+    def aligned(self, names, seconds=None, timestamps=None):
+        """
+        Reads several channels onto one time axis.
+
+        Each channel is sampled at every time point by holding its most
+        recent value; points before a channel's first sample are NaN.
+
+        Args:
+            names (list): Channel names, one column each.
+            seconds (float): Window length; None for everything retained.
+            timestamps (numpy.ndarray): The time axis; by default every
+                sample time of the channels within the window.
+
+        Returns:
+            tuple: ``(timestamps, values)``; ``values`` has one row per time
+            point and one column per channel.
+        """
+        # values are held from before the window, so search the whole buffer
+        buffers = [self.channels[name].window() for name in names]
+        if timestamps is None:
+            if not buffers:
+                return np.empty(0), np.empty((0, 0))
+            timestamps = np.unique(np.concatenate([t for t, _ in buffers]))
+            if seconds is not None and len(timestamps):
+                timestamps = timestamps[timestamps >= timestamps[-1] - seconds]
+        values = np.full((len(timestamps), len(names)), np.nan)
+        for column, (channel_timestamps, channel_values) in enumerate(buffers):
+            if not len(channel_timestamps):
+                continue
+            index = np.searchsorted(channel_timestamps, timestamps, "right") - 1
+            held = index >= 0
+            values[held, column] = channel_values[index[held]]
+        return timestamps, values
@@ -0,0 +1,57 @@
+"""
+This module shows a running datastream in a tkinter window.
+"""
+from tkinter import Tk, TOP, BOTH
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from datastreams.live_plot import DEFAULT_MAX_FPS, BlittedPlotter
+from datastreams.misfire import is_misfire_monitor, misfire_suspects
+
+# Seconds of data shown per graph
+PLOT_WINDOW = 30
+
+
+def run_viewer(engine, commands=None, window=PLOT_WINDOW, max_fps=DEFAULT_MAX_FPS):
+    """
+    Plots sensors of a running engine until the window is closed.
+
+    Args:
+        engine (DatastreamEngine): The running engine.
+        commands (list): Sensors to plot; every channel the profiles show by
+            default.
+        window (float): Seconds of data shown per graph.
+        max_fps (float): Frames drawn per second at most.
+    """
+    commands = engine.channels if commands is None else commands
+
+    # Create a tkinter window
+    root = Tk()
+    root.title("OBD-II Live Data Stream")
+
+    # Create a matplotlib figure and add it to the tkinter window
+    fig = plt.figure(figsize=(10, 15))
+    canvas = FigureCanvasTkAgg(fig, master=root)
+    canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=1)
+
+    def latest_samples(seconds):
+        # misfire monitors get flagged in their title when they stand out
+        suspects = misfire_suspects(engine.store, commands)
+        for idx, command in enumerate(commands):
+            title = command.desc
+            if is_misfire_monitor(command) and command.pid - 0xA1 in suspects:
+                title += " (misfiring)"
+            plotter.set_title(idx, title)
+        return [engine.store.window(command.name, seconds) for command in commands]
+
+    # Draw each sensor's recent samples, redrawing at a capped rate
+    plotter = BlittedPlotter(
+        fig,
+        [command.desc for command in commands],
+        latest_samples,
+        window=window,
+        max_fps=max_fps,
+    ).start()
+
+    # Start the tkinter main loop
+    root.mainloop()
+    plotter.stop()
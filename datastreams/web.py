@@ -0,0 +1,355 @@
+"""
+This module serves the live datastream dashboard.
+
+The page shows one graph per polled sensor of the running
+``DatastreamEngine`` and receives new samples over Server-Sent Events
+(``/stream``); ``/data`` returns the same updates on request.
+"""
+import json
+import time
+from flask import Flask, Response, render_template_string, jsonify, request
+from config import (
+    DATASTREAM_PUSH_INTERVAL,
+    DATASTREAM_RECORD_DIR,
+    DATASTREAM_SNAPSHOT_DIR,
+)
+from datastreams.anomaly import AnomalyDetector, Speaker
+from datastreams.engine import engine_from_config
+from datastreams.recorder import SessionRecorder, export_session
+from datastreams.rules import load_rules, watch_rules
+from datastreams.misfire import misfire_suspects
+from datastreams.wire_format import (
+    BINARY_MIMETYPE,
+    encode_binary,
+    encode_json,
+    encode_packed,
+)
+
+
+app = Flask(__name__)
+
+# The running engine, the sensors it polls, the anomaly detector and rule
+# engine watching it and the recorder writing the session to disk
+engine = None
+supported_sensors = []
+detector = None
+rule_engine = None
+recorder = None
+start_time = time.time()
+
+# Flask keeps serving after the datastream stops; a restarted datastream
+# reuses the running server
+server_running = False
+
+# Seconds shown per graph, and points a graph keeps before dropping the oldest
+PLOT_WINDOW = 10
+MAX_PLOT_POINTS = 1000
+
+# Seconds between keepalive comments on an idle event stream
+STREAM_KEEPALIVE = 15.0
+
+
+def not_running():
+    return jsonify({"error": "Data stream is not running."}), 503
+
+
+@app.route("/")
+def index():
+    supported_sensors_desc = [sensor.desc for sensor in supported_sensors]
+    return render_template_string(
+        """
+        <html>
+            <head>
+                <title>OBD-II Live Data Stream</title>
+                <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+                <style>
+                    body {
+                        display: flex;
+                        flex-wrap: wrap;
+                        justify-content: space-around;
+                        height: 100vh;
+                        margin: 23px;
+                        padding: 0;
+                    }
+                    .graph-container {
+                        box-sizing: border-box;
+                        width: 50%;
+                        padding: 10px;
+                    }
+                </style>
+            </head>
+            <body>
+                {% for sensor_desc in supported_sensors %}
+                <div class="graph-container" id="{{ sensor_desc }}"></div>
+                {% endfor %}
+                <script>
+                    {% for sensor_desc in supported_sensors %}
+                    var trace = {
+                        x: [],
+                        y: [],
+                        mode: 'lines',
+                        name: '{{ sensor_desc }}'
+                    };
+
+                    var layout = {
+                        title: '{{ sensor_desc }}',
+                        xaxis: {
+                            title: 'Elapsed Time (s)'
+                        },
+                        yaxis: {
+                            title: 'Value'
+                        },
+                        height: (100 / {{ num_sensors }}) + '%',
+                        margin: {
+                            t: 50,
+                            l: 50,
+                            r: 50,
+                            b: 50
+                        },
+                        annotations: [{
+                            xref: 'paper',
+                            yref: 'y',
+                            x: 1,
+                            xanchor: 'right',
+                            y: 0,
+                            yanchor: 'bottom',
+                            text: '',
+                            showarrow: false,
+                            font: {
+                                size: 16
+                            }
+                        }]
+                    };
+
+                    var config = {responsive: true};
+
+                    Plotly.newPlot('{{ sensor_desc }}', [trace], layout, config);
+                    {% endfor %}
+
+                    // New samples are pushed as they are acquired, coalesced
+                    // into one event per interval
+                    var startTime = {{ start_time }};
+                    var sensorDescs = {{ supported_sensors|tojson }};
+                    var source = new EventSource(
+                        '/stream?interval={{ push_interval }}&window={{ window }}'
+                    );
+
+                    source.onmessage = function(event) {
+                        var data = JSON.parse(event.data);
+                        for (var i = 0; i < sensorDescs.length; i++) {
+                            var n = data.timestamps[i].length;
+                            if (n === 0) {
+                                continue;
+                            }
+                            var sensor_desc = sensorDescs[i];
+                            var x = data.timestamps[i].map(ts => ts - startTime);
+                            var y = data.values[i];
+                            Plotly.extendTraces(
+                                sensor_desc, {x: [x], y: [y]}, [0], {{ max_points }}
+                            );
+                            var xAxisRange = [x[n - 1] - {{ window }}, x[n - 1]];
+                            var currentValue = y[n - 1];
+                            var labelText = 'Current value: ' + currentValue;
+                            if (sensor_desc === 'Engine RPM') {
+                                labelText = 'Current RPM: ' + currentValue;
+                            } else if (sensor_desc === 'Mass Air Flow') {
+                                labelText = 'Current gm/s: ' + currentValue;
+                            }
+                            Plotly.relayout(sensor_desc, {
+                                'xaxis.range': xAxisRange,
+                                'annotations[0].text': labelText
+                            });
+                        }
+                    };
+                </script>
+            </body>
+        </html>
+    """,
+        num_sensors=len(supported_sensors),
+        supported_sensors=supported_sensors_desc,
+        start_time=start_time,
+        window=PLOT_WINDOW,
+        max_points=MAX_PLOT_POINTS,
+        push_interval=DATASTREAM_PUSH_INTERVAL,
+    )
+
+
+@app.route("/data")
+def data():
+    """
+    Returns the samples received after ``since``.
+
+    Query parameters:
+        since (int): The cursor from the previous response, 0 at first.
+        window (float): Only samples from the newest ``window`` seconds.
+        format (str): ``json`` (default), ``binary`` or ``packed``.
+    """
+    # The producer polls in the background; every client reads the same store
+    current = engine
+    if current is None:
+        return not_running()
+    names = [sensor.name for sensor in supported_sensors]
+    cursor, columns = current.store.since(
+        names,
+        request.args.get("since", 0, type=int),
+        request.args.get("window", type=float),
+    )
+    if request.args.get("format") == "binary":
+        return Response(encode_binary(cursor, columns), mimetype=BINARY_MIMETYPE)
+    if request.args.get("format") == "packed":
+        return Response(
+            encode_packed(cursor, columns, names), mimetype=BINARY_MIMETYPE
+        )
+    return jsonify(
+        {
+            **encode_json(cursor, columns),
+            "start_time": start_time,
+            "suspect_cylinders": misfire_suspects(current.store, supported_sensors),
+            "anomalies": [
+                {"timestamp": anomaly.timestamp, "message": anomaly.message}
+                for anomaly in (detector.anomalies if detector is not None else ())
+            ],
+            "rule_events": [
+                {
+                    "timestamp": event.timestamp,
+                    "rule": event.rule.name,
+                    "triggered": event.triggered,
+                }
+                for event in (rule_engine.events if rule_engine is not None else ())
+            ],
+        }
+    )
+
+
+@app.route("/stream")
+def stream():
+    """
+    Pushes new samples as Server-Sent Events.
+
+    Each event carries the samples acquired since the previous one, in the
+    JSON form of ``/data``, and has the cursor as its ID so a reconnecting
+    browser resumes where it left off.
+
+    The stream ends when the datastream stops.
+
+    Query parameters:
+        interval (float): Seconds new samples are coalesced into one event.
+        window (float): Seconds of history in the first event.
+    """
+    current = engine
+    if current is None:
+        return not_running()
+    interval = request.args.get("interval", DATASTREAM_PUSH_INTERVAL, type=float)
+    window = request.args.get("window", type=float)
+    cursor = request.headers.get("Last-Event-ID", 0, type=int)
+    names = [sensor.name for sensor in supported_sensors]
+    # only wakes the stream up; the samples are read from the store
+    subscription = current.hub.subscribe(f"stream {request.remote_addr}", maxsize=1)
+
+    def events():
+        nonlocal cursor
+        sent = 0.0
+        try:
+            while engine is current:
+                if cursor and subscription.get(STREAM_KEEPALIVE) is None:
+                    yield ": keepalive\n\n"
+                    continue
+                time.sleep(max(0.0, sent + interval - time.monotonic()))
+                subscription.drain()
+                sent = time.monotonic()
+                cursor, columns = current.store.since(names, cursor, window)
+                update = encode_json(cursor, columns)
+                payload = json.dumps(update, separators=(",", ":"))
+                yield f"id: {cursor}\ndata: {payload}\n\n"
+        finally:
+            current.hub.unsubscribe(subscription)
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def start_datastream(profile_names=("air-fuel",), alerts=False, rules_path=None):
+    """
+    Starts polling the sensors of some profiles for the dashboard, unless
+    a datastream is already running.
+
+    Args:
+        profile_names (list): Built-in profile names or profile file paths.
+        alerts (bool): Speak anomaly alerts and rule messages; they are
+            listed by ``/data`` either way.
+        rules_path (str): Rule file to evaluate, if any.
+    """
+    global engine, supported_sensors, detector, rule_engine, recorder
+    if engine is not None:
+        return
+    engine = engine_from_config(profile_names)
+    speaker = Speaker() if alerts else None
+    detector = AnomalyDetector(engine.hub, speaker=speaker).start()
+    if rules_path:
+        rule_engine = watch_rules(
+            engine, load_rules(rules_path), speaker, DATASTREAM_SNAPSHOT_DIR
+        )
+    supported_sensors = engine.channels
+    recorder = SessionRecorder(
+        engine.hub, DATASTREAM_RECORD_DIR, supported_sensors
+    ).start()
+
+
+def run_dashboard(profile_names=("air-fuel",), host="127.0.0.1", port=5000,
+                  alerts=False, rules_path=None):
+    """
+    Starts the datastream and serves the dashboard until interrupted.
+
+    If the dashboard is already being served, only the datastream is
+    (re)started and this returns at once.
+
+    Args:
+        profile_names (list): Built-in profile names or profile file paths.
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        alerts (bool): Speak anomaly alerts and rule messages.
+        rules_path (str): Rule file to evaluate, if any.
+    """
+    global server_running
+    start_datastream(profile_names, alerts, rules_path)
+    if server_running:
+        return
+    server_running = True
+    try:
+        app.run(host=host, port=port, debug=False, threaded=True, use_reloader=False)
+    finally:
+        server_running = False
+
+
+def export_datastream(out_path):
+    """
+    Exports the session recorded so far while recording carries on.
+
+    Args:
+        out_path (str): A ``.csv`` or ``.xlsx`` file.
+
+    Returns:
+        int: Rows written, or None if no datastream is running.
+    """
+    if recorder is None:
+        return None
+    return export_session(recorder.path, out_path)
+
+
+def stop_datastream():
+    global engine, detector, rule_engine, recorder
+    if recorder is not None:
+        recorder.stop()
+        recorder = None
+    if rule_engine is not None:
+        rule_engine.stop()
+        rule_engine = None
+    if detector is not None:
+        detector.stop()
+        detector = None
+    if engine is not None:
+        engine.stop()
+        engine = None
@@ -0,0 +1,149 @@
+"""
+This module encodes incremental datastream updates for dashboards.
+
+An update is a cursor plus, for every channel in a fixed order, the samples
+that arrived after the client's previous cursor. It is sent either as JSON
+or as a columnar binary message whose arrays a browser maps straight onto
+typed arrays without parsing, or packed (see ``datastreams.codec``) for slow links, at
+a few bytes per sample.
+
+Binary layout (little-endian, every section 8-byte aligned):
+    header: magic ``OBDC``, uint64 cursor, uint16 channel count, 2 pad bytes
+    per channel: uint32 sample count ``n``, 4 pad bytes,
+                 float64[n] timestamps, float32[n] values padded to 8 bytes
+
+Packed layout (little-endian):
+    header: magic ``OBDP``, uint64 cursor, uint16 channel count, 2 pad bytes
+    per channel: uint32 block length, then a block from ``encode_block``
+"""
+import struct
+
+import numpy as np
+
+from datastreams.codec import decode_block, encode_block
+
+MAGIC = b"OBDC"
+HEADER = struct.Struct("<4sQH2x")
+CHANNEL = struct.Struct("<I4x")
+
+PACKED_MAGIC = b"OBDP"
+PACKED_CHANNEL = struct.Struct("<I")
+
+BINARY_MIMETYPE = "application/octet-stream"
+
+
+def encode_json(cursor, columns):
+    """
+    Builds the JSON form of an update.
+
+    Args:
+        cursor (int): The cursor for the client's next request.
+        columns (list): ``(timestamps, values)`` arrays per channel.
+
+    Returns:
+        dict: ``cursor``, ``timestamps`` and ``values``, one list per
+        channel; missing values are None since JSON has no NaN.
+    """
+    return {
+        "cursor": cursor,
+        "timestamps": [timestamps.tolist() for timestamps, _ in columns],
+        "values": [
+            [None if np.isnan(value) else value for value in values.tolist()]
+            for _, values in columns
+        ],
+    }
+
+
+def encode_binary(cursor, columns):
+    """
+    Builds the binary form of an update.
+
+    Args:
+        cursor (int): The cursor for the client's next request.
+        columns (list): ``(timestamps, values)`` arrays per channel.
+
+    Returns:
+        bytes: The message.
+    """
+    parts = [HEADER.pack(MAGIC, cursor, len(columns))]
+    for timestamps, values in columns:
+        parts.append(CHANNEL.pack(len(timestamps)))
+        parts.append(np.asarray(timestamps, dtype="<f8").tobytes())
+        packed = np.asarray(values, dtype="<f4").tobytes()
+        parts.append(packed + bytes(-len(packed) % 8))
+    return b"".join(parts)
+
+
+def decode_binary(message):
+    """
+    Reads a binary update.
+
+    Args:
+        message (bytes): The message.
+
+    Returns:
+        tuple: ``(cursor, columns)`` as passed to ``encode_binary``.
+
+    Raises:
+        ValueError: If the message is not an update.
+    """
+    magic, cursor, count = HEADER.unpack_from(message)
+    if magic != MAGIC:
+        raise ValueError("Not a datastream update")
+    offset = HEADER.size
+    columns = []
+    for _ in range(count):
+        (length,) = CHANNEL.unpack_from(message, offset)
+        offset += CHANNEL.size
+        timestamps = np.frombuffer(message, "<f8", length, offset)
+        offset += 8 * length
+        values = np.frombuffer(message, "<f4", length, offset)
+        offset += 4 * length + (-4 * length) % 8
+        columns.append((timestamps, values))
+    return cursor, columns
+
+
+def encode_packed(cursor, columns, names):
+    """
+    Builds the packed form of an update.
+
+    Args:
+        cursor (int): The cursor for the client's next request.
+        columns (list): ``(timestamps, values)`` arrays per channel.
+        names (list): Channel names, to find each channel's resolution.
+
+    Returns:
+        bytes: The message.
+    """
+    parts = [HEADER.pack(PACKED_MAGIC, cursor, len(columns))]
+    for name, (timestamps, values) in zip(names, columns):
+        block = encode_block(timestamps, values, name)
+        parts.append(PACKED_CHANNEL.pack(len(block)))
+        parts.append(block)
+    return b"".join(parts)
+
+
+def decode_packed(message):
+    """
+    Reads a packed update.
+
+    Args:
+        message (bytes): The message.
+
+    Returns:
+        tuple: ``(cursor, columns)`` as passed to ``encode_packed``.
+
+    Raises:
+        ValueError: If the message is not a packed update.
+    """
+    magic, cursor, count = HEADER.unpack_from(message)
+    if magic != PACKED_MAGIC:
+        raise ValueError("Not a packed datastream update")
+    offset = HEADER.size
+    columns = []
+    for _ in range(count):
+        (length,) = PACKED_CHANNEL.unpack_from(message, offset)
+        offset += PACKED_CHANNEL.size
+        columns.append(decode_block(message[offset:offset + length]))
+        offset += length
+    return cursor, columns
@@ -0,0 +1,269 @@
+"""
+This module negotiates ELM327/STN adapter settings for fast polling.
+
+Out of the box an adapter echoes every command, pads responses with spaces
+and linefeeds, waits the full default timeout for slow ECUs and searches for
+the protocol on every session. ``negotiate_adapter`` turns those off, enables
+adaptive timing with a timeout sized to the vehicle's measured response time,
+pins the detected protocol, raises the UART baud rate on adapters that
+support it, and measures queries per second before and after.
+"""
+import math
+import time
+
+from utils.elm327_transport import TransportTimeout
+
+# Settings that only cost bytes on the wire. Headers stay on so responses can
+# be attributed to ECUs.
+BASE_COMMANDS = ("ATE0", "ATL0", "ATS0", "ATH1")
+
+# Baud rates tried, fastest first, on adapters that can switch at runtime.
+STN_BAUD_RATES = (2000000, 1000000, 500000, 230400, 115200)
+ELM_BAUD_RATES = (500000, 230400, 115200)
+
+# The ATST unit is 4.096 ms.
+ATST_UNIT = 0.004096
+
+# Seconds the adapter waits for the host to confirm a new baud rate.
+BAUD_SWITCH_DEADLINE = 0.5
+
+
+class AdapterReport:
+    """
+    Outcome of an adapter negotiation.
+
+    Attributes:
+        identity (str): ``ATI``/``STI`` identification string.
+        is_stn (bool): True for OBDLink/STN based adapters.
+        protocol_id (str): Pinned ELM327 protocol number.
+        protocol_name (str): Protocol description from ``ATDP``.
+        lines_0100 (list): Response to ``0100`` used to tag ECUs.
+        timeout (int): ATST value programmed, in 4.096 ms units.
+        baudrate_before (int): UART baud rate before negotiation.
+        baudrate_after (int): UART baud rate after negotiation.
+        qps_before (float): Queries per second before negotiation.
+        qps_after (float): Queries per second after negotiation.
+    """
+
+    def __init__(self):
+        self.identity = ""
+        self.is_stn = False
+        self.protocol_id = None
+        self.protocol_name = ""
+        self.lines_0100 = []
+        self.timeout = None
+        self.baudrate_before = None
+        self.baudrate_after = None
+        self.qps_before = 0.0
+        self.qps_after = 0.0
+
+    def __str__(self):
+        gain = self.qps_after / self.qps_before if self.qps_before else 0.0
+        return (
+            f"Adapter: {self.identity} ({'STN' if self.is_stn else 'ELM327'})\n"
+            f"Protocol: {self.protocol_name} ({self.protocol_id})\n"
+            f"Timeout: ATST{self.timeout:02X}\n"
+            f"Baud rate: {self.baudrate_before} -> {self.baudrate_after}\n"
+            f"Queries/s: {self.qps_before:.1f} -> {self.qps_after:.1f} "
+            f"({gain:.1f}x)"
+        )
+
+
+def measure_qps(transport, command="0100", count=20):
+    """
+    Measures how many queries per second the link sustains.
+
+    Args:
+        transport (ELM327Transport): The open transport.
+        command (str): A command every vehicle answers.
+        count (int): Number of queries to time.
+
+    Returns:
+        float: Queries per second, 0 if the command timed out.
+    """
+    started = time.monotonic()
+    try:
+        for _ in range(count):
+            transport.query_sync(command)
+    except TransportTimeout:
+        return 0.0
+    return count / (time.monotonic() - started)
+
+
+def detect_protocol(transport):
+    """
+    Runs the automatic protocol search once and pins the result.
+
+    Args:
+        transport (ELM327Transport): The open transport.
+
+    Returns:
+        tuple: ``(protocol_id, protocol_name, lines_0100)``.
+    """
+    transport.query_sync("ATSP0")
+    # 0100 triggers the search; slow K-line inits need the long deadline
+    lines_0100 = transport.query_sync("0100", deadline=15).lines
+    protocol_id = transport.query_sync("ATDPN").text.strip()
+    # "A" marks a protocol found by the search; protocol A itself is SAE J1939
+    if len(protocol_id) == 2 and protocol_id[0] == "A":
+        protocol_id = protocol_id[1]
+    protocol_id = protocol_id or None
+    protocol_name = transport.query_sync("ATDP").text.replace("AUTO, ", "")
+    if protocol_id and protocol_id != "0":
+        transport.query_sync(f"ATSP{protocol_id}")
+    return protocol_id, protocol_name, lines_0100
+
+
+def tune_timeout(transport, samples=5, margin=1.5):
+    """
+    Enables adaptive timing and sizes ATST to the ECU's response time.
+
+    ATST caps how long the adapter waits for an ECU to answer, and for more
+    ECUs after the last answer; the default of about 200 ms is paid on every
+    single query. It is sized from the time to the first byte of the
+    answer, since the whole query also includes that listening wait. Echo
+    must be off, or the echo would be the first byte.
+
+    Args:
+        transport (ELM327Transport): The open transport.
+        samples (int): Number of ``0100`` queries to time.
+        margin (float): Multiplier over the slowest answer seen.
+
+    Returns:
+        int: The ATST value programmed.
+    """
+    transport.query_sync("ATAT1")
+    slowest = max(
+        transport.query_sync("0100").first_byte for _ in range(samples)
+    )
+    timeout = min(0xFF, max(0x04, math.ceil(slowest * margin / ATST_UNIT)))
+    transport.query_sync(f"ATST{timeout:02X}")
+    return timeout
+
+
+def switch_baudrate(transport, command, baudrate):
+    """
+    Performs the ELM327/STN baud rate handshake.
+
+    The adapter answers ``OK`` at the old rate, switches, prints its ID at
+    the new rate and keeps the new rate only if the host answers with a
+    carriage return in time; otherwise it falls back to the old rate.
+
+    Args:
+        transport (ELM327Transport): The open transport.
+        command (str): ``STBR <baud>`` or ``ATBRD <divisor>``.
+        baudrate (int): The new host baud rate.
+
+    Returns:
+        bool: True if the adapter is now at ``baudrate``.
+    """
+
+    def handshake(port):
+        old = port.baudrate
+        port.reset_input_buffer()
+        port.write(command.encode() + b"\r")
+        port.flush()
+        deadline = time.monotonic() + BAUD_SWITCH_DEADLINE
+        reply = bytearray()
+        while b"OK" not in reply and time.monotonic() < deadline:
+            reply += port.read(port.in_waiting or 1)
+            if b"?" in reply or b">" in reply:
+                return False
+        if b"OK" not in reply:
+            return False
+
+        port.baudrate = baudrate
+        # the ID may already have arrived in the same read as the OK
+        identity = reply[reply.index(b"OK") + 2:]
+        deadline = time.monotonic() + BAUD_SWITCH_DEADLINE
+        while time.monotonic() < deadline and b"\r" not in identity.lstrip(b"\r"):
+            identity += port.read(port.in_waiting or 1)
+        if b"ELM" in identity or b"STN" in identity:
+            port.write(b"\r")
+            port.flush()
+            if transport.read_until_prompt(
+                time.monotonic() + BAUD_SWITCH_DEADLINE
+            ) is not None:
+                return True
+
+        # the adapter reverts on its own; wait for it and resync at old rate
+        port.baudrate = old
+        time.sleep(BAUD_SWITCH_DEADLINE)
+        port.reset_input_buffer()
+        port.write(b"\r")
+        transport.read_until_prompt(time.monotonic() + BAUD_SWITCH_DEADLINE)
+        return False
+
+    switched = transport.run_exclusive(handshake).result()
+    if switched:
+        transport.baudrate = baudrate
+    return switched
+
+
+def raise_baudrate(transport, is_stn, rates=None):
+    """
+    Switches the UART to the fastest baud rate the adapter accepts.
+
+    Args:
+        transport (ELM327Transport): The open transport.
+        is_stn (bool): Use ``STBR`` instead of ``ATBRD``.
+        rates (tuple): Candidate baud rates, fastest first.
+
+    Returns:
+        int: The baud rate in use afterwards.
+    """
+    if rates is None:
+        rates = STN_BAUD_RATES if is_stn else ELM_BAUD_RATES
+    for rate in rates:
+        if rate <= transport.baudrate:
+            break
+        if is_stn:
+            command = f"STBR {rate}"
+        else:
+            command = f"ATBRD{round(4000000 / rate):02X}"
+        if switch_baudrate(transport, command, rate):
+            break
+    return transport.baudrate
+
+
+def negotiate_adapter(transport, raise_baud=True, benchmark_count=20):
+    """
+    Configures the adapter for fast polling and reports the gain.
+
+    Args:
+        transport (ELM327Transport): The open transport.
+        raise_baud (bool): Try to switch to a faster UART baud rate.
+        benchmark_count (int): Queries timed before and after; 0 skips the
+            benchmark.
+
+    Returns:
+        AdapterReport: What was negotiated and the measured rates.
+    """
+    report = AdapterReport()
+    report.baudrate_before = transport.baudrate
+
+    transport.query_sync("ATZ")
+    report.identity = transport.query_sync("ATI").text
+    stn_identity = transport.query_sync("STI")
+    report.is_stn = stn_identity.error is None and bool(stn_identity.lines)
+    if report.is_stn:
+        report.identity = stn_identity.text
+
+    # the first search is slow on every protocol, so time only after it
+    report.protocol_id, report.protocol_name, report.lines_0100 = detect_protocol(
+        transport
+    )
+    if benchmark_count:
+        report.qps_before = measure_qps(transport, count=benchmark_count)
+
+    for command in BASE_COMMANDS:
+        transport.query_sync(command)
+    report.lines_0100 = transport.query_sync("0100").lines
+    report.timeout = tune_timeout(transport)
+    if raise_baud:
+        raise_baudrate(transport, report.is_stn)
+    report.baudrate_after = transport.baudrate
+
+    if benchmark_count:
+        report.qps_after = measure_qps(transport, count=benchmark_count)
+    return report
@@ -0,0 +1,396 @@
+"""
+This module passively monitors the CAN bus through the adapter.
+
+``ATMA`` (``STMA`` on STN adapters) makes the adapter print every frame it
+sees until a character is sent, so broadcast traffic arrives at thousands of
+frames per second with no requests at all. ``BusMonitor`` runs the monitor
+on the transport's I/O thread, parses the stream a chunk at a time with
+NumPy and writes the frames into a preallocated ``FrameRing``. Readers take
+frames from the ring without locking; frames they were too slow to read are
+counted as dropped.
+
+While the monitor runs the adapter answers no requests, so broker clients
+wait until it stops.
+
+Usage:
+    python -m utils.bus_monitor /dev/ttyUSB0 --seconds 10 --ids 0C9,1F5
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from utils.elm327_transport import ELM327Transport, TransportError
+from utils.isotp import CAN_HEADER_LENGTHS
+
+# Largest classic CAN payload.
+MAX_DLC = 8
+
+DEFAULT_CAPACITY = 65536
+
+# Sent before monitoring: no spaces, headers on, raw frames including PCI.
+MONITOR_SETUP = ("ATS0", "ATH1", "ATCAF0")
+MONITOR_TEARDOWN = ("ATCAF1", "ATCRA")
+
+# Seconds to wait for the prompt after stopping the monitor.
+STOP_DEADLINE = 1.0
+
+# Nibble value per ASCII code, and whether the code is a hex digit at all.
+_NIBBLE = np.zeros(256, dtype=np.uint8)
+_IS_HEX = np.zeros(256, dtype=bool)
+for _i, _char in enumerate(b"0123456789ABCDEF"):
+    _NIBBLE[_char] = _i
+    _IS_HEX[_char] = True
+
+
+class FrameRing:
+    """
+    A fixed-size ring of CAN frames for one writer and any number of readers.
+
+    The ring is a sequence lock without the lock: the writer advances
+    ``reserved`` before it touches a slot and ``written`` once it is done. A
+    reader copies the slots below ``written`` and then checks ``reserved``,
+    discarding any slot a write began on during the copy, finished or not.
+
+    Attributes:
+        timestamps (numpy.ndarray): ``time.monotonic()`` of each frame.
+        ids (numpy.ndarray): Arbitration IDs.
+        dlcs (numpy.ndarray): Payload lengths.
+        data (numpy.ndarray): ``(capacity, 8)`` payload bytes.
+        written (int): Frames written since creation.
+        reserved (int): Frames written or being written since creation.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        Args:
+            capacity (int): Number of frames kept.
+        """
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.ids = np.zeros(capacity, dtype=np.uint32)
+        self.dlcs = np.zeros(capacity, dtype=np.uint8)
+        self.data = np.zeros((capacity, MAX_DLC), dtype=np.uint8)
+        self.written = 0
+        self.reserved = 0
+
+    def push(self, timestamps, ids, dlcs, data):
+        """
+        Appends a batch of frames, overwriting the oldest ones.
+
+        Args:
+            timestamps (numpy.ndarray): Arrival times.
+            ids (numpy.ndarray): Arbitration IDs.
+            dlcs (numpy.ndarray): Payload lengths.
+            data (numpy.ndarray): ``(n, 8)`` payload bytes.
+        """
+        count = len(ids)
+        # claim the slots before writing them, so readers can tell
+        self.reserved = self.written + count
+        position = self.written
+        if count > self.capacity:
+            timestamps, ids = timestamps[-self.capacity:], ids[-self.capacity:]
+            dlcs, data = dlcs[-self.capacity:], data[-self.capacity:]
+            position += count - self.capacity
+            count = self.capacity
+        start = position % self.capacity
+        first = min(count, self.capacity - start)
+        for source, target in (
+            (timestamps, self.timestamps),
+            (ids, self.ids),
+            (dlcs, self.dlcs),
+            (data, self.data),
+        ):
+            target[start:start + first] = source[:first]
+            target[:count - first] = source[first:]
+        self.written = self.reserved
+
+    def since(self, cursor):
+        """
+        Copies the frames written after ``cursor``.
+
+        Args:
+            cursor (int): ``written`` value from the previous call, 0 at first.
+
+        Returns:
+            tuple: ``(frames, cursor, dropped)``; ``frames`` is a tuple of
+            ``(timestamps, ids, dlcs, data)`` arrays, ``cursor`` the value to
+            pass next time and ``dropped`` the frames overwritten unread.
+        """
+        end = self.written
+        start = max(cursor, end - self.capacity)
+        slots = np.arange(start, end) % self.capacity
+        frames = (
+            self.timestamps[slots],
+            self.ids[slots],
+            self.dlcs[slots],
+            self.data[slots],
+        )
+        # slots a write began on while they were being copied
+        lapped = min(end - start, max(0, self.reserved - self.capacity - start))
+        if lapped:
+            frames = tuple(array[lapped:] for array in frames)
+        return frames, end, start - cursor + lapped
+
+    def latest(self, seconds):
+        """
+        Copies the frames received in the last ``seconds``.
+
+        Args:
+            seconds (float): Window length.
+
+        Returns:
+            tuple: ``(timestamps, ids, dlcs, data)`` arrays.
+        """
+        frames, _, _ = self.since(0)
+        keep = frames[0] >= time.monotonic() - seconds
+        return tuple(array[keep] for array in frames)
+
+
+def parse_frames(chunk, header_length):
+    """
+    Parses complete monitor lines into frame arrays.
+
+    Lines are grouped by length so each group converts with a handful of
+    array operations, whatever the number of frames.
+
+    Args:
+        chunk (bytes): Monitor output ending with a carriage return.
+        header_length (int): Hex digits in the arbitration ID.
+
+    Returns:
+        tuple: ``(ids, dlcs, data, errors, overflows)``; ``errors`` counts
+        lines that are not frames and ``overflows`` the adapter's
+        ``BUFFER FULL`` reports.
+    """
+    raw = np.frombuffer(chunk, dtype=np.uint8)
+    ends = np.flatnonzero(raw == 13)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts
+    nonempty = lengths > 0
+    starts, lengths = starts[nonempty], lengths[nonempty]
+
+    ids = []
+    dlcs = []
+    data = []
+    order = []
+    errors = 0
+    for length in np.unique(lengths):
+        rows = np.flatnonzero(lengths == length)
+        payload = int(length) - header_length
+        if payload < 2 or payload % 2 or payload > 2 * MAX_DLC:
+            errors += len(rows)
+            continue
+        chars = raw[starts[rows, None] + np.arange(length)]
+        valid = _IS_HEX[chars].all(axis=1)
+        errors += int(len(rows) - valid.sum())
+        chars, rows = chars[valid], rows[valid]
+        nibbles = _NIBBLE[chars].astype(np.uint32)
+        weights = 16 ** np.arange(header_length - 1, -1, -1, dtype=np.uint32)
+        frame_data = np.zeros((len(rows), MAX_DLC), dtype=np.uint8)
+        frame_data[:, :payload // 2] = (
+            nibbles[:, header_length::2] << 4 | nibbles[:, header_length + 1::2]
+        )
+        ids.append(nibbles[:, :header_length] @ weights)
+        dlcs.append(np.full(len(rows), payload // 2, dtype=np.uint8))
+        data.append(frame_data)
+        order.append(rows)
+
+    overflows = chunk.count(b"BUFFER FULL")
+    errors = max(0, errors - overflows)
+    if not ids:
+        return (
+            np.empty(0, dtype=np.uint32),
+            np.empty(0, dtype=np.uint8),
+            np.empty((0, MAX_DLC), dtype=np.uint8),
+            errors,
+            overflows,
+        )
+    # restore arrival order across the length groups
+    index = np.argsort(np.concatenate(order), kind="stable")
+    return (
+        np.concatenate(ids)[index].astype(np.uint32),
+        np.concatenate(dlcs)[index],
+        np.concatenate(data)[index],
+        errors,
+        overflows,
+    )
+
+
+class BusMonitor:
+    """
+    Streams CAN frames from the adapter's monitor mode into a ring buffer.
+
+    Example:
+        monitor = BusMonitor(transport, protocol_id="6", ids={0x0C9})
+        monitor.start()
+        time.sleep(5)
+        monitor.stop()
+        print(monitor.stats())
+
+    Attributes:
+        ring (FrameRing): The received frames.
+        frames (int): Frames parsed, before ID filtering.
+        errors (int): Lines that could not be parsed.
+        overflows (int): ``BUFFER FULL`` reports; the adapter lost frames.
+    """
+
+    def __init__(self, transport, protocol_id="6", is_stn=False, ids=None,
+                 capacity=DEFAULT_CAPACITY):
+        """
+        Args:
+            transport (ELM327Transport): The open transport.
+            protocol_id (str): ELM327 CAN protocol number, for the ID length.
+            is_stn (bool): Use ``STMA`` instead of ``ATMA``.
+            ids (set): Keep only these arbitration IDs; None keeps all.
+            capacity (int): Frames kept in the ring.
+        """
+        if protocol_id not in CAN_HEADER_LENGTHS:
+            raise ValueError(f"Protocol {protocol_id} is not a CAN protocol")
+        self.transport = transport
+        self.header_length = CAN_HEADER_LENGTHS[protocol_id]
+        self.command = "STMA" if is_stn else "ATMA"
+        self.ids = None if ids is None else np.array(sorted(ids), dtype=np.uint32)
+        self.ring = FrameRing(capacity)
+        self.frames = 0
+        self.errors = 0
+        self.overflows = 0
+        self.started = None
+        self._stop = threading.Event()
+        self._future = None
+
+    def start(self):
+        """
+        Configures the adapter and starts monitoring on the I/O thread.
+
+        A single 11-bit ID filter is also programmed into the adapter with
+        ``ATCRA`` so it never sends other frames.
+
+        Returns:
+            concurrent.futures.Future: Resolves when the monitor stops.
+        """
+        for command in MONITOR_SETUP:
+            self.transport.query_sync(command)
+        if self.ids is not None and len(self.ids) == 1 and self.header_length == 3:
+            self.transport.query_sync(f"ATCRA{int(self.ids[0]):03X}")
+        self._stop.clear()
+        self.started = time.monotonic()
+        self._future = self.transport.run_exclusive(self._monitor)
+        return self._future
+
+    def stop(self):
+        """
+        Stops monitoring and restores the adapter settings.
+        """
+        if self._future is None:
+            return
+        self._stop.set()
+        self._future.result()
+        self._future = None
+        for command in MONITOR_TEARDOWN:
+            self.transport.query_sync(command)
+
+    def _monitor(self, port):
+        port.reset_input_buffer()
+        port.write(self.command.encode() + b"\r")
+        port.flush()
+        pending = bytearray()
+        echo = self.command.encode() + b"\r"
+        previous = time.monotonic()
+        while not self._stop.is_set():
+            pending += port.read(port.in_waiting or 1)
+            end = pending.rfind(b"\r")
+            if end < 0:
+                continue
+            if echo and pending.startswith(echo):
+                # the command echoed back when echo is on (ATE1)
+                del pending[:len(echo)]
+                end -= len(echo)
+            echo = None
+            if end < 0:
+                continue
+            now = time.monotonic()
+            self._ingest(bytes(pending[:end + 1]), previous, now)
+            del pending[:end + 1]
+            previous = now
+            if pending.endswith(b">"):
+                # the adapter left monitor mode on its own
+                return False
+        # any character ends the monitor
+        port.write(b"\r")
+        port.flush()
+        self.transport.read_until_prompt(time.monotonic() + STOP_DEADLINE)
+        return True
+
+    def _ingest(self, chunk, previous, now):
+        ids, dlcs, data, errors, overflows = parse_frames(chunk, self.header_length)
+        self.frames += len(ids)
+        self.errors += errors
+        self.overflows += overflows
+        if self.ids is not None:
+            keep = np.isin(ids, self.ids)
+            ids, dlcs, data = ids[keep], dlcs[keep], data[keep]
+        if not len(ids):
+            return
+        # the adapter has no timestamps; spread the chunk over its read window
+        timestamps = np.linspace(previous, now, len(ids) + 1)[1:]
+        self.ring.push(timestamps, ids, dlcs, data)
+
+    def stats(self, window=1.0):
+        """
+        Reports frame rates per arbitration ID.
+
+        Args:
+            window (float): Seconds of recent frames to measure over.
+
+        Returns:
+            dict: Totals and ``rates``, a dict of ID (hex string) to frames
+            per second.
+        """
+        timestamps, ids, _, _ = self.ring.latest(window)
+        elapsed = min(window, time.monotonic() - (self.started or time.monotonic()))
+        unique, counts = np.unique(ids, return_counts=True)
+        width = self.header_length
+        return {
+            "frames": self.frames,
+            "frames_per_second": round(len(ids) / elapsed, 1) if elapsed else 0.0,
+            "errors": self.errors,
+            "overflows": self.overflows,
+            "rates": {
+                f"{int(can_id):0{width}X}": round(float(count) / elapsed, 1)
+                for can_id, count in zip(unique, counts)
+            } if elapsed else {},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monitor CAN bus traffic")
+    parser.add_argument("port", help="serial port, pyserial URL or replay URL")
+    parser.add_argument("--baudrate", type=int, default=38400)
+    parser.add_argument("--protocol", default="6", help="ELM327 CAN protocol")
+    parser.add_argument("--stn", action="store_true", help="use STMA")
+    parser.add_argument("--ids", help="comma separated hex IDs to keep")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    ids = None
+    if args.ids:
+        ids = {int(can_id, 16) for can_id in args.ids.split(",")}
+    try:
+        with ELM327Transport(args.port, args.baudrate) as transport:
+            transport.query_sync(f"ATSP{args.protocol}")
+            monitor = BusMonitor(transport, args.protocol, args.stn, ids)
+            monitor.start()
+            time.sleep(args.seconds)
+            stats = monitor.stats(window=args.seconds)
+            monitor.stop()
+    except TransportError as e:
+        print(f"Bus monitor failed: {e}")
+        return
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
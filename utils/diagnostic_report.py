@@ -0,0 +1,211 @@
+"""
+This module runs diagnostic report stages concurrently.
+
+A report needs adapter reads (VIN, DTCs, freeze frame, calibration data) and
+NHTSA lookups that depend on the VIN. Run one after another, the report takes
+as long as every stage added together. ``ReportPipeline`` starts each stage
+as soon as the stages it depends on are done, so the adapter reads proceed
+while the HTTP lookups are in flight. Each stage has its own timeout; a
+stage that fails, times out or returns None leaves its result empty and
+skips only the stages that need it.
+"""
+import concurrent.futures
+import time
+
+# Seconds a stage may run before its result is abandoned.
+DEFAULT_STAGE_TIMEOUT = 15.0
+
+OK = "ok"
+ERROR = "error"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+
+
+class StageResult:
+    """
+    The outcome of one pipeline stage.
+
+    Attributes:
+        name (str): Stage name.
+        status (str): ``ok``, ``error``, ``timeout`` or ``skipped``.
+        value: The stage's return value, None unless ``status`` is ``ok``.
+        error (str): Why the stage has no value.
+        started (float): Seconds from the pipeline start to the stage start.
+        elapsed (float): Seconds the stage ran.
+    """
+
+    def __init__(self, name, status, value=None, error=None, started=0.0,
+                 elapsed=0.0):
+        self.name = name
+        self.status = status
+        self.value = value
+        self.error = error
+        self.started = started
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f"StageResult({self.name!r}, {self.status!r}, {self.elapsed:.2f}s)"
+
+
+class _Stage:
+    __slots__ = ("name", "func", "depends", "timeout")
+
+    def __init__(self, name, func, depends, timeout):
+        self.name = name
+        self.func = func
+        self.depends = depends
+        self.timeout = timeout
+
+
+class ReportPipeline:
+    """
+    Runs dependent stages on a thread pool.
+
+    Example:
+        pipeline = ReportPipeline()
+        pipeline.add("vin", read_vin, args=(transport,))
+        pipeline.add("vehicle", get_vehicle_data_from_nhtsa, depends=("vin",))
+        results = pipeline.run()
+    """
+
+    def __init__(self, max_workers=6):
+        """
+        Args:
+            max_workers (int): Stages that may run at the same time.
+        """
+        self.max_workers = max_workers
+        self.stages = {}
+        self.elapsed = 0.0
+
+    def add(self, name, func, depends=(), args=(), timeout=DEFAULT_STAGE_TIMEOUT):
+        """
+        Adds a stage.
+
+        Args:
+            name (str): Unique stage name.
+            func (callable): Called with ``args`` followed by the values of the
+                stages in ``depends``, in order.
+            depends (tuple): Names of stages that must succeed, with a value
+                other than None, first.
+            args (tuple): Leading arguments for ``func``.
+            timeout (float): Seconds before the stage is abandoned.
+        """
+        for dependency in depends:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name!r} depends on unknown {dependency!r}")
+
+        def call(*values):
+            return func(*args, *values)
+
+        self.stages[name] = _Stage(name, call, tuple(depends), timeout)
+
+    def run(self):
+        """
+        Runs every stage and waits for all of them to finish, fail, time out
+        or be skipped.
+
+        Returns:
+            dict: Stage name mapped to its StageResult, in the order added.
+        """
+        started = time.monotonic()
+        results = {}
+        running = {}
+        executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        try:
+            while len(results) < len(self.stages):
+                self._start_ready(executor, started, results, running)
+                if not running:
+                    continue
+                now = time.monotonic()
+                deadline = min(s + stage.timeout for stage, s in running.values())
+                done, _ = concurrent.futures.wait(
+                    running,
+                    timeout=max(0.0, deadline - now),
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                now = time.monotonic()
+                for future in list(running):
+                    stage, stage_started = running[future]
+                    if future in done:
+                        error = future.exception()
+                        status = OK if error is None else ERROR
+                        value = future.result() if error is None else None
+                    elif now - stage_started >= stage.timeout:
+                        status, value = TIMEOUT, None
+                        error = f"No result after {stage.timeout:g} s"
+                    else:
+                        continue
+                    del running[future]
+                    results[stage.name] = StageResult(
+                        stage.name,
+                        status,
+                        value,
+                        None if error is None else str(error),
+                        stage_started - started,
+                        now - stage_started,
+                    )
+        finally:
+            # abandoned stages finish in the background
+            executor.shutdown(wait=False)
+        self.elapsed = time.monotonic() - started
+        return {name: results[name] for name in self.stages}
+
+    def _start_ready(self, executor, started, results, running):
+        scheduled = {stage.name for stage, _ in running.values()}
+        for stage in self.stages.values():
+            if stage.name in results or stage.name in scheduled:
+                continue
+            dependencies = [results.get(name) for name in stage.depends]
+            if any(result is None for result in dependencies):
+                continue
+            # a read that found nothing, such as a missing VIN, has nothing
+            # to pass on either
+            failed = [
+                result.name for result in dependencies
+                if result.status != OK or result.value is None
+            ]
+            if failed:
+                results[stage.name] = StageResult(
+                    stage.name,
+                    SKIPPED,
+                    error=f"Needs {', '.join(failed)}",
+                    started=time.monotonic() - started,
+                )
+                continue
+            future = executor.submit(
+                stage.func, *(result.value for result in dependencies)
+            )
+            running[future] = (stage, time.monotonic())
+
+
+def value_of(results, name, default=None):
+    """
+    Returns a stage's value, or ``default`` if it has none.
+    """
+    result = results.get(name)
+    return result.value if result is not None and result.status == OK else default
+
+
+def format_timings(results, elapsed):
+    """
+    Formats the per-stage timing breakdown.
+
+    Args:
+        results (dict): Stage results from ``ReportPipeline.run``.
+        elapsed (float): The pipeline's wall-clock time.
+
+    Returns:
+        str: One line per stage, then the total against the stage times added up.
+    """
+    lines = []
+    for result in results.values():
+        line = (
+            f"{result.name}: {result.status}, started at {result.started:.2f} s, "
+            f"took {result.elapsed:.2f} s"
+        )
+        if result.error:
+            line += f" ({result.error})"
+        lines.append(line)
+    sequential = sum(result.elapsed for result in results.values())
+    lines.append(f"Total: {elapsed:.2f} s (stages added up: {sequential:.2f} s)")
+    return "\n".join(lines)
@@ -0,0 +1,708 @@
+"""
+This module simulates an ELM327 adapter on a Linux pseudo-terminal.
+
+The simulator opens a pty and answers the AT and OBD dialect on its slave
+side, so ``SERIAL_PORT`` can point at it and the voice commands, datastreams
+and broker run unchanged without a vehicle. A vehicle profile scripts what
+the "car" supports: Mode 01 PIDs driven by signal generators, DTCs, VIN,
+calibration IDs and Mode 06 misfire counters. ECU latency, jitter, bus bit
+rate and error injection are configurable and seeded, so benchmark runs are
+repeatable.
+
+Only the CAN protocols (6 to 9) are simulated.
+
+Usage:
+    python -m utils.elm327_simulator --profile air_fuel --latency 0.02
+    python -m utils.elm327_simulator --profile misfire --benchmark 10
+"""
+import argparse
+import math
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+ELM_VERSION = "ELM327 v1.5"
+
+PROTOCOLS = {
+    "6": ("ISO 15765-4 (CAN 11/500)", "7E8", 500000),
+    "7": ("ISO 15765-4 (CAN 29/500)", "18DAF110", 500000),
+    "8": ("ISO 15765-4 (CAN 11/250)", "7E8", 250000),
+    "9": ("ISO 15765-4 (CAN 29/250)", "18DAF110", 250000),
+}
+
+# Default ATST value, 50 x 4.096 ms.
+DEFAULT_TIMEOUT = 0x32
+
+# Seconds the adapter waits for the host's CR after an ATBRD switch.
+BAUD_CONFIRM_WINDOW = 0.2
+
+# Adapter responses used for injected errors; "DROP" loses a CAN frame.
+INJECTED_ERRORS = ("NO DATA", "CAN ERROR", "BUS BUSY", "DROP")
+
+# Broadcast frames seen in monitor mode (ATMA): arbitration ID and rate in Hz.
+BROADCAST_FRAMES = {
+    0x0C9: 100,
+    0x0F1: 100,
+    0x1E9: 50,
+    0x1F5: 50,
+    0x3C1: 20,
+    0x4C1: 10,
+}
+
+# Mode 06 test IDs for misfire monitors, counts units and scaling (UAS 0x24).
+MISFIRE_EWMA_TID = 0x0B
+MISFIRE_CYCLE_TID = 0x0C
+UAS_COUNTS = 0x24
+
+
+def _word(value):
+    value = max(0, min(0xFFFF, int(round(value))))
+    return bytes((value >> 8, value & 0xFF))
+
+
+def _byte(value):
+    return bytes((max(0, min(0xFF, int(round(value)))),))
+
+
+def _drive(t):
+    """
+    Returns a 0..1 pedal position following a repeating 30 s drive cycle.
+    """
+    return (1 - math.cos(2 * math.pi * t / 30)) / 2
+
+
+def _rpm(t, rng):
+    return _word((800 + 2200 * _drive(t) + rng.gauss(0, 15)) * 4)
+
+
+def _speed(t, rng):
+    return _byte(90 * _drive(t - 3))
+
+
+def _throttle(t, rng):
+    return _byte((8 + 50 * _drive(t)) * 255 / 100)
+
+
+def _load(t, rng):
+    return _byte((20 + 60 * _drive(t)) * 255 / 100)
+
+
+def _maf(t, rng):
+    return _word((2.5 + 45 * _drive(t) + rng.gauss(0, 0.3)) * 100)
+
+
+def _map(t, rng):
+    return _byte(30 + 65 * _drive(t))
+
+
+def _coolant(t, rng):
+    return _byte(20 + 70 * (1 - math.exp(-t / 120)) + 40)
+
+
+def _intake(t, rng):
+    return _byte(25 + 40)
+
+
+def _short_trim(t, rng):
+    return _byte((4 * math.sin(t / 2) + rng.gauss(0, 1)) * 128 / 100 + 128)
+
+
+def _long_trim(offset):
+    def generator(t, rng):
+        return _byte(offset * 128 / 100 + 128)
+    return generator
+
+
+def _o2_narrow(phase):
+    def generator(t, rng):
+        volts = 0.45 + 0.4 * math.sin(2 * math.pi * t + phase)
+        return _byte(volts / 0.005) + _short_trim(t, rng)
+    return generator
+
+
+def _lambda(t, phase):
+    return 1 + 0.03 * math.sin(2 * math.pi * t / 2 + phase)
+
+
+def _wr_voltage(phase):
+    def generator(t, rng):
+        return _word(_lambda(t, phase) * 32768) + _word(1.6 * 8192)
+    return generator
+
+
+def _wr_current(phase):
+    def generator(t, rng):
+        milliamps = (1 - _lambda(t, phase)) * -10
+        return _word(_lambda(t, phase) * 32768) + _word((milliamps + 128) * 256)
+    return generator
+
+
+def encode_dtc(code):
+    """
+    Encodes a trouble code such as ``"P0301"`` into its two bytes.
+    """
+    first = "PCBU".index(code[0]) << 6 | int(code[1]) << 4 | int(code[2], 16)
+    return bytes((first, int(code[3:5], 16)))
+
+
+class VehicleProfile:
+    """
+    What the simulated vehicle supports and how its signals move.
+
+    Attributes:
+        name (str): Profile name.
+        signals (dict): Mode 01 PID mapped to ``generator(t, rng)`` returning
+            the raw data bytes at ``t`` seconds.
+        vin (str): 17-character VIN.
+        dtcs (list): Stored trouble codes.
+        pending_dtcs (list): Pending trouble codes.
+        calibration_ids (list): Calibration ID strings, up to 16 characters.
+        cvns (list): Calibration verification numbers as 4 bytes each.
+        misfire_rates (list): Misfires per minute for each cylinder with a
+            Mode 06 misfire monitor.
+        protocol (str): ELM327 protocol number the vehicle answers on.
+    """
+
+    def __init__(self, name, signals, vin, dtcs=(), pending_dtcs=(),
+                 calibration_ids=(), cvns=(), misfire_rates=(), protocol="6"):
+        self.name = name
+        self.signals = signals
+        self.vin = vin
+        self.dtcs = list(dtcs)
+        self.pending_dtcs = list(pending_dtcs)
+        self.calibration_ids = list(calibration_ids)
+        self.cvns = list(cvns)
+        self.misfire_rates = list(misfire_rates)
+        self.protocol = protocol
+
+    def supported(self, mode):
+        """
+        Returns:
+            set: Non-support PIDs (or MIDs) answered in ``mode``.
+        """
+        if mode == 1:
+            return set(self.signals)
+        if mode == 6 and self.misfire_rates:
+            return {0xA2 + i for i in range(len(self.misfire_rates))}
+        if mode == 9:
+            return {0x02, 0x04, 0x06} if self.calibration_ids else {0x02}
+        return set()
+
+    def support_bitmap(self, mode, base):
+        """
+        Builds the answer to a support PID, or None if the range is absent.
+
+        Args:
+            mode (int): The service.
+            base (int): The support PID, a multiple of 0x20.
+
+        Returns:
+            bytes: The four bitmap bytes.
+        """
+        pids = self.supported(mode)
+        if base and not any(pid > base for pid in pids):
+            return None
+        value = 0
+        for pid in pids:
+            if base < pid <= base + 32:
+                value |= 1 << (base + 32 - pid)
+        # the last bit announces the next support range
+        if any(pid > base + 32 for pid in pids):
+            value |= 1
+        return value.to_bytes(4, "big")
+
+
+PROFILES = {
+    "air_fuel": VehicleProfile(
+        "air_fuel",
+        {
+            0x04: _load,
+            0x05: _coolant,
+            0x06: _short_trim,
+            0x07: _long_trim(2.3),
+            0x08: _short_trim,
+            0x09: _long_trim(-1.6),
+            0x0B: _map,
+            0x0C: _rpm,
+            0x0D: _speed,
+            0x0F: _intake,
+            0x10: _maf,
+            0x11: _throttle,
+            0x14: _o2_narrow(0.0),
+            0x18: _o2_narrow(1.3),
+            0x24: _wr_voltage(0.0),
+            0x25: _wr_voltage(0.7),
+            0x26: _wr_voltage(1.4),
+            0x27: _wr_voltage(2.1),
+            0x34: _wr_current(0.0),
+            0x35: _wr_current(0.7),
+            0x36: _wr_current(1.4),
+            0x37: _wr_current(2.1),
+        },
+        vin="1D4GP00R55B123456",
+        dtcs=["P0171", "P0174"],
+        calibration_ids=["68045123AB", "68045124AC"],
+        cvns=[bytes.fromhex("1A2B3C4D"), bytes.fromhex("5E6F7081")],
+    ),
+    "misfire": VehicleProfile(
+        "misfire",
+        {
+            0x04: _load,
+            0x05: _coolant,
+            0x0C: _rpm,
+            0x0D: _speed,
+            0x0F: _intake,
+            0x10: _maf,
+            0x11: _throttle,
+        },
+        vin="2C3CDXBG7EH123456",
+        dtcs=["P0300", "P0303"],
+        pending_dtcs=["P0303"],
+        calibration_ids=["05150851AA"],
+        cvns=[bytes.fromhex("C0FFEE01")],
+        misfire_rates=[0.2, 0.1, 12.0, 0.3, 0.0, 0.4],
+    ),
+}
+
+
+class ELM327Simulator:
+    """
+    An ELM327 answering on the slave side of a pseudo-terminal.
+
+    Example:
+        simulator = ELM327Simulator(PROFILES["air_fuel"], latency=0.02).start()
+        transport = ELM327Transport(simulator.port, 38400)
+    """
+
+    def __init__(self, profile, latency=0.02, jitter=0.0, bus_bitrate=None,
+                 error_rate=0.0, seed=0):
+        """
+        Args:
+            profile (VehicleProfile): The simulated vehicle.
+            latency (float): ECU response time in seconds.
+            jitter (float): Maximum random deviation from ``latency``.
+            bus_bitrate (int): CAN bit rate; defaults to the protocol's.
+            error_rate (float): Probability that an OBD request fails with
+                one of ``INJECTED_ERRORS``.
+            seed (int): Seed for noise, jitter and injected errors.
+        """
+        self.profile = profile
+        self.latency = latency
+        self.jitter = jitter
+        self.bus_bitrate = bus_bitrate
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.port = None
+        self.requests = 0
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+        self._started = None
+        self._reset()
+
+    def _reset(self):
+        self.echo = True
+        self.linefeeds = False
+        self.spaces = True
+        self.headers = False
+        self.adaptive = 1
+        self.timeout = DEFAULT_TIMEOUT
+        self.protocol = "0"
+        self.detected = False
+        self.receive_filter = None
+
+    def start(self):
+        """
+        Opens the pseudo-terminal and starts answering.
+
+        Returns:
+            ELM327Simulator: The simulator, for chaining.
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        tty.setraw(self._master)
+        self.port = os.ttyname(self._slave)
+        self._started = time.monotonic()
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="elm327-simulator", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops answering and closes the pseudo-terminal.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        buffer = bytearray()
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            buffer += os.read(self._master, 1024)
+            while b"\r" in buffer:
+                end = buffer.index(b"\r")
+                line = buffer[:end].decode("ascii", "ignore")
+                del buffer[:end + 1]
+                self._handle(line)
+
+    def _write(self, text):
+        os.write(self._master, text.encode())
+
+    def _wait(self, seconds):
+        # any character from the host aborts the command in progress
+        if seconds <= 0:
+            return False
+        readable, _, _ = select.select([self._master], [], [], seconds)
+        if readable:
+            os.read(self._master, 1024)
+            return True
+        return False
+
+    def _handle(self, line):
+        command = line.replace(" ", "").replace("\n", "").upper()
+        newline = "\r\n" if self.linefeeds else "\r"
+        if self.echo:
+            self._write(line + newline)
+        if not command:
+            self._write(">")
+            return
+        if command.startswith("AT"):
+            lines = self._at(command[2:])
+        elif command.startswith("ST"):
+            lines = ["?"]
+        else:
+            lines = self._obd(command)
+        if lines is None:
+            # the command was interrupted or has already written its prompt
+            return
+        self._write(newline.join(lines) + newline + newline + ">")
+
+    def _at(self, command):
+        if command == "Z" or command == "WS":
+            self._reset()
+            time.sleep(0.01)
+            return ["", ELM_VERSION]
+        if command == "I":
+            return [ELM_VERSION]
+        if command == "@1":
+            return ["OBDII to RS232 Interpreter"]
+        if command == "RV":
+            return ["12.6V"]
+        if command == "D":
+            self._reset()
+            return ["OK"]
+        flags = {"E": "echo", "L": "linefeeds", "S": "spaces", "H": "headers"}
+        if len(command) == 2 and command[0] in flags and command[1] in "01":
+            setattr(self, flags[command[0]], command[1] == "1")
+            return ["OK"]
+        if command in ("AT0", "AT1", "AT2"):
+            self.adaptive = int(command[2])
+            return ["OK"]
+        if command.startswith("ST") and len(command) == 4:
+            self.timeout = int(command[2:], 16) or DEFAULT_TIMEOUT
+            return ["OK"]
+        if command.startswith("SP") or command.startswith("TP"):
+            self.protocol = command[-1]
+            self.detected = False
+            return ["OK"]
+        if command == "DPN":
+            if self.protocol == "0":
+                return [f"A{self.profile.protocol}" if self.detected else "0"]
+            return [self.protocol]
+        if command == "DP":
+            name = PROTOCOLS[self.profile.protocol][0]
+            return [f"AUTO, {name}" if self.protocol == "0" else name]
+        if command.startswith("BRD") and len(command) == 5:
+            self._switch_baudrate()
+            return None
+        if command == "MA":
+            self._monitor_bus()
+            return None
+        if command.startswith("CRA"):
+            self.receive_filter = int(command[3:], 16) if command[3:] else None
+            return ["OK"]
+        if command in ("CAF0", "CAF1", "CFC0", "CFC1", "M0", "M1"):
+            return ["OK"]
+        return ["?"]
+
+    def _switch_baudrate(self):
+        # a pty has no real baud rate; play the handshake so hosts can test it
+        newline = "\r\n" if self.linefeeds else "\r"
+        self._write("OK" + newline)
+        time.sleep(0.01)
+        self._write(ELM_VERSION + newline)
+        confirmed = self._wait(BAUD_CONFIRM_WINDOW)
+        self._write(">" if confirmed else newline + ">")
+
+    def _monitor_bus(self):
+        # print broadcast traffic until the host sends any character
+        newline = "\r\n" if self.linefeeds else "\r"
+        separator = " " if self.spaces else ""
+        due = {can_id: time.monotonic() for can_id in BROADCAST_FRAMES}
+        counter = 0
+        while self._running:
+            now = time.monotonic()
+            lines = []
+            for can_id, rate in BROADCAST_FRAMES.items():
+                while due[can_id] <= now:
+                    due[can_id] += 1 / rate
+                    if self.receive_filter not in (None, can_id):
+                        continue
+                    counter = (counter + 1) & 0xFF
+                    data = bytes((counter, can_id & 0xFF, 0, 0, 0, 0, 0, counter))
+                    text = separator.join(f"{b:02X}" for b in data)
+                    header = f"{can_id:03X}" if self.headers else ""
+                    lines.append(header + separator + text if header else text)
+            if lines:
+                self._write(newline.join(lines) + newline)
+            if self._wait(0.005):
+                break
+        self._write(newline + ">")
+
+    def _obd(self, command):
+        try:
+            request = bytes.fromhex(command)
+        except ValueError:
+            return ["?"]
+        if self.protocol not in ("0", self.profile.protocol):
+            return ["UNABLE TO CONNECT"]
+        lines = []
+        if self.protocol == "0" and not self.detected:
+            lines.append("SEARCHING...")
+            self.detected = True
+        self.requests += 1
+
+        payload = self._respond(request)
+        error = None
+        if self.error_rate and self.rng.random() < self.error_rate:
+            error = self.rng.choice(INJECTED_ERRORS)
+        if payload is None or error in ("NO DATA", "CAN ERROR", "BUS BUSY"):
+            # nothing arrives, so the adapter waits out the full timeout
+            if self._wait(self.timeout * 0.004096):
+                return self._stopped()
+            return lines + [error or "NO DATA"]
+
+        frames = self._frames(payload)
+        if error == "DROP" and len(frames) > 1:
+            del frames[self.rng.randrange(1, len(frames))]
+        arrival, listen = self._response_time(len(frames))
+        if self._wait(arrival):
+            return self._stopped()
+        # frames are printed as they arrive; the prompt follows once the
+        # adapter stops listening for more ECUs
+        newline = "\r\n" if self.linefeeds else "\r"
+        self._write(newline.join(lines + self._format(payload, frames)) + newline)
+        if self._wait(listen):
+            return self._stopped()
+        self._write(newline + ">")
+        return None
+
+    def _stopped(self):
+        newline = "\r\n" if self.linefeeds else "\r"
+        self._write("STOPPED" + newline + newline + ">")
+        return None
+
+    def _response_time(self, frame_count):
+        latency = self.latency
+        if self.jitter:
+            latency += self.rng.uniform(-self.jitter, self.jitter)
+        # about 130 bits per 8-byte CAN frame including stuffing
+        bitrate = self.bus_bitrate or PROTOCOLS[self.profile.protocol][2]
+        bus = frame_count * 130 / bitrate
+        # the adapter keeps listening for more ECUs after the last frame
+        listen = self.timeout * 0.004096
+        if self.adaptive:
+            listen = min(listen, max(0.004, latency * 1.5))
+        return max(0.0, latency) + bus, listen
+
+    def _respond(self, request):
+        mode = request[0]
+        pids = request[1:]
+        profile = self.profile
+        t = time.monotonic() - self._started
+
+        if mode in (0x03, 0x07, 0x0A):
+            codes = profile.dtcs if mode == 0x03 else profile.pending_dtcs
+            if mode == 0x0A:
+                codes = []
+            data = b"".join(encode_dtc(code) for code in codes)
+            return bytes((0x40 + mode, len(codes))) + data
+
+        if mode == 0x01 and pids:
+            data = b""
+            for pid in pids[:6]:
+                if pid % 0x20 == 0:
+                    bitmap = profile.support_bitmap(1, pid)
+                    if bitmap is not None:
+                        data += bytes((pid,)) + bitmap
+                elif pid in profile.signals:
+                    data += bytes((pid,)) + profile.signals[pid](t, self.rng)
+            return b"\x41" + data if data else None
+
+        if mode == 0x06 and len(pids) == 1:
+            return self._mode06(pids[0], t)
+        if mode == 0x06 and pids:
+            # one MID per request on this ECU; more is a malformed request
+            return bytes((0x7F, 0x06, 0x13))
+
+        if mode == 0x09 and len(pids) == 1:
+            return self._mode09(pids[0])
+        return None
+
+    def _mode06(self, mid, t):
+        profile = self.profile
+        if mid % 0x20 == 0:
+            bitmap = profile.support_bitmap(6, mid)
+            return None if bitmap is None else bytes((0x46, mid)) + bitmap
+        cylinder = mid - 0xA2
+        if not 0 <= cylinder < len(profile.misfire_rates):
+            return None
+        cycle = profile.misfire_rates[cylinder] * t / 60
+        ewma = profile.misfire_rates[cylinder] * 10
+        tests = b""
+        for tid, value in ((MISFIRE_EWMA_TID, ewma), (MISFIRE_CYCLE_TID, cycle)):
+            tests += bytes((mid, tid, UAS_COUNTS)) + _word(value)
+            tests += _word(0) + _word(0xFFFF)
+        return b"\x46" + tests
+
+    def _mode09(self, pid):
+        profile = self.profile
+        if pid == 0x00:
+            return b"\x49\x00" + profile.support_bitmap(9, 0)
+        if pid == 0x02:
+            return b"\x49\x02\x01" + profile.vin.encode()
+        if pid == 0x04 and profile.calibration_ids:
+            items = b"".join(
+                cid.encode().ljust(16, b"\x00") for cid in profile.calibration_ids
+            )
+            return bytes((0x49, 0x04, len(profile.calibration_ids))) + items
+        if pid == 0x06 and profile.cvns:
+            return bytes((0x49, 0x06, len(profile.cvns))) + b"".join(profile.cvns)
+        return None
+
+    def _frames(self, payload):
+        if len(payload) <= 7:
+            return [bytes((len(payload),)) + payload]
+        length = len(payload)
+        frames = [bytes((0x10 | length >> 8, length & 0xFF)) + payload[:6]]
+        for i, start in enumerate(range(6, length, 7)):
+            frames.append(bytes((0x20 | (i + 1) & 0x0F,)) + payload[start:start + 7])
+        return frames
+
+    def _format(self, payload, frames):
+        separator = " " if self.spaces else ""
+
+        def hex_bytes(data):
+            return separator.join(f"{b:02X}" for b in data)
+
+        if self.headers:
+            header = PROTOCOLS[self.profile.protocol][1]
+            if self.spaces and len(header) == 8:
+                header = " ".join(header[i:i + 2] for i in range(0, 8, 2))
+            return [header + separator + hex_bytes(frame) for frame in frames]
+        if len(frames) == 1:
+            return [hex_bytes(payload)]
+        # without headers the adapter prints the length and numbered lines
+        lines = [f"{len(payload):03X}"]
+        for frame in frames:
+            index = 0 if frame[0] >> 4 == 1 else frame[0] & 0x0F
+            data = frame[2:] if index == 0 else frame[1:]
+            lines.append(f"{index:X}:{separator}{hex_bytes(data)}")
+        return lines
+
+
+def benchmark(simulator, seconds):
+    """
+    Runs the broker and polling scheduler against the simulator.
+
+    Args:
+        simulator (ELM327Simulator): A started simulator.
+        seconds (float): How long to poll.
+
+    Returns:
+        dict: Per-channel target and achieved rates from the scheduler.
+    """
+    from datastreams.discovery import discover_supported
+    from datastreams.scheduler import DEFAULT_RATES, PollingScheduler
+    from utils.obd_broker import OBDBroker
+
+    broker = OBDBroker(simulator.port, 38400).start()
+    try:
+        client = broker.client()
+        sensors = discover_supported(client, list(DEFAULT_RATES))
+        scheduler = PollingScheduler.for_connection(client, sensors)
+        scheduler.prime()
+        requests = simulator.requests
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            scheduler.poll_once()
+            time.sleep(scheduler.time_to_next())
+        print(
+            f"{simulator.requests - requests} requests in {seconds:.0f} s, "
+            f"link utilization {scheduler.utilization:.0%}"
+        )
+        return scheduler.stats()
+    finally:
+        broker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate an ELM327 on a pty")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="air_fuel")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="ECU response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="maximum deviation from the latency in seconds")
+    parser.add_argument("--bus-bitrate", type=int, default=None,
+                        help="CAN bit rate, defaults to the protocol's")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="probability of an injected error per request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--benchmark", type=float, default=0,
+                        help="poll the simulator for this many seconds and exit")
+    args = parser.parse_args()
+
+    simulator = ELM327Simulator(
+        PROFILES[args.profile],
+        latency=args.latency,
+        jitter=args.jitter,
+        bus_bitrate=args.bus_bitrate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    ).start()
+    print(f"ELM327 simulator ({args.profile}) on {simulator.port}")
+    try:
+        if args.benchmark:
+            for name, stats in benchmark(simulator, args.benchmark).items():
+                print(f"{name}: {stats['achieved']} of {stats['target']} Hz")
+            return
+        print("Set SERIAL_PORT to this path. Press Ctrl+C to stop.")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+This module provides a prompt-aware transport for ELM327 adapters.
+
+The ELM327 terminates every response with a ``>`` prompt rather than a
+newline, so reading a response line by line either returns a partial answer
+or waits for the serial timeout. The transport owns the serial port from a
+dedicated I/O thread, frames responses on the prompt, and hands them back
+through futures so callers can block or ``await`` with a per-command deadline.
+"""
+import asyncio
+import concurrent.futures
+import queue
+import re
+import threading
+import time
+
+import serial
+
+from utils.traffic_capture import (
+    REPLAY_SCHEME,
+    CaptureWriter,
+    CapturingSerial,
+    ReplaySerial,
+)
+
+ELM_PROMPT = b">"
+
+# Seconds to wait for the prompt after a command has been written.
+DEFAULT_DEADLINE = 5.0
+
+# Seconds to wait for the adapter to acknowledge an interrupted command.
+RESYNC_DEADLINE = 1.0
+
+# Responses the adapter prints instead of data.
+ELM_ERRORS = (
+    "NO DATA",
+    "CAN ERROR",
+    "BUS INIT",
+    "BUS BUSY",
+    "BUS ERROR",
+    "UNABLE TO CONNECT",
+    "STOPPED",
+    "BUFFER FULL",
+    "DATA ERROR",
+    "FB ERROR",
+    "LV RESET",
+    "ACT ALERT",
+    "ERROR",
+    "?",
+)
+
+
+class TransportError(Exception):
+    """
+    Raised when the adapter cannot be reached or the port fails.
+    """
+
+
+class TransportTimeout(TransportError):
+    """
+    Raised when the adapter does not return a prompt before the deadline.
+    """
+
+
+class ELM327Response:
+    """
+    A complete, prompt-framed response from the adapter.
+
+    Attributes:
+        command (str): The command that produced the response.
+        lines (list): Non-empty response lines with echo and status lines removed.
+        raw (bytes): The bytes received before the prompt.
+        elapsed (float): Seconds between writing the command and the prompt.
+        first_byte (float): Seconds between writing the command and the first
+            byte of the response, None if unknown.
+    """
+
+    __slots__ = ("command", "lines", "raw", "elapsed", "first_byte")
+
+    def __init__(self, command, lines, raw, elapsed, first_byte=None):
+        self.command = command
+        self.lines = lines
+        self.raw = raw
+        self.elapsed = elapsed
+        self.first_byte = first_byte
+
+    @property
+    def text(self):
+        """
+        str: The response lines joined with newlines.
+        """
+        return "\n".join(self.lines)
+
+    @property
+    def error(self):
+        """
+        str: The adapter error message, or None when the response holds data.
+        """
+        for line in self.lines:
+            for error in ELM_ERRORS:
+                if line.startswith(error):
+                    return line
+        return None
+
+    def by_header(self, header_length=3):
+        """
+        Groups the response lines by the ECU header that sent them.
+
+        Only meaningful when headers are enabled (``ATH1``). Works with or
+        without spaces between bytes.
+
+        Args:
+            header_length (int): Number of hex digits in the header, 3 for
+                11-bit CAN and 8 for 29-bit CAN.
+
+        Returns:
+            dict: Header string mapped to the list of lines it sent.
+        """
+        ecus = {}
+        for line in self.lines:
+            compact = line.replace(" ", "")
+            ecus.setdefault(compact[:header_length], []).append(line)
+        return ecus
+
+    def __repr__(self):
+        return f"ELM327Response({self.command!r}, {self.lines!r}, {self.elapsed:.3f}s)"
+
+
+def split_response(command, raw):
+    """
+    Splits the raw bytes of one response into clean lines.
+
+    Args:
+        command (str): The command that was sent, used to drop its echo.
+        raw (bytes): The bytes received before the prompt.
+
+    Returns:
+        list: Response lines without echo, ``SEARCHING...`` or blank lines.
+    """
+    text = raw.replace(b"\x00", b"").decode("ascii", "ignore")
+    echo = command.replace(" ", "").upper()
+    lines = []
+    for line in re.split("[\r\n]", text):
+        line = line.strip()
+        if not line or line.startswith("SEARCHING"):
+            continue
+        if line.replace(" ", "").upper() == echo:
+            continue
+        lines.append(line)
+    return lines
+
+
+class _Request:
+    __slots__ = ("command", "deadline", "future", "handler")
+
+    def __init__(self, command, deadline, handler=None):
+        self.command = command
+        self.deadline = deadline
+        self.handler = handler
+        self.future = concurrent.futures.Future()
+
+
+class ELM327Transport:
+    """
+    Serializes commands to an ELM327 adapter from a dedicated I/O thread.
+
+    Commands are queued and written one at a time; each response is framed
+    on the ``>`` prompt. A command that misses its deadline is interrupted so
+    the adapter is back at the prompt before the next command is written.
+
+    Example:
+        with ELM327Transport("/dev/ttyUSB0", 38400) as transport:
+            response = transport.query_sync("010C")
+            response = await transport.query("0105", deadline=0.5)
+    """
+
+    def __init__(self, port, baudrate, deadline=DEFAULT_DEADLINE, serial_port=None,
+                 capture_path=None):
+        """
+        Args:
+            port (str): Serial port name, pyserial URL, or
+                ``replay://<capture>?speed=<factor>`` to replay a capture.
+            baudrate (int): UART baud rate.
+            deadline (float): Default per-command deadline in seconds.
+            serial_port: An already opened pyserial-compatible object to use
+                instead of opening ``port``.
+            capture_path (str): Record all traffic to this capture file.
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.deadline = deadline
+        self.capture_path = capture_path
+        self._serial = serial_port
+        self._first_data = None
+        self._requests = queue.Queue()
+        self._thread = None
+        self._running = False
+
+    def open(self):
+        """
+        Opens the serial port and starts the I/O thread.
+
+        Raises:
+            TransportError: If the port cannot be opened.
+        """
+        if self._running:
+            return
+        if self._serial is None:
+            try:
+                if self.port.startswith(REPLAY_SCHEME):
+                    self._serial = ReplaySerial.from_url(self.port)
+                else:
+                    self._serial = serial.serial_for_url(
+                        self.port, baudrate=self.baudrate, timeout=0.05
+                    )
+            except (serial.SerialException, OSError, ValueError) as e:
+                raise TransportError(f"Cannot open {self.port}: {e}") from e
+        if self.capture_path:
+            self._serial = CapturingSerial(
+                self._serial, CaptureWriter(self.capture_path, self.baudrate)
+            )
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="elm327-transport", daemon=True
+        )
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops the I/O thread, fails pending commands and closes the port.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._requests.put(None)
+        self._thread.join()
+        self._thread = None
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.future.set_exception(TransportError("Transport closed"))
+        self._serial.close()
+        self._serial = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def is_open(self):
+        """
+        bool: True while the I/O thread is running.
+        """
+        return self._running
+
+    def submit(self, command, deadline=None):
+        """
+        Queues a command without waiting for its response.
+
+        Args:
+            command (str): The AT or OBD command, without terminator.
+            deadline (float): Seconds to wait for the prompt once written.
+
+        Returns:
+            concurrent.futures.Future: Resolves to an ELM327Response, or
+            raises TransportTimeout or TransportError.
+        """
+        if not self._running:
+            raise TransportError("Transport is not open")
+        request = _Request(command, self.deadline if deadline is None else deadline)
+        self._requests.put(request)
+        return request.future
+
+    def run_exclusive(self, handler):
+        """
+        Runs ``handler(serial_port)`` on the I/O thread between two commands.
+
+        Used for exchanges that do not follow the command/prompt pattern,
+        such as baud rate handshakes. The adapter must be back at the prompt
+        when the handler returns.
+
+        Args:
+            handler (callable): Called with the open pyserial port.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the handler's return value.
+        """
+        if not self._running:
+            raise TransportError("Transport is not open")
+        request = _Request(None, None, handler)
+        self._requests.put(request)
+        return request.future
+
+    def read_until_prompt(self, deadline):
+        """
+        Reads from the port until the prompt. Only for use inside a
+        ``run_exclusive`` handler.
+
+        Args:
+            deadline (float): ``time.monotonic()`` value to give up at.
+
+        Returns:
+            bytearray: The bytes before the prompt, or None on timeout.
+        """
+        return self._read_until_prompt(deadline)
+
+    def query_sync(self, command, deadline=None):
+        """
+        Sends a command and blocks until its response arrives.
+
+        Args:
+            command (str): The AT or OBD command, without terminator.
+            deadline (float): Seconds to wait for the prompt once written.
+
+        Returns:
+            ELM327Response: The framed response.
+        """
+        return self.submit(command, deadline).result()
+
+    async def query(self, command, deadline=None):
+        """
+        Sends a command and awaits its response.
+
+        Args:
+            command (str): The AT or OBD command, without terminator.
+            deadline (float): Seconds to wait for the prompt once written.
+
+        Returns:
+            ELM327Response: The framed response.
+        """
+        return await asyncio.wrap_future(self.submit(command, deadline))
+
+    def _run(self):
+        while self._running:
+            request = self._requests.get()
+            if request is None:
+                break
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            try:
+                if request.handler is not None:
+                    request.future.set_result(request.handler(self._serial))
+                else:
+                    request.future.set_result(self._exchange(request))
+            except TransportError as e:
+                request.future.set_exception(e)
+            except (serial.SerialException, OSError) as e:
+                request.future.set_exception(TransportError(str(e)))
+            except Exception as e:
+                # a failing handler must not take the I/O thread down with it
+                request.future.set_exception(e)
+
+    def _exchange(self, request):
+        self._serial.reset_input_buffer()
+        self._serial.write(request.command.encode() + b"\r")
+        self._serial.flush()
+        started = time.monotonic()
+        raw = self._read_until_prompt(started + request.deadline)
+        if raw is None:
+            self._resync()
+            raise TransportTimeout(
+                f"{request.command!r} timed out after {request.deadline}s"
+            )
+        return ELM327Response(
+            request.command,
+            split_response(request.command, raw),
+            bytes(raw),
+            time.monotonic() - started,
+            self._first_data - started,
+        )
+
+    def _read_until_prompt(self, deadline):
+        buffer = bytearray()
+        self._first_data = None
+        while time.monotonic() < deadline:
+            data = self._serial.read(self._serial.in_waiting or 1)
+            if not data:
+                continue
+            if not buffer:
+                self._first_data = time.monotonic()
+            buffer += data
+            end = buffer.find(ELM_PROMPT)
+            if end >= 0:
+                del buffer[end:]
+                return buffer
+        return None
+
+    def _resync(self):
+        # Any character aborts the command in progress; the adapter answers
+        # with STOPPED and a fresh prompt.
+        self._serial.write(b"\r")
+        self._serial.flush()
+        self._read_until_prompt(time.monotonic() + RESYNC_DEADLINE)
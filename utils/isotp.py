@@ -0,0 +1,304 @@
+"""
+This module reassembles ISO 15765-2 (ISO-TP) multi-frame responses.
+
+With headers on, an ELM327 on CAN prints every frame as it arrives, e.g. for
+a VIN::
+
+    7E8 10 14 49 02 01 31 44 34
+    7E8 21 47 50 30 30 52 35 35
+    7E8 22 42 31 32 33 34 35 36
+
+Frames from several ECUs may interleave. ``ISOTPReassembler`` consumes the
+adapter output incrementally, tracks one transfer per ECU header and yields
+each payload as soon as its last consecutive frame arrives. The readers at
+the bottom use it for Mode 09 items and DTC lists, and fall back to the
+python-obd parsers on the legacy (J1850 / ISO 9141 / KWP) protocols.
+"""
+import binascii
+
+from api.nhtsa_functions.vin_decoder import parse_vin_payload
+from utils.elm327_transport import TransportTimeout
+
+# Header length in hex digits for the CAN protocols: 11-bit and 29-bit IDs.
+CAN_HEADER_LENGTHS = {"6": 3, "7": 8, "8": 3, "9": 8, "A": 8, "B": 3, "C": 3}
+
+# Protocol Control Information frame types (high nibble of the PCI byte).
+SINGLE_FRAME = 0x0
+FIRST_FRAME = 0x1
+CONSECUTIVE_FRAME = 0x2
+FLOW_CONTROL = 0x3
+
+# Bytes each item of a multi-item Mode 09 PID occupies.
+CALIBRATION_ID_LENGTH = 16
+CVN_LENGTH = 4
+
+DTC_LETTERS = "PCBU"
+
+
+class _Transfer:
+    __slots__ = ("payload", "filled", "sequence")
+
+    def __init__(self, length):
+        self.payload = bytearray(length)
+        self.filled = 0
+        self.sequence = 0
+
+    def append(self, data):
+        end = min(len(self.payload), self.filled + len(data))
+        self.payload[self.filled:end] = data[:end - self.filled]
+        self.filled = end
+        self.sequence = (self.sequence + 1) & 0x0F
+        return self.filled == len(self.payload)
+
+
+class ISOTPReassembler:
+    """
+    Incrementally reassembles ISO-TP payloads from adapter output.
+
+    Feed the reassembler raw bytes as they are read, in chunks of any size;
+    partial lines are kept in an internal buffer until their terminator
+    arrives. Completed payloads are returned with the header of the ECU that
+    sent them.
+
+    Attributes:
+        errors (int): Frames dropped for a sequence gap or an unexpected
+            consecutive frame.
+    """
+
+    def __init__(self, header_length=3):
+        """
+        Args:
+            header_length (int): Hex digits in the CAN ID, 3 for 11-bit and
+                8 for 29-bit identifiers.
+        """
+        self.header_length = header_length
+        self.errors = 0
+        self._buffer = bytearray()
+        self._transfers = {}
+
+    def feed(self, data):
+        """
+        Consumes adapter output.
+
+        Args:
+            data (bytes): Raw bytes from the adapter, without the prompt.
+
+        Returns:
+            list: ``(header, payload)`` tuples for every payload completed by
+            this chunk, ``payload`` starting at the service byte.
+        """
+        self._buffer += data
+        view = memoryview(self._buffer)
+        completed = []
+        start = 0
+        try:
+            while True:
+                end = self._buffer.find(b"\r", start)
+                if end < 0:
+                    break
+                if self._buffer.find(b" ", start, end) >= 0:
+                    # spaces on (ATS1): compact the line, the one copy made
+                    line = self._buffer[start:end].replace(b" ", b"")
+                    payload = self._frame(line)
+                else:
+                    with view[start:end] as line:
+                        payload = self._frame(line)
+                if payload is not None:
+                    completed.append(payload)
+                start = end + 1
+        finally:
+            view.release()
+        del self._buffer[:start]
+        return completed
+
+    def reset(self):
+        """
+        Drops buffered bytes and every transfer in progress.
+        """
+        self._buffer.clear()
+        self._transfers.clear()
+
+    @property
+    def pending(self):
+        """
+        list: Headers of ECUs with an incomplete transfer.
+        """
+        return list(self._transfers)
+
+    def _frame(self, line):
+        if len(line) <= self.header_length + 2:
+            return None
+        try:
+            header = bytes(line[:self.header_length]).decode("ascii")
+            int(header, 16)
+            data = binascii.unhexlify(line[self.header_length:])
+        except (binascii.Error, ValueError):
+            # status lines such as NO DATA or SEARCHING...
+            return None
+
+        frame_type = data[0] >> 4
+        if frame_type == SINGLE_FRAME:
+            length = data[0] & 0x0F
+            self._transfers.pop(header, None)
+            return header, bytearray(data[1:1 + length])
+
+        if frame_type == FIRST_FRAME:
+            transfer = _Transfer(((data[0] & 0x0F) << 8) | data[1])
+            self._transfers[header] = transfer
+            transfer.append(data[2:])
+            return None
+
+        if frame_type == CONSECUTIVE_FRAME:
+            transfer = self._transfers.get(header)
+            if transfer is None or data[0] & 0x0F != transfer.sequence:
+                self.errors += 1
+                self._transfers.pop(header, None)
+                return None
+            if transfer.append(data[1:]):
+                del self._transfers[header]
+                return header, transfer.payload
+        return None
+
+
+def read_payloads(connection, command, deadline=None):
+    """
+    Sends a request and returns the complete payload from every ECU.
+
+    Args:
+        connection: A broker client or other connection with
+            ``query_sync``, ``send_and_parse`` and ``protocol_id``.
+        command (str): The OBD request, e.g. ``"0902"``.
+        deadline (float): Seconds to wait for the prompt.
+
+    Returns:
+        dict: ECU header mapped to its payload, starting at the service byte.
+        Empty if no ECU answered.
+    """
+    header_length = CAN_HEADER_LENGTHS.get(connection.protocol_id())
+    if header_length is None:
+        return {
+            f"{message.tx_id or 0:02X}": message.data
+            for message in connection.send_and_parse(command)
+        }
+    try:
+        response = connection.query_sync(command, deadline)
+    except TransportTimeout:
+        return {}
+    reassembler = ISOTPReassembler(header_length)
+    return dict(reassembler.feed(response.raw + b"\r"))
+
+
+def split_items(payload, item_length):
+    """
+    Splits a multi-item Mode 09 payload into its items.
+
+    CAN payloads carry an item count after the PID; the legacy parsers
+    already removed the per-frame sequence bytes and have no count.
+
+    Args:
+        payload (bytearray): The payload, starting at the service byte.
+        item_length (int): Bytes per item.
+
+    Returns:
+        list: The items as bytes.
+    """
+    data = payload[2:]
+    if data and data[0] * item_length == len(data) - 1:
+        data = data[1:]
+    return [
+        bytes(data[i:i + item_length])
+        for i in range(0, len(data) - item_length + 1, item_length)
+    ]
+
+
+def decode_dtcs(payload):
+    """
+    Decodes a Mode 03/07/0A payload into trouble codes.
+
+    Args:
+        payload (bytearray): The payload, starting at the service byte.
+
+    Returns:
+        list: Codes such as ``"P0301"``, padding entries removed.
+    """
+    # CAN has a DTC count after the service byte; the legacy parser forges one
+    data = payload[2:]
+    codes = []
+    for i in range(0, len(data) - 1, 2):
+        a, b = data[i], data[i + 1]
+        if a == 0 and b == 0:
+            continue
+        codes.append(f"{DTC_LETTERS[a >> 6]}{(a >> 4) & 0x03}{a & 0x0F:X}{b:02X}")
+    return codes
+
+
+def read_vin(connection):
+    """
+    Reads the VIN.
+
+    Args:
+        connection: See ``read_payloads``.
+
+    Returns:
+        str: The 17-character VIN, or None if no ECU answered.
+    """
+    for payload in read_payloads(connection, "0902").values():
+        vin = parse_vin_payload(payload)
+        if vin:
+            return vin
+    return None
+
+
+def read_calibration_ids(connection):
+    """
+    Reads the calibration IDs (Mode 09 PID 04) of every ECU.
+
+    Args:
+        connection: See ``read_payloads``.
+
+    Returns:
+        dict: ECU header mapped to its list of calibration ID strings.
+    """
+    return {
+        header: [
+            item.replace(b"\x00", b"").decode("ascii", "ignore").strip()
+            for item in split_items(payload, CALIBRATION_ID_LENGTH)
+        ]
+        for header, payload in read_payloads(connection, "0904").items()
+    }
+
+
+def read_cvns(connection):
+    """
+    Reads the calibration verification numbers (Mode 09 PID 06) of every ECU.
+
+    Args:
+        connection: See ``read_payloads``.
+
+    Returns:
+        dict: ECU header mapped to its list of CVNs as hex strings.
+    """
+    return {
+        header: [item.hex().upper() for item in split_items(payload, CVN_LENGTH)]
+        for header, payload in read_payloads(connection, "0906").items()
+    }
+
+
+def read_dtcs(connection, command="03"):
+    """
+    Reads trouble codes from every ECU.
+
+    Args:
+        connection: See ``read_payloads``.
+        command (str): ``"03"`` for stored, ``"07"`` for pending or ``"0A"``
+            for permanent codes.
+
+    Returns:
+        list: The codes of every ECU, without duplicates.
+    """
+    codes = []
+    for payload in read_payloads(connection, command).values():
+        for code in decode_dtcs(payload):
+            if code not in codes:
+                codes.append(code)
+    return codes
@@ -0,0 +1,435 @@
+"""
+This module provides a single owner for the ELM327 adapter.
+
+The broker holds the only transport to the adapter and serializes requests
+from every client through a priority queue, so interactive voice queries are
+sent ahead of background datastream polling. Clients in the same process call
+the broker directly; other processes (the Tk plotters, the Flask dashboards,
+recorders) reach it over a local ``multiprocessing.connection`` socket.
+That socket unpickles what it receives, so it only accepts clients holding
+the broker's private authkey; there is no default key.
+
+Clients expose the parts of the ``obd.OBD`` interface the datastreams use
+(``query``, ``send_and_parse``, ``protocol_id``), plus ``query_sync`` for raw
+commands, so they can replace either an ``obd.OBD`` or a transport.
+"""
+import concurrent.futures
+import itertools
+import logging
+import queue
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from obd.elm327 import ELM327
+from obd.OBDResponse import OBDResponse
+
+from utils.adapter_setup import negotiate_adapter
+from utils.bus_monitor import DEFAULT_CAPACITY, BusMonitor
+from utils.elm327_transport import (
+    ELM327Response,
+    ELM327Transport,
+    TransportError,
+    TransportTimeout,
+)
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are sent first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class _Request:
+    __slots__ = ("command", "deadline", "future")
+
+    def __init__(self, command, deadline, future):
+        self.command = command
+        self.deadline = deadline
+        self.future = future
+
+
+class OBDBroker:
+    """
+    Owns the adapter and runs client requests in priority order.
+
+    A request in flight is never interrupted; preemption happens between
+    commands, which on an ELM327 is at most one response time.
+
+    Example:
+        broker = OBDBroker(SERIAL_PORT, BAUD_RATE).start()
+        broker.serve(("127.0.0.1", OBD_BROKER_PORT), OBD_BROKER_AUTHKEY)
+        client = broker.client(PRIORITY_INTERACTIVE)
+    """
+
+    def __init__(self, port, baudrate, transport=None, raise_baud=True,
+                 capture_path=None):
+        """
+        Args:
+            port (str): Serial port name, pyserial URL or replay URL.
+            baudrate (int): UART baud rate.
+            transport (ELM327Transport): Use this transport instead of
+                opening ``port``.
+            raise_baud (bool): Let adapter negotiation switch to a faster
+                UART baud rate.
+            capture_path (str): Record all adapter traffic to this file.
+        """
+        self.transport = transport or ELM327Transport(
+            port, baudrate, capture_path=capture_path
+        )
+        self.raise_baud = raise_baud
+        self.adapter_report = None
+        self.protocol_id = None
+        self.lines_0100 = []
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker = None
+        self._listener = None
+        self._running = False
+
+    def start(self):
+        """
+        Opens the adapter, initializes it and starts the request worker.
+
+        Returns:
+            OBDBroker: The broker, for chaining.
+        """
+        if self._running:
+            return self
+        if not self.transport.is_open:
+            self.transport.open()
+        self._initialize()
+        self._running = True
+        self._worker = threading.Thread(
+            target=self._run, name="obd-broker", daemon=True
+        )
+        self._worker.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving clients, fails queued requests and closes the adapter.
+        """
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if self._running:
+            self._running = False
+            self._queue.put((float("-inf"), -1, None))
+            self._worker.join()
+        while True:
+            try:
+                _, _, request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.future.set_exception(TransportError("Broker stopped"))
+        self.transport.close()
+
+    def _initialize(self):
+        self.adapter_report = negotiate_adapter(self.transport, self.raise_baud)
+        self.protocol_id = self.adapter_report.protocol_id
+        self.lines_0100 = self.adapter_report.lines_0100
+        print(self.adapter_report)
+
+    def request(self, command, priority=PRIORITY_BACKGROUND, deadline=None):
+        """
+        Queues a raw command.
+
+        Args:
+            command (str): The AT or OBD command, without terminator.
+            priority (int): Queue priority, lower is sooner.
+            deadline (float): Seconds to wait for the prompt once written.
+
+        Returns:
+            concurrent.futures.Future: Resolves to an ELM327Response.
+        """
+        if not self._running:
+            raise TransportError("Broker is not running")
+        future = concurrent.futures.Future()
+        self._queue.put(
+            (priority, next(self._sequence), _Request(command, deadline, future))
+        )
+        return future
+
+    def client(self, priority=PRIORITY_BACKGROUND):
+        """
+        Returns an in-process client.
+
+        Args:
+            priority (int): Priority of every request the client sends.
+
+        Returns:
+            BrokerClient: The client.
+        """
+        return BrokerClient(self.protocol_id, self.lines_0100, priority, broker=self)
+
+    def monitor(self, ids=None, capacity=DEFAULT_CAPACITY):
+        """
+        Creates a passive bus monitor on the broker's adapter.
+
+        Requests queued while the monitor runs are sent once it stops.
+
+        Args:
+            ids (set): Keep only these arbitration IDs; None keeps all.
+            capacity (int): Frames kept in the monitor's ring buffer.
+
+        Returns:
+            BusMonitor: The monitor, not yet started.
+        """
+        is_stn = self.adapter_report is not None and self.adapter_report.is_stn
+        return BusMonitor(self.transport, self.protocol_id, is_stn, ids, capacity)
+
+    def _run(self):
+        while self._running:
+            _, _, request = self._queue.get()
+            if request is None:
+                break
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            try:
+                request.future.set_result(
+                    self.transport.query_sync(request.command, request.deadline)
+                )
+            except TransportError as e:
+                request.future.set_exception(e)
+            except Exception as e:
+                # the worker must outlive any one request, or every caller
+                # after it waits forever
+                logger.exception("Broker request %r failed", request.command)
+                request.future.set_exception(e)
+
+    def serve(self, address, authkey):
+        """
+        Accepts clients from other processes on a local socket.
+
+        Args:
+            address (tuple): ``(host, port)`` to listen on.
+            authkey (bytes): Private key clients must present.
+
+        Raises:
+            ValueError: If no authkey is given.
+        """
+        if not authkey:
+            raise ValueError("The broker needs a private authkey")
+        self._listener = Listener(address, authkey=authkey)
+        threading.Thread(
+            target=self._accept, args=(self._listener,), name="obd-broker-ipc",
+            daemon=True,
+        ).start()
+
+    def _accept(self, listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except AuthenticationError:
+                logger.warning("Rejected a broker client with the wrong authkey")
+                continue
+            except OSError:
+                # the listener was closed by stop()
+                return
+            threading.Thread(
+                target=self._serve_client, args=(connection,), daemon=True
+            ).start()
+
+    def _serve_client(self, connection):
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                op = message[0]
+                if op == "info":
+                    connection.send(("ok", (self.protocol_id, self.lines_0100)))
+                elif op == "query":
+                    command, priority, deadline = message[1:]
+                    try:
+                        response = self.request(command, priority, deadline).result()
+                        connection.send((
+                            "ok",
+                            (response.command, response.lines, response.raw,
+                             response.elapsed, response.first_byte),
+                        ))
+                    except TransportTimeout as e:
+                        connection.send(("timeout", str(e)))
+                    except Exception as e:
+                        connection.send(("error", str(e)))
+                else:
+                    connection.send(("error", f"Unknown operation {op!r}"))
+
+
+class BrokerClient:
+    """
+    A broker client that looks like an ``obd.OBD`` connection.
+
+    Raw commands go through ``query_sync``; ``query`` and ``send_and_parse``
+    decode responses with the python-obd protocol parser for the protocol the
+    broker detected.
+    """
+
+    def __init__(self, protocol_id, lines_0100, priority=PRIORITY_BACKGROUND,
+                 broker=None, connection=None):
+        """
+        Args:
+            protocol_id (str): ELM327 protocol number reported by the broker.
+            lines_0100 (list): The broker's response to ``0100``.
+            priority (int): Priority of every request this client sends.
+            broker (OBDBroker): The broker, for in-process clients.
+            connection: A ``multiprocessing.connection.Connection``, for
+                clients in other processes.
+        """
+        self.priority = priority
+        self._protocol_id = protocol_id
+        self._broker = broker
+        self._connection = connection
+        self._lock = threading.Lock()
+        protocol = ELM327._SUPPORTED_PROTOCOLS.get(protocol_id)
+        self._protocol = protocol(lines_0100) if protocol else None
+
+    @classmethod
+    def connect(cls, address, authkey, priority=PRIORITY_BACKGROUND):
+        """
+        Connects to a broker in another process.
+
+        Args:
+            address (tuple): The broker's ``(host, port)``.
+            authkey (bytes): The broker's private key.
+            priority (int): Priority of every request this client sends.
+
+        Returns:
+            BrokerClient: The connected client.
+        """
+        connection = Client(address, authkey=authkey)
+        connection.send(("info",))
+        _, (protocol_id, lines_0100) = connection.recv()
+        return cls(protocol_id, lines_0100, priority, connection=connection)
+
+    def query_sync(self, command, deadline=None):
+        """
+        Sends a raw command and blocks until its response arrives.
+
+        Args:
+            command (str): The AT or OBD command, without terminator.
+            deadline (float): Seconds to wait for the prompt once written.
+
+        Returns:
+            ELM327Response: The framed response.
+        """
+        if self._broker is not None:
+            return self._broker.request(command, self.priority, deadline).result()
+        with self._lock:
+            self._connection.send(("query", command, self.priority, deadline))
+            status, payload = self._connection.recv()
+        if status == "ok":
+            return ELM327Response(*payload)
+        if status == "timeout":
+            raise TransportTimeout(payload)
+        raise TransportError(payload)
+
+    def parse(self, lines):
+        """
+        Parses response lines into python-obd messages.
+
+        Args:
+            lines (list): Response lines from the adapter.
+
+        Returns:
+            list: Parsed ``Message`` objects, empty if nothing could be parsed.
+        """
+        if self._protocol is None:
+            return []
+        return self._protocol(lines)
+
+    def send_and_parse(self, command):
+        """
+        Sends a raw command and parses the response into messages.
+
+        Args:
+            command (bytes or str): The OBD command.
+
+        Returns:
+            list: Parsed ``Message`` objects, empty on timeout.
+        """
+        if isinstance(command, bytes):
+            command = command.decode()
+        try:
+            return self.parse(self.query_sync(command).lines)
+        except TransportTimeout:
+            return []
+
+    def query(self, cmd):
+        """
+        Sends a python-obd command and decodes its response.
+
+        Args:
+            cmd (obd.OBDCommand): The command.
+
+        Returns:
+            obd.OBDResponse: The decoded response, null if nothing came back.
+        """
+        messages = self.send_and_parse(cmd.command)
+        if not messages:
+            return OBDResponse(cmd, [])
+        return cmd(messages)
+
+    def protocol_id(self):
+        """
+        Returns:
+            str: The ELM327 protocol number the broker detected.
+        """
+        return self._protocol_id
+
+    def is_connected(self):
+        """
+        Returns:
+            bool: True if the client can reach the broker.
+        """
+        if self._broker is not None:
+            return self._broker._running
+        return not self._connection.closed
+
+    def close(self):
+        """
+        Closes the connection to a remote broker. In-process clients share
+        the broker and leave it running.
+        """
+        if self._connection is not None:
+            self._connection.close()
+
+
+def connect_broker(port, baudrate, broker_port, priority=PRIORITY_BACKGROUND,
+                   authkey=None, capture_path=None):
+    """
+    Connects to the running broker, starting one if none is listening.
+
+    Args:
+        port (str): Serial port name, used when a broker must be started.
+        baudrate (int): UART baud rate, used when a broker must be started.
+        broker_port (int): Local TCP port of the broker.
+        priority (int): Priority of every request the client sends.
+        authkey (bytes): The broker's private key.
+        capture_path (str): Traffic capture file, used when a broker must be
+            started.
+
+    Returns:
+        BrokerClient: A client of the shared broker.
+
+    Raises:
+        ValueError: If no authkey is given.
+        TransportError: If the running broker has a different key.
+    """
+    if not authkey:
+        raise ValueError("The broker needs a private authkey")
+    address = ("127.0.0.1", broker_port)
+    try:
+        return BrokerClient.connect(address, authkey, priority)
+    except AuthenticationError:
+        raise TransportError(
+            f"The broker on port {broker_port} has a different authkey; set "
+            "OBD_BROKER_AUTHKEY to the same value for both programs"
+        )
+    except ConnectionRefusedError:
+        broker = OBDBroker(port, baudrate, capture_path=capture_path).start()
+        broker.serve(address, authkey)
+        return broker.client(priority)
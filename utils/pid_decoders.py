@@ -0,0 +1,352 @@
+"""
+This module provides a table-driven decoder registry for SAE J1979 PIDs.
+
+Every numeric Mode 01 PID is described once by its name, data length, units
+and formula over the data bytes ``A B C D``. The formulas are written with
+NumPy operators, so the same table decodes a single live frame or millions of
+recorded frames at once: the hex text is converted to a ``uint8`` matrix with
+a lookup table and each PID's formula runs over whole byte columns.
+
+Mode 02 (freeze frame) responses reuse the Mode 01 table, skipping the frame
+number byte. Mode 09 PIDs are text or hex strings and are decoded per frame.
+"""
+import numpy as np
+
+# Response service byte for each request mode.
+RESPONSE_OFFSET = 0x40
+
+
+class PIDDecoder:
+    """
+    Describes how to decode one PID.
+
+    Attributes:
+        mode (int): Request mode (1 and 2 share the Mode 01 table, or 9).
+        pid (int): Parameter ID.
+        name (str): Command name, matching ``obd.commands`` where it exists.
+        description (str): Human readable description.
+        length (int): Number of data bytes after the PID.
+        units (str): Units of the decoded value.
+        formula (callable): ``formula(a, b, c, d)`` over scalars or arrays,
+            or ``formula(data)`` over the data bytes for string PIDs.
+        kind (str): ``"numeric"`` or ``"string"``.
+    """
+
+    __slots__ = ("mode", "pid", "name", "description", "length", "units",
+                 "formula", "kind")
+
+    def __init__(self, mode, pid, name, description, length, units, formula,
+                 kind="numeric"):
+        self.mode = mode
+        self.pid = pid
+        self.name = name
+        self.description = description
+        self.length = length
+        self.units = units
+        self.formula = formula
+        self.kind = kind
+
+    def decode(self, data):
+        """
+        Decodes the data bytes of one response.
+
+        Args:
+            data (bytes or memoryview): The bytes after the PID (and after the
+                frame number for Mode 02).
+
+        Returns:
+            float or str: The decoded value.
+        """
+        if self.kind == "string":
+            return self.formula(bytes(data))
+        a, b, c, d = (tuple(data[:self.length]) + (0, 0, 0, 0))[:4]
+        return float(self.formula(a, b, c, d))
+
+    def decode_array(self, data):
+        """
+        Decodes many responses at once.
+
+        Args:
+            data (numpy.ndarray): ``(n, length)`` uint8 matrix of data bytes.
+
+        Returns:
+            numpy.ndarray: ``(n,)`` float64 values.
+        """
+        columns = [data[:, i].astype(np.float64) for i in range(self.length)]
+        zeros = np.zeros(len(data))
+        a, b, c, d = (columns + [zeros] * 4)[:4]
+        return np.asarray(self.formula(a, b, c, d), dtype=np.float64)
+
+    def __repr__(self):
+        return f"PIDDecoder({self.mode:02X}{self.pid:02X} {self.name}, {self.units})"
+
+
+def _signed16(a, b):
+    return (a * 256 + b + 32768) % 65536 - 32768
+
+
+def _percent(a, b, c, d):
+    return a * 100 / 255
+
+
+def _centered(a, b, c, d):
+    return a * 100 / 128 - 100
+
+
+def _temperature(a, b, c, d):
+    return a - 40
+
+
+def _word(a, b, c, d):
+    return a * 256 + b
+
+
+def _o2_voltage(a, b, c, d):
+    return a / 200
+
+
+def _wr_voltage(a, b, c, d):
+    return (c * 256 + d) * 8 / 65536
+
+
+def _wr_current(a, b, c, d):
+    return (c * 256 + d) / 256 - 128
+
+
+def _catalyst(a, b, c, d):
+    return (a * 256 + b) / 10 - 40
+
+
+def _ascii(data):
+    return data.replace(b"\x00", b"").decode("ascii", "ignore").strip()
+
+
+def _hex(data):
+    return data.hex().upper()
+
+
+# pid, name, description, data bytes, units, formula
+MODE_01_TABLE = [
+    (0x04, "ENGINE_LOAD", "Calculated Engine Load", 1, "%", _percent),
+    (0x05, "COOLANT_TEMP", "Engine Coolant Temperature", 1, "°C", _temperature),
+    (0x06, "SHORT_FUEL_TRIM_1", "Short Term Fuel Trim - Bank 1", 1, "%", _centered),
+    (0x07, "LONG_FUEL_TRIM_1", "Long Term Fuel Trim - Bank 1", 1, "%", _centered),
+    (0x08, "SHORT_FUEL_TRIM_2", "Short Term Fuel Trim - Bank 2", 1, "%", _centered),
+    (0x09, "LONG_FUEL_TRIM_2", "Long Term Fuel Trim - Bank 2", 1, "%", _centered),
+    (0x0A, "FUEL_PRESSURE", "Fuel Pressure", 1, "kPa",
+     lambda a, b, c, d: a * 3),
+    (0x0B, "INTAKE_PRESSURE", "Intake Manifold Pressure", 1, "kPa",
+     lambda a, b, c, d: a),
+    (0x0C, "RPM", "Engine RPM", 2, "rpm", lambda a, b, c, d: (a * 256 + b) / 4),
+    (0x0D, "SPEED", "Vehicle Speed", 1, "km/h", lambda a, b, c, d: a),
+    (0x0E, "TIMING_ADVANCE", "Timing Advance", 1, "°",
+     lambda a, b, c, d: a / 2 - 64),
+    (0x0F, "INTAKE_TEMP", "Intake Air Temp", 1, "°C", _temperature),
+    (0x10, "MAF", "Air Flow Rate (MAF)", 2, "g/s",
+     lambda a, b, c, d: (a * 256 + b) / 100),
+    (0x11, "THROTTLE_POS", "Throttle Position", 1, "%", _percent),
+    (0x1F, "RUN_TIME", "Engine Run Time", 2, "s", _word),
+    (0x21, "DISTANCE_W_MIL", "Distance Traveled with MIL on", 2, "km", _word),
+    (0x22, "FUEL_RAIL_PRESSURE_VAC", "Fuel Rail Pressure (relative to vacuum)",
+     2, "kPa", lambda a, b, c, d: (a * 256 + b) * 0.079),
+    (0x23, "FUEL_RAIL_PRESSURE_DIRECT", "Fuel Rail Pressure (direct inject)",
+     2, "kPa", lambda a, b, c, d: (a * 256 + b) * 10),
+    (0x2C, "COMMANDED_EGR", "Commanded EGR", 1, "%", _percent),
+    (0x2D, "EGR_ERROR", "EGR Error", 1, "%", _centered),
+    (0x2E, "EVAPORATIVE_PURGE", "Commanded Evaporative Purge", 1, "%", _percent),
+    (0x2F, "FUEL_LEVEL", "Fuel Level Input", 1, "%", _percent),
+    (0x30, "WARMUPS_SINCE_DTC_CLEAR", "Number of warm-ups since codes cleared",
+     1, "count", lambda a, b, c, d: a),
+    (0x31, "DISTANCE_SINCE_DTC_CLEAR", "Distance traveled since codes cleared",
+     2, "km", _word),
+    (0x32, "EVAP_VAPOR_PRESSURE", "Evaporative system vapor pressure", 2, "Pa",
+     lambda a, b, c, d: _signed16(a, b) / 4),
+    (0x33, "BAROMETRIC_PRESSURE", "Barometric Pressure", 1, "kPa",
+     lambda a, b, c, d: a),
+    (0x3C, "CATALYST_TEMP_B1S1", "Catalyst Temperature: Bank 1 - Sensor 1",
+     2, "°C", _catalyst),
+    (0x3D, "CATALYST_TEMP_B2S1", "Catalyst Temperature: Bank 2 - Sensor 1",
+     2, "°C", _catalyst),
+    (0x3E, "CATALYST_TEMP_B1S2", "Catalyst Temperature: Bank 1 - Sensor 2",
+     2, "°C", _catalyst),
+    (0x3F, "CATALYST_TEMP_B2S2", "Catalyst Temperature: Bank 2 - Sensor 2",
+     2, "°C", _catalyst),
+    (0x42, "CONTROL_MODULE_VOLTAGE", "Control module voltage", 2, "V",
+     lambda a, b, c, d: (a * 256 + b) / 1000),
+    (0x43, "ABSOLUTE_LOAD", "Absolute load value", 2, "%",
+     lambda a, b, c, d: (a * 256 + b) * 100 / 255),
+    (0x44, "COMMANDED_EQUIV_RATIO", "Commanded equivalence ratio", 2, "ratio",
+     lambda a, b, c, d: (a * 256 + b) * 2 / 65536),
+    (0x45, "RELATIVE_THROTTLE_POS", "Relative throttle position", 1, "%", _percent),
+    (0x46, "AMBIANT_AIR_TEMP", "Ambient air temperature", 1, "°C", _temperature),
+    (0x47, "THROTTLE_POS_B", "Absolute throttle position B", 1, "%", _percent),
+    (0x48, "THROTTLE_POS_C", "Absolute throttle position C", 1, "%", _percent),
+    (0x49, "ACCELERATOR_POS_D", "Accelerator pedal position D", 1, "%", _percent),
+    (0x4A, "ACCELERATOR_POS_E", "Accelerator pedal position E", 1, "%", _percent),
+    (0x4B, "ACCELERATOR_POS_F", "Accelerator pedal position F", 1, "%", _percent),
+    (0x4C, "THROTTLE_ACTUATOR", "Commanded throttle actuator", 1, "%", _percent),
+    (0x4D, "RUN_TIME_MIL", "Time run with MIL on", 2, "min", _word),
+    (0x4E, "TIME_SINCE_DTC_CLEARED", "Time since trouble codes cleared", 2, "min",
+     _word),
+    (0x52, "ETHANOL_PERCENT", "Ethanol Fuel Percent", 1, "%", _percent),
+    (0x53, "EVAP_VAPOR_PRESSURE_ABS", "Absolute Evap system Vapor Pressure", 2,
+     "kPa", lambda a, b, c, d: (a * 256 + b) / 200),
+    (0x54, "EVAP_VAPOR_PRESSURE_ALT", "Evap system vapor pressure", 2, "Pa",
+     lambda a, b, c, d: _signed16(a, b)),
+    (0x59, "FUEL_RAIL_PRESSURE_ABS", "Fuel rail absolute pressure", 2, "kPa",
+     lambda a, b, c, d: (a * 256 + b) * 10),
+    (0x5A, "RELATIVE_ACCEL_POS", "Relative accelerator pedal position", 1, "%",
+     _percent),
+    (0x5B, "HYBRID_BATTERY_REMAINING", "Hybrid battery pack remaining life", 1,
+     "%", _percent),
+    (0x5C, "OIL_TEMP", "Engine oil temperature", 1, "°C", _temperature),
+    (0x5D, "FUEL_INJECT_TIMING", "Fuel injection timing", 2, "°",
+     lambda a, b, c, d: (a * 256 + b) / 128 - 210),
+    (0x5E, "FUEL_RATE", "Engine fuel rate", 2, "L/h",
+     lambda a, b, c, d: (a * 256 + b) / 20),
+]
+
+for _bank, _sensor, _pid in [(b, s, 0x14 + (b - 1) * 4 + s - 1)
+                             for b in (1, 2) for s in (1, 2, 3, 4)]:
+    MODE_01_TABLE.append((
+        _pid, f"O2_B{_bank}S{_sensor}",
+        f"O2: Bank {_bank} - Sensor {_sensor} Voltage", 2, "V", _o2_voltage,
+    ))
+for _sensor in range(1, 9):
+    MODE_01_TABLE.append((
+        0x23 + _sensor, f"O2_S{_sensor}_WR_VOLTAGE",
+        f"02 Sensor {_sensor} WR Lambda Voltage", 4, "V", _wr_voltage,
+    ))
+    MODE_01_TABLE.append((
+        0x33 + _sensor, f"O2_S{_sensor}_WR_CURRENT",
+        f"02 Sensor {_sensor} WR Lambda Current", 4, "mA", _wr_current,
+    ))
+
+# pid, name, description, data bytes (after the item count), decoder
+MODE_09_TABLE = [
+    (0x02, "VIN", "Vehicle Identification Number", 17, _ascii),
+    (0x04, "CALIBRATION_ID", "Calibration ID", 16, _ascii),
+    (0x06, "CVN", "Calibration Verification Numbers", 4, _hex),
+    (0x0A, "ECU_NAME", "ECU Name", 20, _ascii),
+]
+
+REGISTRY = {}
+for _row in MODE_01_TABLE:
+    REGISTRY[(1, _row[0])] = PIDDecoder(1, *_row)
+for _pid, _name, _description, _length, _decoder in MODE_09_TABLE:
+    REGISTRY[(9, _pid)] = PIDDecoder(
+        9, _pid, _name, _description, _length, "", _decoder, kind="string"
+    )
+
+
+def get_decoder(mode, pid):
+    """
+    Looks up the decoder for a PID.
+
+    Args:
+        mode (int): Request mode; Mode 02 uses the Mode 01 table.
+        pid (int): Parameter ID.
+
+    Returns:
+        PIDDecoder: The decoder, or None if the PID is not registered.
+    """
+    return REGISTRY.get((1 if mode == 2 else mode, pid))
+
+
+def decode_frame(frame):
+    """
+    Decodes one response frame.
+
+    Args:
+        frame (bytes, bytearray or memoryview): The response starting at the
+            service byte, e.g. ``41 0C 1A F8`` or ``49 02 01 <VIN>``.
+
+    Returns:
+        tuple: ``(decoder, value)``, or ``(None, None)`` when the PID is not
+        registered or the frame is too short.
+    """
+    frame = memoryview(frame)
+    if len(frame) < 2:
+        return None, None
+    mode = frame[0] - RESPONSE_OFFSET
+    decoder = get_decoder(mode, frame[1])
+    if decoder is None:
+        return None, None
+    # Mode 02 carries a frame number and Mode 09 an item count before the data
+    start = 3 if mode in (2, 9) else 2
+    data = frame[start:]
+    if decoder.kind == "numeric" and len(data) < decoder.length:
+        return decoder, None
+    return decoder, decoder.decode(data)
+
+
+# ASCII code to nibble value; anything that is not a hex digit maps to 0.
+_HEX_LOOKUP = np.zeros(256, dtype=np.uint8)
+for _i, _char in enumerate(b"0123456789ABCDEF"):
+    _HEX_LOOKUP[_char] = _i
+for _i, _char in enumerate(b"abcdef"):
+    _HEX_LOOKUP[_char] = 10 + _i
+
+
+def hex_to_uint8(lines):
+    """
+    Converts equal-length hex strings into a byte matrix without a Python loop
+    per byte.
+
+    Args:
+        lines (list): Hex strings or bytes without spaces, all the same length.
+
+    Returns:
+        numpy.ndarray: ``(n, length / 2)`` uint8 matrix.
+    """
+    if not lines:
+        return np.empty((0, 0), dtype=np.uint8)
+    joined = b"".join(line.encode() if isinstance(line, str) else line
+                      for line in lines)
+    nibbles = _HEX_LOOKUP[np.frombuffer(joined, dtype=np.uint8)]
+    nibbles = nibbles.reshape(len(lines), -1)
+    return (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+
+def decode_batch(frames):
+    """
+    Decodes a batch of Mode 01 response frames, grouped by PID.
+
+    Args:
+        frames (numpy.ndarray or list): A uint8 matrix with one response per
+            row starting at the service byte, or a list of hex strings
+            (spaces allowed), which are grouped by length first.
+
+    Returns:
+        dict: Command name mapped to ``(rows, values)``, where ``rows`` are the
+        indexes of the frames in the input and ``values`` the decoded floats.
+    """
+    if not isinstance(frames, np.ndarray):
+        lines = [line.replace(" ", "") for line in frames]
+        by_length = {}
+        for row, line in enumerate(lines):
+            by_length.setdefault(len(line), []).append(row)
+        results = {}
+        for rows in by_length.values():
+            matrix = hex_to_uint8([lines[row] for row in rows])
+            for name, (sub_rows, values) in decode_batch(matrix).items():
+                previous = results.get(name)
+                found = np.asarray(rows)[sub_rows]
+                if previous is not None:
+                    found = np.concatenate([previous[0], found])
+                    values = np.concatenate([previous[1], values])
+                results[name] = (found, values)
+        return results
+
+    results = {}
+    if frames.size == 0 or frames.shape[1] < 3:
+        return results
+    valid = frames[:, 0] == RESPONSE_OFFSET + 1
+    for pid in np.unique(frames[valid, 1]):
+        decoder = REGISTRY.get((1, int(pid)))
+        if decoder is None or frames.shape[1] < 2 + decoder.length:
+            continue
+        rows = np.flatnonzero(valid & (frames[:, 1] == pid))
+        values = decoder.decode_array(frames[rows, 2:2 + decoder.length])
+        results[decoder.name] = (rows, values)
+    return results
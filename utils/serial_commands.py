@@ -1,8 +1,13 @@
-import serial
 import requests
-from api.nhtsa_functions.vin_decoder import parse_vin_response, decode_vin, get_vehicle_data_from_nhtsa
+from api.nhtsa_functions.vin_decoder import (
+    decode_vin,
+    get_vehicle_data_from_nhtsa,
+)
 from api.microsoft_functions.graph_api import send_email_with_attachments
 from config import GRAPH_EMAIL_ADDRESS
+from utils.diagnostic_report import ReportPipeline, format_timings, value_of
+from utils.elm327_transport import TransportTimeout
+from utils.isotp import read_calibration_ids, read_cvns, read_dtcs, read_vin
 
 
 def process_data(command, response, value):
@@ -10,32 +15,58 @@ def process_data(command, response, value):
     return formatted_data
 
 
-def send_command(ser, command):
-    ser.write((command + "\r\n").encode())
-    response = ser.readline().decode().strip()
-    response = response.replace("\r", "").replace(">", "")
-    return response
-
-
-def run_diagnostic_report(ser):
-    report_data = []
-
-    # Get VIN
-    vin_response = send_command(ser, "0902")
-    vin = parse_vin_response(vin_response)
-    vehicle_data = get_vehicle_data_from_nhtsa(vin)
-    report_data.append(f"VIN: {vin}")
-    report_data.append(f"Vehicle Data: {vehicle_data}")
-
-    # Get DTCs
-    dtc_response = send_command(ser, "03")
-    report_data.append(f"DTCs: {dtc_response}")
-
-    # Get Freeze Frame Data
-    freeze_frame_response = send_command(ser, "02")
-    report_data.append(f"Freeze Frame Data: {freeze_frame_response}")
-
-    # Add more commands for Mode 6 and Mode 9 data as needed
+def send_command(transport, command, deadline=None):
+    """
+    Sends a command through the ELM327 transport and returns its response.
+
+    Args:
+        transport: An open ELM327Transport or adapter broker client.
+        command (str): The AT or OBD command to send.
+        deadline (float): Seconds to wait for the prompt, or None for the
+            transport default.
+
+    Returns:
+        str: The response lines joined with newlines, or an empty string if
+        the adapter did not answer before the deadline.
+    """
+    try:
+        return transport.query_sync(command, deadline).text
+    except TransportTimeout:
+        return ""
+
+
+def add_adapter_stages(pipeline, transport):
+    """
+    Adds the adapter reads shared by both reports to a pipeline.
+
+    The broker serializes them on the adapter, so they run back to back
+    while HTTP stages run alongside.
+    """
+    pipeline.add("vin", read_vin, args=(transport,))
+    pipeline.add("dtcs", read_dtcs, args=(transport, "03"))
+    pipeline.add("freeze_frame", send_command, args=(transport, "0202"))
+    pipeline.add("pending_dtcs", read_dtcs, args=(transport, "07"))
+    pipeline.add("calibration_ids", read_calibration_ids, args=(transport,))
+    pipeline.add("cvns", read_cvns, args=(transport,))
+    pipeline.add("vehicle", get_vehicle_data_from_nhtsa, depends=("vin",))
+
+
+def run_diagnostic_report(transport):
+    pipeline = ReportPipeline()
+    add_adapter_stages(pipeline, transport)
+    results = pipeline.run()
+
+    dtcs = value_of(results, "dtcs", [])
+    report_data = [
+        f"VIN: {value_of(results, 'vin')}",
+        f"Vehicle Data: {value_of(results, 'vehicle')}",
+        f"DTCs: {', '.join(dtcs) or 'None'}",
+        f"Freeze Frame Data: {value_of(results, 'freeze_frame')}",
+        f"Calibration IDs: {value_of(results, 'calibration_ids')}",
+        f"CVNs: {value_of(results, 'cvns')}",
+        "",
+        format_timings(results, pipeline.elapsed),
+    ]
 
     # Save the report to a text file
     with open("diagnostic_report.txt", "w") as f:
@@ -47,54 +78,60 @@ def run_diagnostic_report(ser):
 
 def get_recall_data(year, make):
     url = f"https://api.nhtsa.gov/products/vehicle/models?modelYear={year}&make={make}&issueType=r"
-    response = requests.get(url)
+    response = requests.get(url, timeout=10)
     return response.json()
 
 
 def get_complaint_data(year, make, model):
     url = f"https://api.nhtsa.gov/complaints/complaintsByVehicle?make={make}&model={model}&modelYear={year}"
-    response = requests.get(url)
+    response = requests.get(url, timeout=10)
     return response.json()
 
 
-def send_diagnostic_report(ser):
-    # Send the commands to the ELM327 device and process the responses
-    vin_response = send_command(ser, "0902")
-    vin = parse_vin_response(vin_response)
-    vehicle_data = get_vehicle_data_from_nhtsa(vin)
-
-    # Get recall and complaint data
-    recall_data = get_recall_data(
-        vehicle_data['Model Year'], vehicle_data['Make'])
-    complaint_data = get_complaint_data(
-        vehicle_data['Model Year'], vehicle_data['Make'], vehicle_data['Model'])
-
-    trouble_codes_response = send_command(ser, "03")
-
-    freeze_frame_data_response = send_command(ser, "0202")
-
-    pending_trouble_codes_response = send_command(ser, "07")
+def send_diagnostic_report(transport):
+    # Adapter reads run while the VIN decode and NHTSA lookups are in flight
+    pipeline = ReportPipeline()
+    add_adapter_stages(pipeline, transport)
+    pipeline.add(
+        "recalls",
+        lambda vehicle: get_recall_data(vehicle['Model Year'], vehicle['Make']),
+        depends=("vehicle",),
+    )
+    pipeline.add(
+        "complaints",
+        lambda vehicle: get_complaint_data(
+            vehicle['Model Year'], vehicle['Make'], vehicle['Model']),
+        depends=("vehicle",),
+    )
+    results = pipeline.run()
+    print(format_timings(results, pipeline.elapsed))
 
-    calibration_ids_response = send_command(ser, "0904")
+    vehicle_data = value_of(results, "vehicle") or {}
+    recall_data = value_of(results, "recalls", {})
+    complaint_data = value_of(results, "complaints", {})
+    trouble_codes = value_of(results, "dtcs", [])
+    pending_trouble_codes = value_of(results, "pending_dtcs", [])
 
     # Extract relevant recall and complaint information
-    recalls = [recall['model'] for recall in recall_data['results']
-               if recall['model'].lower() == vehicle_data['Model'].lower()]
+    model = vehicle_data.get('Model') or ''
+    recalls = [recall['model'] for recall in recall_data.get('results', [])
+               if recall['model'].lower() == model.lower()]
     complaints = [complaint['summary']
                   for complaint in complaint_data['results']] if 'results' in complaint_data else []
 
     # Combine the data into a single string with proper formatting
     diagnostic_data = (
-        f"VIN: {vin}\n"
-        f"Model Year: {vehicle_data['Model Year']}\n"
-        f"Make: {vehicle_data['Make']}\n"
-        f"Model: {vehicle_data['Model']}\n"
-        f"Trim Level: {vehicle_data['Trim Level']}\n"
-        f"Engine Displacement (L): {vehicle_data['Engine Displacement (L)']}\n"
-        f"Trouble Codes: {trouble_codes_response}\n"
-        f"Freeze Frame Data: {freeze_frame_data_response}\n"
-        f"Pending Trouble Codes: {pending_trouble_codes_response}\n"
-        f"Calibration IDs: {calibration_ids_response}\n"
+        f"VIN: {value_of(results, 'vin')}\n"
+        f"Model Year: {vehicle_data.get('Model Year', 'Unknown')}\n"
+        f"Make: {vehicle_data.get('Make', 'Unknown')}\n"
+        f"Model: {vehicle_data.get('Model', 'Unknown')}\n"
+        f"Trim Level: {vehicle_data.get('Trim Level', 'Unknown')}\n"
+        "Engine Displacement (L): "
+        f"{vehicle_data.get('Engine Displacement (L)', 'Unknown')}\n"
+        f"Trouble Codes: {', '.join(trouble_codes) or 'None'}\n"
+        f"Freeze Frame Data: {value_of(results, 'freeze_frame')}\n"
+        f"Pending Trouble Codes: {', '.join(pending_trouble_codes) or 'None'}\n"
+        f"Calibration IDs: {value_of(results, 'calibration_ids')}\n"
         f"Recalls: {len(recalls)}\n"
         f"{'-'*20}\n"
         f"Complaints: {len(complaints)}\n"
@@ -104,6 +141,8 @@ def send_diagnostic_report(ser):
     for i, complaint in enumerate(complaints):
         diagnostic_data += f"Complaint {i+1}: {complaint}\n\n"
 
+    diagnostic_data += f"\n{format_timings(results, pipeline.elapsed)}\n"
+
     # Send the email
     to_email = GRAPH_EMAIL_ADDRESS
     subject = "Diagnostic Report"
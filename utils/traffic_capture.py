@@ -0,0 +1,393 @@
+"""
+This module records adapter traffic and replays it.
+
+A capture is a compact binary log of every byte written to and read from the
+adapter, each chunk stamped with the time since the previous one. Captures
+are taken at the transport, so voice commands and datastreams are recorded
+alike; set ``OBD_CAPTURE_FILE`` to enable it.
+
+``ReplaySerial`` stands in for the serial port and answers every command with
+the bytes the adapter sent when it was recorded, at the recorded pace, N
+times faster, or as fast as possible. Pointing ``SERIAL_PORT`` at
+``replay://<capture>?speed=10`` replays a capture through the unchanged
+application.
+
+File layout:
+    header: magic ``ELMCAP1\\n``, float64 start time (epoch), uint32 baud rate
+    record: uint32 microseconds since the previous record, uint8 direction,
+            uint16 length, data
+
+Usage:
+    python -m utils.traffic_capture info capture.elmcap
+    python -m utils.traffic_capture benchmark capture.elmcap --speed 0
+"""
+import argparse
+import collections
+import contextlib
+import io
+import struct
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+MAGIC = b"ELMCAP1\n"
+HEADER = struct.Struct("<8sdI")
+RECORD = struct.Struct("<IBH")
+
+# Record directions.
+HOST = 0
+ADAPTER = 1
+
+REPLAY_SCHEME = "replay://"
+
+# Answer given for a command the capture does not contain.
+UNKNOWN_COMMAND = b"?\r\r>"
+
+# Settings whose argument is derived from timing and differs between runs.
+TIMED_SETTINGS = (b"ATST", b"ATBRD", b"STBR")
+
+# OBD modes whose requests may name different PIDs between runs.
+POLLED_MODES = (b"01", b"06", b"09")
+
+
+class CaptureWriter:
+    """
+    Appends timestamped traffic records to a capture file.
+    """
+
+    def __init__(self, path, baudrate):
+        """
+        Args:
+            path (str): Capture file to create.
+            baudrate (int): UART baud rate, stored in the header.
+        """
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, time.time(), baudrate))
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+
+    def record(self, direction, data):
+        """
+        Appends one chunk of traffic.
+
+        Args:
+            direction (int): ``HOST`` for written bytes, ``ADAPTER`` for read.
+            data (bytes): The bytes, split into 64 KiB records if longer.
+        """
+        with self._lock:
+            now = time.monotonic()
+            delta = min(0xFFFFFFFF, int((now - self._last) * 1e6))
+            self._last = now
+            for start in range(0, len(data), 0xFFFF):
+                chunk = data[start:start + 0xFFFF]
+                self._file.write(RECORD.pack(delta, direction, len(chunk)))
+                self._file.write(chunk)
+                delta = 0
+            # a capture is most wanted after a crash or a pulled cable
+            self._file.flush()
+
+    def close(self):
+        """
+        Flushes and closes the capture file.
+        """
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """
+    Loads a capture.
+
+    Args:
+        path (str): The capture file.
+
+    Returns:
+        tuple: ``(started, baudrate, records)`` where ``records`` is a list of
+        ``(offset, direction, data)`` with ``offset`` in seconds since the
+        first record.
+
+    Raises:
+        ValueError: If the file is not a capture.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    magic, started, baudrate = HEADER.unpack_from(content)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an adapter capture")
+    records = []
+    offset = 0.0
+    position = HEADER.size
+    view = memoryview(content)
+    while position + RECORD.size <= len(content):
+        delta, direction, length = RECORD.unpack_from(content, position)
+        position += RECORD.size
+        offset += delta / 1e6
+        records.append((offset, direction, bytes(view[position:position + length])))
+        position += length
+    return started, baudrate, records
+
+
+class CapturingSerial:
+    """
+    Wraps a pyserial port and records everything that passes through it.
+    """
+
+    def __init__(self, serial_port, writer):
+        """
+        Args:
+            serial_port: The open pyserial-compatible port.
+            writer (CaptureWriter): Where traffic is recorded.
+        """
+        self._serial = serial_port
+        self._writer = writer
+
+    def read(self, size=1):
+        data = self._serial.read(size)
+        if data:
+            self._writer.record(ADAPTER, data)
+        return data
+
+    def write(self, data):
+        self._writer.record(HOST, data)
+        return self._serial.write(data)
+
+    @property
+    def baudrate(self):
+        return self._serial.baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._serial.baudrate = value
+
+    def close(self):
+        self._serial.close()
+        self._writer.close()
+
+    def __getattr__(self, name):
+        return getattr(self._serial, name)
+
+
+class ReplaySerial:
+    """
+    A pyserial-compatible port that answers from a capture.
+
+    Each write is matched to the next identical host record in the capture
+    and the adapter records that followed it become readable at their
+    recorded offsets, divided by ``speed``. Commands the capture does not
+    contain are answered with ``?`` and counted in ``mismatches``.
+
+    Attributes:
+        mismatches (int): Writes that matched no recorded command.
+    """
+
+    def __init__(self, path, speed=1.0, timeout=0.05):
+        """
+        Args:
+            path (str): The capture file.
+            speed (float): Replay speed factor; 0 replays without delays.
+            timeout (float): Seconds ``read`` waits when nothing is pending.
+        """
+        self.path = path
+        self.speed = speed
+        self.timeout = timeout
+        self.started, self.baudrate, self.records = read_capture(path)
+        self.mismatches = 0
+        self._cursor = 0
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+
+    @classmethod
+    def from_url(cls, url):
+        """
+        Opens ``replay://<path>?speed=<factor>``.
+
+        Args:
+            url (str): The replay URL.
+
+        Returns:
+            ReplaySerial: The port.
+        """
+        parsed = urlparse(url)
+        speed = float(parse_qs(parsed.query).get("speed", ["1"])[0])
+        return cls(parsed.netloc + parsed.path, speed)
+
+    def write(self, data):
+        data = bytes(data)
+        now = time.monotonic()
+        index = self._match(data)
+        if index is None:
+            self.mismatches += 1
+            self._pending.append((now, UNKNOWN_COMMAND))
+            return len(data)
+
+        base = self.records[index][0]
+        index += 1
+        while index < len(self.records) and self.records[index][1] == ADAPTER:
+            offset, _, recorded = self.records[index]
+            delay = (offset - base) / self.speed if self.speed else 0.0
+            self._pending.append((now + delay, recorded))
+            index += 1
+        self._cursor = index
+        return len(data)
+
+    def _match(self, data):
+        for index in range(self._cursor, len(self.records)):
+            if self.records[index][1] == HOST and self.records[index][2] == data:
+                return index
+        # timing-derived settings and polled PIDs differ between runs;
+        # accept the next recorded command with the same name instead
+        name = _command_name(data)
+        for index in range(self._cursor, len(self.records)):
+            if self.records[index][1] == HOST:
+                if name is not None and name == _command_name(self.records[index][2]):
+                    return index
+                return None
+        return None
+
+    @property
+    def position(self):
+        """
+        int: Index of the next record to be matched.
+        """
+        return self._cursor
+
+    def _collect(self):
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            self._buffer += self._pending.popleft()[1]
+
+    @property
+    def in_waiting(self):
+        self._collect()
+        return len(self._buffer)
+
+    def read(self, size=1):
+        self._collect()
+        if not self._buffer:
+            if self._pending:
+                wait = self._pending[0][0] - time.monotonic()
+                time.sleep(max(0.0, min(wait, self.timeout)))
+            else:
+                time.sleep(self.timeout)
+            self._collect()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self._collect()
+        self._buffer.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._pending.clear()
+        self._buffer.clear()
+
+
+def _command_name(command):
+    # the command without its varying argument, None if nothing may vary
+    command = command.strip().replace(b" ", b"").upper()
+    for setting in TIMED_SETTINGS:
+        if command.startswith(setting):
+            return setting
+    if command[:2] in POLLED_MODES:
+        return command[:2]
+    return None
+
+
+def summarize(path):
+    """
+    Summarizes a capture.
+
+    Args:
+        path (str): The capture file.
+
+    Returns:
+        dict: Duration, record and byte counts, and the number of commands.
+    """
+    started, baudrate, records = read_capture(path)
+    sent = [data for _, direction, data in records if direction == HOST]
+    return {
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+        "baudrate": baudrate,
+        "duration": records[-1][0] if records else 0.0,
+        "records": len(records),
+        "bytes_sent": sum(len(data) for data in sent),
+        "bytes_received": sum(
+            len(data) for _, direction, data in records if direction == ADAPTER
+        ),
+        "commands": sum(1 for data in sent if data.strip()),
+    }
+
+
+def benchmark(path, speed=0.0):
+    """
+    Replays a capture through the transport, parsers and PID decoders.
+
+    The broker negotiates the adapter from the capture exactly as it did when
+    it was recorded, then every recorded OBD request is sent again, parsed
+    into messages and decoded.
+
+    Args:
+        path (str): The capture file.
+        speed (float): Replay speed factor; 0 replays without delays.
+
+    Returns:
+        dict: Requests, decoded values, mismatches and throughput.
+    """
+    from utils.elm327_transport import ELM327Transport
+    from utils.obd_broker import OBDBroker
+    from utils.pid_decoders import decode_frame
+
+    port = ReplaySerial(path, speed)
+    transport = ELM327Transport(path, port.baudrate, serial_port=port)
+    broker = OBDBroker(path, port.baudrate, transport=transport)
+    # keep the adapter report out of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        broker.start()
+    client = broker.client()
+
+    commands = []
+    for _, direction, data in port.records[port.position:]:
+        command = data.strip().decode("ascii", "ignore")
+        if direction == HOST and command and command[:2].upper() not in ("AT", "ST"):
+            commands.append(command)
+
+    started = time.monotonic()
+    decoded = 0
+    for command in commands:
+        for message in client.send_and_parse(command):
+            decoder, value = decode_frame(message.data)
+            decoded += value is not None
+    elapsed = time.monotonic() - started
+    broker.stop()
+    return {
+        "requests": len(commands),
+        "decoded": decoded,
+        "mismatches": port.mismatches,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(commands) / elapsed, 1) if elapsed else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a capture")
+    parser.add_argument("action", choices=("info", "benchmark"))
+    parser.add_argument("path", help="capture file")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="replay speed factor, 0 for as fast as possible")
+    args = parser.parse_args()
+
+    if args.action == "info":
+        results = summarize(args.path)
+    else:
+        results = benchmark(args.path, args.speed)
+    for key, value in results.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 """
 This module contains functions to handle voice commands using ELM327.
 """
+import subprocess
 import threading
-import pandas as pd
-import serial
-from config import SERIAL_PORT, BAUD_RATE
-from datastreams.flask_air_fuel_datastream import start_datastream, app
+from config import (
+    SERIAL_PORT,
+    BAUD_RATE,
+    OBD_BROKER_PORT,
+    OBD_BROKER_AUTHKEY,
+    OBD_CAPTURE_FILE,
+)
+from datastreams.web import run_dashboard, stop_datastream, export_datastream
 from voice.voice_recognition import (
     recognize_speech,
     recognize_command,
@@ -13,13 +18,15 @@ from voice.voice_recognition import (
     handle_common_voice_commands,
 )
 from utils.commands import voice_commands, ELM327_COMMANDS
+from utils.obd_broker import OBDBroker, PRIORITY_INTERACTIVE
 from utils.serial_commands import (
     send_command,
     process_data,
     send_diagnostic_report,
-    parse_vin_response,
     decode_vin,
 )
+from utils.pid_decoders import decode_frame
+from api.nhtsa_functions.vin_decoder import vin_from_messages
 from api.openai_functions.gpt_chat import chat_gpt_custom
 
 
@@ -33,11 +40,13 @@ def handle_voice_commands_elm327(user_object_id):
     Returns:
         None
     """
-    ser = serial.Serial(
-        port=SERIAL_PORT,
-        baudrate=BAUD_RATE,
-        timeout=1,
-    )
+    # The broker owns the adapter; datastreams connect to it over local IPC
+    # while voice queries jump ahead of their polling.
+    broker = OBDBroker(
+        SERIAL_PORT, BAUD_RATE, capture_path=OBD_CAPTURE_FILE
+    ).start()
+    broker.serve(("127.0.0.1", OBD_BROKER_PORT), OBD_BROKER_AUTHKEY)
+    obd_client = broker.client(PRIORITY_INTERACTIVE)
     standby_phrases = ["enter standby mode", "go to sleep", "stop listening"]
     wakeup_phrases = ["wake up", "i need your help", "start listening"]
 
@@ -71,55 +80,52 @@ def handle_voice_commands_elm327(user_object_id):
             if cmd == "START_DATA_STREAM":
                 print("Starting data stream...")
                 tts_output("Starting data stream...")
-                datastream_thread = threading.Thread(target=start_datastream)
+                datastream_thread = threading.Thread(
+                    target=run_dashboard, kwargs={"alerts": True}
+                )
                 datastream_thread.daemon = True
                 datastream_thread.start()
 
             elif cmd == "STOP_DATA_STREAM":
                 print("Stopping data stream...")
                 tts_output("Stopping data stream...")
-                with app.test_request_context():
-                    app.do_teardown_request()
+                stop_datastream()
 
             elif cmd == "SAVE_DATA_TO_SPREADSHEET":
                 print("Saving data to spreadsheet...")
                 tts_output("Saving data to spreadsheet...")
-                data = app.view_functions["data"]()
-                df = pd.DataFrame(data["sensor_data"]).T
-                df.columns = [sensor.name for sensor in supported_sensors]
-                df.to_excel("datastream_output.xlsx", index=False)
-                print("Data saved to datastream_output.xlsx")
-                tts_output("Data saved to datastream_output.xlsx")
+                # exported from the recording; the datastream keeps polling
+                if export_datastream("datastream_output.xlsx") is None:
+                    print("Data stream is not running.")
+                    tts_output("Data stream is not running.")
+                else:
+                    print("Data saved to datastream_output.xlsx")
+                    tts_output("Data saved to datastream_output.xlsx")
 
             if cmd and (cmd in ELM327_COMMANDS):
                 if cmd == "send_diagnostic_report":
-                    send_diagnostic_report(ser)
+                    send_diagnostic_report(obd_client)
                     print("Diagnostic report sent to your email.")
                     tts_output("The report has been sent to your email.")
                 else:
-                    response = send_command(ser, cmd)
+                    response = send_command(obd_client, cmd)
                     print(f"Raw response: {response}")
-                    if "NO DATA" not in response:
-                        value = None
-                        if cmd == "0105":
-                            value = int(response.split()[2], 16) - 40
-                            value = (value * 9 / 5) + 32
-                            print(f"Engine Coolant Temperature (F): {value}")
+                    messages = obd_client.parse(response.splitlines())
+                    if messages and "NO DATA" not in response:
+                        decoder, value = decode_frame(messages[0].data)
+                        if decoder is not None and isinstance(value, float):
+                            description = decoder.description
+                            units = decoder.units
+                            if units == "°C":
+                                value = (value * 9 / 5) + 32
+                                units = "°F"
+                            print(f"{description}: {value} {units}")
                             processed_data = (
                                 f"{text}: {response} - "
-                                f"Engine Coolant Temperature (F): {value}"
-                            )
-                        elif cmd == "010C":
-                            value = (
-                                int(response.split()[2], 16) * 256
-                                + int(response.split()[3], 16)
-                            ) / 4
-                            print(f"Engine RPM: {value}")
-                            processed_data = (
-                                f"{text}: {response} - " f"Engine RPM: {value}"
+                                f"{description}: {value} {units}"
                             )
                         elif cmd == "0902":
-                            vin_response = parse_vin_response(response)
+                            vin_response = vin_from_messages(messages)
                             print(f"VIN response: {vin_response}")
                             vehicle_data = decode_vin(vin_response)
                             print(f"Decoded VIN: {vehicle_data}")